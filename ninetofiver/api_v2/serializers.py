@@ -1,17 +1,37 @@
 """925r API v2 serializers."""
 from django.contrib.auth import models as auth_models
+from django.core.exceptions import ValidationError
 from django_countries.serializers import CountryFieldMixin
 from django.utils.translation import gettext_lazy as _
 from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
-from decimal import Decimal
 import dateutil
 import copy
 import datetime
 
-from rest_framework import serializers
+from rest_framework import permissions, serializers
 from ninetofiver import models, settings
+from ninetofiver.holidays import holiday_calendar
+from ninetofiver.request_cache import request_cache
+
+
+def get_requested_fields(request, names):
+    """
+    Filter the given field names down to the ones requested for the response to the given request.
+
+    Read requests can list the fields to include in the fields query parameter and the fields to leave out in the omit
+    query parameter, both comma-separated. Unknown fields are ignored.
+    """
+    if (request is None) or (request.method not in permissions.SAFE_METHODS):
+        return list(names)
+
+    fields = request.query_params.get('fields')
+    fields = set(x.strip() for x in fields.split(',')) if fields else None
+    omit = request.query_params.get('omit')
+    omit = set(x.strip() for x in omit.split(',')) if omit else set()
+
+    return [x for x in names if ((fields is None) or (x in fields)) and (x not in omit)]
 
 
 class BaseSerializer(serializers.ModelSerializer):
@@ -39,6 +59,18 @@ class BaseSerializer(serializers.ModelSerializer):
     def get_display_label(self, obj):
         return str(obj)
 
+    def get_fields(self):
+        fields = super().get_fields()
+
+        # Sparse fieldsets only apply to the top-level objects of a response, not to nested objects
+        if (self.parent is None) or ((self.parent is self.root) and
+                                     isinstance(self.parent, serializers.ListSerializer)):
+            requested = get_requested_fields(self.context.get('request'), fields)
+            for name in [x for x in fields if x not in requested]:
+                fields.pop(name)
+
+        return fields
+
     def populate_validated_data_from_context(self, validated_data):
         pass
 
@@ -55,6 +87,17 @@ class MinimalSerializer(BaseSerializer):
     """Minimal serializer."""
 
     def to_internal_value(self, data):
+        # Related objects can be loaded up front, instead of being queried one by one
+        related_objects = self.context.get('related_objects', {}).get(self.__class__.Meta.model)
+        if related_objects is not None:
+            field = serializers.PrimaryKeyRelatedField(read_only=True)
+            try:
+                return related_objects[int(data)]
+            except KeyError:
+                field.fail('does_not_exist', pk_value=data)
+            except (TypeError, ValueError):
+                field.fail('incorrect_type', data_type=type(data).__name__)
+
         return (serializers.PrimaryKeyRelatedField(queryset=self.__class__.Meta.model.objects.all()).to_internal_value(data))
 
 
@@ -101,7 +144,8 @@ class BasePolymorphicSerializer(serializers.Serializer):
             )
 
         data = serializer(obj, context=self.context).to_representation(obj)
-        data['type'] = type_str
+        if 'type' in data:
+            data['type'] = type_str
 
         return data
 
@@ -299,6 +343,23 @@ class HolidaySerializer(BaseSerializer):
         )
 
 
+class UserOvertimeCheckpointSerializer(BaseSerializer):
+    """User overtime checkpoint serializer."""
+
+    class Meta(BaseSerializer.Meta):
+        model = models.UserOvertimeCheckpoint
+        # Checkpoints are recalculated whenever their data changes, so they are identified by month instead of ID
+        fields = tuple(x for x in BaseSerializer.Meta.fields if x != 'id') + (
+            'year',
+            'month',
+            'overtime_hours',
+            'remaining_hours',
+            'used_overtime_hours',
+            'balance',
+        )
+        read_only_fields = fields
+
+
 class TimesheetSerializer(BasicSerializer):
     """Timesheet serializer."""
 
@@ -428,23 +489,22 @@ class LeaveSerializer(BasicSerializer):
                     employment_contract = models.EmploymentContract.objects.filter(
                         Q(user=leave.user, started_at__lte=current_date) &
                         (Q(ended_at__isnull=True) | Q(ended_at__gte=current_date))
-                    ).first()
+                    ).select_related('company', 'work_schedule').first()
                     work_schedule = employment_contract.work_schedule if employment_contract else None
 
                 # Determine amount of hours to work on this day based on work schedule
                 work_hours = 0.00
                 if work_schedule:
-                    work_hours = float(getattr(work_schedule, current_date.strftime('%A').lower(), Decimal(0.00)))
+                    work_hours = float(work_schedule.weekday_hours[current_date.weekday()])
 
                 # Determine existence of holidays on this day based on work schedule
-                holiday = None
+                holidays = []
                 if employment_contract:
-                    holiday = models.Holiday.objects.filter(date=current_date,
-                                                            country=employment_contract.company.country).first()
+                    holidays = holiday_calendar.get_holidays(employment_contract.company.country, current_date)
 
                 # If we have to work a certain amount of hours on this day, and there is no holiday on that day,
                 # add a leave date pair for that amount of hours
-                if (work_hours > 0.0) and (not holiday):
+                if (work_hours > 0.0) and (not holidays):
                     # Ensure the leave starts when the working day does
                     pair_starts_at = current_dt.replace(hour=settings.DEFAULT_WORKING_DAY_STARTING_HOUR, minute=0,
                                                         second=1)
@@ -633,6 +693,174 @@ class PerformanceSerializer(BasePolymorphicSerializer):
         }
 
 
+class BulkPerformanceSerializer(serializers.ListSerializer):
+    """
+    Serializer to create or update many performances at once.
+
+    Items with an ID update the performance with that ID, other items create a new performance. Related objects and
+    the data used by model validation are loaded for all items at once, and performances are saved with a single
+    insert or update per table. Errors are reported per item.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('child', PerformanceSerializer())
+        super().__init__(*args, **kwargs)
+
+    def get_ids(self, data, key):
+        """Get the IDs given for the given key in the given items."""
+        ids = set()
+        for item in data:
+            try:
+                ids.add(int(item[key]))
+            except (KeyError, TypeError, ValueError):
+                pass
+        return ids
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            items = [x for x in data if isinstance(x, dict)]
+            self.context['related_objects'] = {
+                models.Contract: {x.id: x for x in (models.Contract.objects
+                                                    .filter(id__in=self.get_ids(items, 'contract'))
+                                                    .select_related('customer'))},
+                models.PerformanceType: {x.id: x for x in (models.PerformanceType.objects
+                                                           .filter(id__in=self.get_ids(items, 'performance_type')))},
+                models.ContractRole: {x.id: x for x in (models.ContractRole.objects
+                                                        .filter(id__in=self.get_ids(items, 'contract_role')))},
+            }
+
+        validated_data = super().to_internal_value(data)
+        if not validated_data:
+            return []
+
+        return self.validate_performances(data, validated_data)
+
+    def validate_performances(self, data, validated_data):
+        """Build performances from the validated data and run model validation on them."""
+        user = self.context['request'].user
+        dates = {x['date'] for x in validated_data}
+        contract_ids = {x['contract'].id for x in validated_data if x.get('contract')}
+
+        # Load the performances to update, and get or create the timesheets of all items
+        performances = {x.id: x for x in (models.Performance.objects
+                                          .filter(id__in=self.get_ids(data, 'id'), timesheet__user=user))}
+        months = {(x.year, x.month) for x in dates}
+        timesheets = {(x.year, x.month): x for x in models.Timesheet.objects.filter(
+            Q(user=user) & Q(*[Q(year=year, month=month) for year, month in months], _connector=Q.OR))}
+        for year, month in months:
+            timesheet = timesheets.setdefault((year, month), models.Timesheet(user=user, year=year, month=month))
+            timesheet.user = user
+
+        with request_cache() as cache:
+            # Model validation memoizes the data it queries, so it can be loaded for all items at once
+            role_ids = {x: set() for x in contract_ids}
+            for contract_id, contract_role_id in (models.ContractUser.objects
+                                                  .filter(user=user, contract__in=contract_ids)
+                                                  .values_list('contract', 'contract_role')):
+                role_ids[contract_id].add(contract_role_id)
+            performance_types = {x: [] for x in contract_ids}
+            for contract_performance_type in (models.Contract.performance_types.through.objects
+                                              .filter(contract__in=contract_ids)
+                                              .select_related('performancetype')):
+                performance_types[contract_performance_type.contract_id].append(
+                    contract_performance_type.performancetype)
+            for contract_id in contract_ids:
+                cache.set(('contract_user_contract_role_ids', contract_id, user.id), role_ids[contract_id])
+                cache.set(('contract_performance_types', contract_id), performance_types[contract_id])
+
+            standby_performance_ids = {}
+            for standby_id, contract_id, timesheet_id, date in (models.StandbyPerformance.objects
+                                                                .filter(timesheet__user=user, date__in=dates)
+                                                                .values_list('id', 'contract', 'timesheet', 'date')):
+                standby_performance_ids.setdefault((contract_id, timesheet_id, date), set()).add(standby_id)
+
+            res = []
+            errors = []
+            for i, (item, attrs) in enumerate(zip(data, validated_data)):
+                try:
+                    performance, original_date = self.build_performance(item.get('id'), dict(attrs), performances,
+                                                                        timesheets)
+                    key = ('standby_performance_ids', performance.contract_id, performance.timesheet_id,
+                           performance.date)
+                    if isinstance(performance, models.StandbyPerformance):
+                        cache.set(key, standby_performance_ids.setdefault(key[1:], set()))
+                    performance.perform_additional_validation()
+                except ValidationError as exc:
+                    errors.append(serializers.as_serializer_error(exc))
+                    continue
+
+                # Later items should not duplicate standby performances of earlier items
+                if isinstance(performance, models.StandbyPerformance):
+                    for ids in standby_performance_ids.values():
+                        ids.discard(performance.pk)
+                    standby_performance_ids[key[1:]].add(performance.pk if performance.pk else ('new', i))
+
+                res.append({'performance': performance, 'original_date': original_date})
+                errors.append({})
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        return res
+
+    def build_performance(self, pk, attrs, performances, timesheets):
+        """
+        Build a new performance, or update an existing one, from the given validated data.
+
+        Returns the performance along with the date an existing performance had before, if any.
+        """
+        model = self.child.get_serializer_map()[attrs.pop('type')].Meta.model
+
+        if pk is not None:
+            try:
+                performance = performances[int(pk)]
+            except (KeyError, TypeError, ValueError):
+                raise ValidationError({'id': _('This performance does not exist.')})
+            if performance.__class__ != model:
+                raise ValidationError({'type': _('The type of a performance cannot be changed.')})
+            original_date = performance.date
+        else:
+            performance = model()
+            original_date = None
+
+        for key, value in attrs.items():
+            setattr(performance, key, value)
+        performance.timesheet = timesheets[(performance.date.year, performance.date.month)]
+
+        return performance, original_date
+
+    def create(self, validated_data):
+        from ninetofiver import calculation
+
+        performances = [x['performance'] for x in validated_data]
+        if not performances:
+            return performances
+
+        with transaction.atomic():
+            for timesheet in {x.timesheet for x in performances if not x.timesheet.pk}:
+                timesheet.save()
+
+            now = timezone.now()
+            updated = {}
+            for performance in performances:
+                if performance.pk:
+                    performance.updated_at = now
+                    updated.setdefault(performance.__class__, []).append(performance)
+
+            models.Performance.objects.bulk_create_polymorphic([x for x in performances if not x.pk])
+            for model, model_performances in updated.items():
+                model.objects.bulk_update(model_performances, [
+                    x.name for x in model._meta.concrete_fields
+                    if not x.primary_key and x.name not in ['created_at', 'polymorphic_ctype']])
+
+        # Signals are bypassed, so everything the performance signals would invalidate is invalidated here
+        user_id = self.context['request'].user.id
+        dates = {x.date for x in performances} | {x['original_date'] for x in validated_data if x['original_date']}
+        calculation.invalidate_performance_hours([(user_id, x) for x in dates])
+
+        return performances
+
+
 class AttachmentSerializer(BasicSerializer):
     """Attachment serializer."""
 
@@ -3,11 +3,17 @@ from rest_framework import status
 from rest_framework.test import APITestCase
 from rest_assured import testcases
 from ninetofiver import factories, models
+from ninetofiver.request_cache import request_cache
 from ninetofiver.tests import ModelTestMixin, AuthenticatedAPITestCase
+from django.core.exceptions import ValidationError
+from django.db import connection
 from django.utils import timezone
 from django.shortcuts import reverse
+from django.test.utils import CaptureQueriesContext
+import base64
 import tempfile
 import datetime
+import json
 
 
 class GenericViewTests(AuthenticatedAPITestCase):
@@ -30,6 +36,142 @@ class GenericViewTests(AuthenticatedAPITestCase):
         })
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_range_info_view_streamed(self):
+        """Test streaming range info view."""
+        params = {
+            'from': str(datetime.date.today()),
+            'until': str(datetime.date.today() + datetime.timedelta(days=6)),
+            'daily': 'true',
+            'detailed': 'true',
+            'summary': 'true',
+        }
+        response = self.client.get('/api/v2/range_info/', params)
+        streamed_response = self.client.get('/api/v2/range_info/', dict(params, stream='true'))
+        self.assertEqual(streamed_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(b''.join(streamed_response.streaming_content)), json.loads(response.content))
+
+    def test_range_info_view_entities(self):
+        """Test normalized range info view."""
+        params = {
+            'from': str(datetime.date.today()),
+            'until': str(datetime.date.today() + datetime.timedelta(days=6)),
+            'daily': 'true',
+            'detailed': 'true',
+            'summary': 'true',
+        }
+        response = self.client.get('/api/v2/range_info/', params)
+        normalized_response = self.client.get('/api/v2/range_info/', dict(params, entities='true'))
+        self.assertEqual(normalized_response.status_code, status.HTTP_200_OK)
+
+        data = json.loads(normalized_response.content)
+        entities = data.pop('entities')
+        for day_data in data['details'].values():
+            for entity_type in ['holidays', 'leaves', 'activity_performances', 'standby_performances']:
+                day_data[entity_type] = [entities[entity_type][str(x)] for x in day_data[entity_type]]
+        for performance in data['summary']['performances']:
+            performance['contract'] = entities['contracts'][str(performance['contract'])]
+        self.assertEqual(data, json.loads(response.content))
+
+    def test_overtime_checkpoints_view(self):
+        """Test overtime checkpoints view."""
+        response = self.client.get('/api/v2/overtime_checkpoints/', {
+            'from': '2024-01-01',
+            'until': '2024-03-31',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(x['year'], x['month']) for x in response.data], [(2024, 1), (2024, 2), (2024, 3)])
+
+    def test_conditional_get(self):
+        """Test answering conditional requests for lists and objects."""
+        location = factories.LocationFactory.create()
+        response = self.client.get('/api/v2/locations/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        # Unchanged lists should not be serialized
+        response = self.client.get('/api/v2/locations/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertNotIn('Last-Modified', response)
+
+        # Other filters and changed lists should
+        response = self.client.get('/api/v2/locations/', {'page': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        deleted_location = factories.LocationFactory.create()
+        response = self.client.get('/api/v2/locations/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        response = self.client.get('/api/v2/locations/%s/' % location.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        last_modified = response['Last-Modified']
+        response = self.client.get('/api/v2/locations/%s/' % location.id, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get('/api/v2/locations/%s/' % location.id, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Deleting objects does not advance their last modification, lists should be validated by their ETag only
+        deleted_location_id = deleted_location.id
+        deleted_location.delete()
+        response = self.client.get('/api/v2/locations/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get('/api/v2/locations/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn(deleted_location_id, [x['id'] for x in response.data['results']])
+
+    def test_sparse_fieldsets(self):
+        """Test limiting the fields of lists and objects."""
+        location = factories.LocationFactory.create()
+        response = self.client.get('/api/v2/locations/', {'fields': 'id,name,unknown'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn({'id': location.id, 'name': location.name}, response.data['results'])
+        self.assertEqual(set(key for x in response.data['results'] for key in x), {'id', 'name'})
+
+        response = self.client.get('/api/v2/locations/%s/' % location.id, {'omit': 'type,display_label'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('type', response.data)
+        self.assertNotIn('display_label', response.data)
+        self.assertEqual(response.data['name'], location.name)
+
+    def test_sync_view(self):
+        """Test syncing changes and deletions."""
+        timesheet = factories.OpenTimesheetFactory.create(user=self.user, year=2020, month=1)
+        deleted_timesheet = factories.OpenTimesheetFactory.create(user=self.user, year=2020, month=2)
+        models.Timesheet.objects.update(updated_at=timezone.now() - datetime.timedelta(hours=1))
+
+        response = self.client.get('/api/v2/sync/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['full'])
+        self.assertEqual([x['id'] for x in response.data['timesheets']], [timesheet.id, deleted_timesheet.id])
+        self.assertIsNone(response.data['next']['timesheets'])
+        token = response.data['token']
+
+        # Full syncs are paged per collection
+        response = self.client.get('/api/v2/sync/', {'page_size': 1})
+        self.assertEqual([x['id'] for x in response.data['timesheets']], [timesheet.id])
+        response = self.client.get(response.data['next']['timesheets'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([x['id'] for x in response.data['timesheets']], [deleted_timesheet.id])
+        self.assertEqual(response.data['next'], {'timesheets': None})
+        response = self.client.get('/api/v2/sync/', {'collection': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get('/api/v2/sync/', {'since': token})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['full'])
+        self.assertEqual((response.data['timesheets'], response.data['deleted']), ([], []))
+
+        # Only changed and deleted objects should be returned
+        deleted_timesheet_id = deleted_timesheet.id
+        deleted_timesheet.delete()
+        timesheet.save()
+        response = self.client.get('/api/v2/sync/', {'since': token})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([x['id'] for x in response.data['timesheets']], [timesheet.id])
+        self.assertEqual(response.data['deleted'], [{'type': 'Timesheet', 'id': deleted_timesheet_id}])
+
+        response = self.client.get('/api/v2/sync/', {'since': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_range_availability_view(self):
         """Test range availability view."""
         response = self.client.get('/api/v2/range_availability/', {
@@ -38,6 +180,47 @@ class GenericViewTests(AuthenticatedAPITestCase):
         })
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_range_availability_view_streamed(self):
+        """Test streaming range availability view."""
+        params = {
+            'from': str(datetime.date.today()),
+            'until': str(datetime.date.today() + datetime.timedelta(days=6)),
+        }
+        response = self.client.get('/api/v2/range_availability/', params)
+        streamed_response = self.client.get('/api/v2/range_availability/', dict(params, stream='true'))
+        self.assertEqual(streamed_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(b''.join(streamed_response.streaming_content)), json.loads(response.content))
+
+    def test_range_availability_view_entities(self):
+        """Test normalized range availability view."""
+        params = {
+            'from': str(datetime.date.today()),
+            'until': str(datetime.date.today() + datetime.timedelta(days=6)),
+        }
+        response = self.client.get('/api/v2/range_availability/', params)
+        normalized_response = self.client.get('/api/v2/range_availability/', dict(params, entities='true'))
+        self.assertEqual(normalized_response.status_code, status.HTTP_200_OK)
+
+        data = json.loads(normalized_response.content)
+        entities = data['entities']
+        for user_data in data['users'].values():
+            for day_data in user_data.values():
+                for key, entity_type in [('holidays', 'holidays'), ('leave', 'leave_dates'),
+                                         ('sickness', 'leave_dates'), ('whereabouts', 'whereabouts')]:
+                    day_data[key] = [entities[entity_type][str(x)] for x in day_data[key]]
+        self.assertEqual(data['users'], json.loads(response.content))
+
+    def test_range_availability_view_compact(self):
+        """Test compact range availability view."""
+        response = self.client.get('/api/v2/range_availability/', {
+            'from': str(datetime.date.today()),
+            'until': str(datetime.date.today() + datetime.timedelta(days=6)),
+            'compact': 'true',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['legend'][:2], ['no_work', 'holiday'])
+        self.assertEqual(len(response.data['users'][str(self.user.id)]), len(response.data['legend']))
+
 
 class ApiKeyAuthenticationTests(APITestCase):
     """API key authentication tests."""
@@ -452,3 +635,99 @@ class PerformanceAPITestCase(testcases.ReadWriteRESTAPITestCaseMixin, testcases.
     def _update_check_db(self, obj, data=None, results=None):
         setattr(obj, 'type', 'ActivityPerformance')
         super()._update_check_db(obj, data=data, results=results)
+
+    def test_bulk(self):
+        """Test creating and updating performances in bulk."""
+        def post(data):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/v2/performances/bulk/', data, format='json')
+            # Databases which cannot return the IDs of inserted rows get a performance row inserted per item
+            parent_table = connection.ops.quote_name(models.Performance._meta.db_table)
+            return response, len([x for x in queries if not x['sql'].startswith('INSERT INTO %s' % parent_table)])
+
+        data = [dict(self.get_create_data(), date=datetime.date(2018, 3, day), duration=1) for day in range(1, 3)]
+        response, query_count = post(data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([x['date'] for x in response.data], ['2018-03-01', '2018-03-02'])
+        performance_id = response.data[0]['id']
+        self.assertEqual(models.ActivityPerformance.objects.get(id=performance_id).date, datetime.date(2018, 3, 1))
+
+        # The amount of other queries should not depend on the amount of items
+        data = [dict(self.get_create_data(), date=datetime.date(2018, 3, day), duration=1) for day in range(3, 23)]
+        response, bulk_query_count = post(data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertLessEqual(bulk_query_count, query_count)
+        self.assertEqual(models.ActivityPerformance.objects.filter(timesheet__user=self.user,
+                                                                   date__year=2018).count(), 22)
+
+        # Errors should be reported per item, without saving any item
+        data = [
+            dict(self.get_update_data(), id=performance_id, date=datetime.date(2018, 3, 23), duration=2),
+            dict(self.get_create_data(), contract_role=factories.ContractRoleFactory.create().id),
+        ]
+        response, query_count = post(data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('contract_role', response.data[1])
+
+        # Moving a performance should invalidate the hours of both its old and new date, like its signals would
+        for day in [1, 23]:
+            models.UserDayLedger.objects.create(user=self.user, date=datetime.date(2018, 3, day))
+        response, query_count = post(data[:1])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        performance = models.ActivityPerformance.objects.get(id=performance_id)
+        self.assertEqual((performance.date, performance.duration), (datetime.date(2018, 3, 23), 2))
+        self.assertFalse(models.UserDayLedger.objects.filter(user=self.user).exists())
+
+    def test_bulk_standby(self):
+        """Test rejecting standby performances which duplicate each other."""
+        contract = factories.SupportContractFactory.create(
+            active=True,
+            company=factories.InternalCompanyFactory.create(),
+            customer=factories.CompanyFactory.create()
+        )
+        factories.ContractUserFactory(user=self.user, contract=contract, contract_role=self.contract_role)
+        date = datetime.date(self.timesheet.year, self.timesheet.month, 4)
+
+        item = {'type': 'StandbyPerformance', 'contract': contract.id, 'date': date}
+        response = self.client.post('/api/v2/performances/bulk/', [item, item], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('date', response.data[1])
+
+        # Validation within a request should take standby performances saved earlier in it into account
+        with request_cache():
+            factories.StandbyPerformanceFactory.create(timesheet=self.timesheet, contract=contract, date=date)
+            performance = models.StandbyPerformance(timesheet=self.timesheet, contract=contract, date=date)
+            with self.assertRaises(ValidationError):
+                performance.perform_additional_validation()
+
+    def test_cursor_pagination(self):
+        """Test paging through performances using a cursor."""
+        for day in [5, 3, 3, 7, 1]:
+            factories.ActivityPerformanceFactory.create(
+                timesheet=self.timesheet, performance_type=self.performance_type, contract=self.contract,
+                contract_role=self.contract_role, date=datetime.date(self.timesheet.year, self.timesheet.month, day))
+        expected = list(models.Performance.objects.filter(timesheet__user=self.user)
+                        .order_by('date', 'id').values_list('id', flat=True))
+
+        ids = []
+        url = '/api/v2/performances/?cursor=&page_size=2'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            self.assertFalse([x for x in queries if 'COUNT(*)' in x['sql'].upper()])
+            self.assertLessEqual(len(response.data['results']), 2)
+            ids += [x['id'] for x in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, expected)
+
+        response = self.client.get('/api/v2/performances/?cursor=invalid')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # Cursors holding values which do not fit the ordering fields are invalid as well
+        cursor = base64.b64encode(json.dumps(['x', 'y']).encode('utf-8')).decode('ascii')
+        response = self.client.get('/api/v2/performances/?cursor=%s' % cursor)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
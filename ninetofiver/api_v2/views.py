@@ -1,24 +1,160 @@
 """925r API v2 views."""
+import calendar
 import datetime
+import hashlib
 import logging
 
 import dateutil
+from django.conf import settings
 from django.contrib.auth import models as auth_models
-from django.core.exceptions import ValidationError
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from django.utils.translation import gettext_lazy as _
 from django.shortcuts import get_object_or_404
-from django.db.models import Q, Prefetch
-from rest_framework import mixins, permissions, viewsets, status
+from django.db.models import Count, Max, Q, Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import exceptions, mixins, permissions, viewsets, status
+from rest_framework.decorators import action
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from ninetofiver.api_v2 import serializers, filters
 from ninetofiver import models, feeds, calculation, redmine
+from ninetofiver.availability_cache import availability_cache
 from ninetofiver.views import BaseTimesheetContractPdfExportServiceAPIView
-from ninetofiver.exceptions import InvalidRedmineUserException
+from ninetofiver.exceptions import InvalidRedmineUserException, rest_validation_error_to_dict
+from ninetofiver.pagination import KeysetCursorPagination, OptionalCursorPagination
+from ninetofiver.utils import StreamingJSONObject, iter_json
 
 log = logging.getLogger(__name__)
 
 
+class ConditionalGetMixin(object):
+    """
+    Answer conditional requests for lists and objects before serializing them.
+
+    The ETag and Last-Modified validators are derived from the filtered queryset with a single aggregate query, using
+    the last update and amount of the objects and of the relations in conditional_related, combined with a hash of
+    the request filters. Changes to other related objects are not detected. Deleting objects does not advance the
+    last update, so lists are only validated by their ETag, which includes the amount of objects.
+    """
+
+    conditional_related = ()
+
+    def get_conditional_queryset(self):
+        """Get the filtered queryset the validators are derived from."""
+        queryset = self.filter_queryset(self.get_queryset())
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        if lookup_url_kwarg in self.kwargs:
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+
+        return queryset
+
+    def get_conditional_validators(self, request):
+        """Get the ETag and the last modification timestamp for the request."""
+        aggregates = {}
+        for i, prefix in enumerate([''] + ['%s__' % x for x in self.conditional_related]):
+            aggregates['updated_at_%s' % i] = Max('%supdated_at' % prefix)
+            aggregates['count_%s' % i] = Count('%spk' % prefix, distinct=True)
+        values = self.get_conditional_queryset().order_by().aggregate(**aggregates)
+
+        last_modified = max([x for key, x in values.items() if key.startswith('updated_at_') and x], default=None)
+        timestamp = calendar.timegm(last_modified.utctimetuple()) if last_modified else None
+
+        key = [self.__class__.__name__, self.action, request.user.pk, request.accepted_renderer.format,
+               sorted(self.kwargs.items()), sorted(request.query_params.lists()), sorted(values.items())]
+        etag = quote_etag(hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+
+        return etag, timestamp
+
+    def get_conditional_response(self, request, func, *args, **kwargs):
+        """Answer the request with a 304 response if the client's copy is current, otherwise call func."""
+        etag, timestamp = self.get_conditional_validators(request)
+        if self.action != 'retrieve':
+            timestamp = None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = func(request, *args, **kwargs)
+
+        if response.status_code in [status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED]:
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(request, super().retrieve, *args, **kwargs)
+
+
+class SparseFieldsetMixin(object):
+    """
+    Leave relations and columns which are not requested with the fields and omit parameters out of read queries.
+
+    Selected and prefetched relations are only kept when their field is requested. When only concrete fields are
+    requested, only their columns are loaded, unless the model has subclasses which are loaded separately. The display
+    label can depend on any relation, so the queryset is left as is while it is requested.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.method in permissions.SAFE_METHODS:
+            queryset = self.get_sparse_queryset(queryset)
+        return queryset
+
+    def get_sparse_queryset(self, queryset):
+        """Get the given queryset without the relations and columns which are not requested."""
+        def is_requested(name):
+            return bool(serializers.get_requested_fields(self.request, [name]))
+
+        if is_requested('display_label'):
+            return queryset
+
+        select_related = queryset.query.select_related
+        if isinstance(select_related, dict):
+            def get_paths(related, prefix=''):
+                for name, children in related.items():
+                    yield from (get_paths(children, '%s%s__' % (prefix, name)) if children else [prefix + name])
+
+            paths = list(get_paths({x: y for x, y in select_related.items() if is_requested(x)}))
+            queryset = queryset.select_related(None)
+            if paths:
+                queryset = queryset.select_related(*paths)
+
+        lookups = queryset._prefetch_related_lookups
+        if lookups:
+            queryset = queryset.prefetch_related(None).prefetch_related(
+                *[x for x in lookups if is_requested(getattr(x, 'prefetch_to', x).split('__')[0])])
+
+        model = queryset.model
+        subclasses = [x for x in model.__subclasses__() if not x._meta.abstract]
+        if (not self.request.query_params.get('fields')) or subclasses:
+            return queryset
+
+        columns = ['pk'] + list(getattr(self, 'cursor_ordering', ()))
+        if [x for x in model._meta.concrete_fields if x.name == 'polymorphic_ctype']:
+            columns.append('polymorphic_ctype')
+        for name in self.get_serializer().fields:
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                # Values which are not model fields may need any column
+                if name == 'type':
+                    continue
+                return queryset
+            if field.concrete and not field.many_to_many:
+                columns.append(name)
+
+        return queryset.only(*columns)
+
+
 class MeAPIView(APIView):
     """Get the currently authenticated user."""
 
@@ -30,7 +166,7 @@ class MeAPIView(APIView):
         return Response(data)
 
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class UserViewSet(SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve users."""
 
     permission_classes = (permissions.IsAuthenticated,)
@@ -42,7 +178,7 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
                 .select_related('userinfo'))
 
 
-class LeaveTypeViewSet(viewsets.ReadOnlyModelViewSet):
+class LeaveTypeViewSet(SparseFieldsetMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve leave types."""
 
     permission_classes = (permissions.IsAuthenticated,)
@@ -50,7 +186,7 @@ class LeaveTypeViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = models.LeaveType.objects.all()
 
 
-class ContractRoleViewSet(viewsets.ReadOnlyModelViewSet):
+class ContractRoleViewSet(SparseFieldsetMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve contract roles."""
 
     permission_classes = (permissions.IsAuthenticated,)
@@ -58,7 +194,7 @@ class ContractRoleViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = models.ContractRole.objects.all()
 
 
-class PerformanceTypeViewSet(viewsets.ReadOnlyModelViewSet):
+class PerformanceTypeViewSet(SparseFieldsetMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve performance types."""
 
     permission_classes = (permissions.IsAuthenticated,)
@@ -66,7 +202,7 @@ class PerformanceTypeViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = models.PerformanceType.objects.all()
 
 
-class LocationViewSet(viewsets.ReadOnlyModelViewSet):
+class LocationViewSet(SparseFieldsetMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve locations."""
 
     permission_classes = (permissions.IsAuthenticated,)
@@ -74,7 +210,7 @@ class LocationViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = models.Location.objects.all()
 
 
-class HolidayViewSet(viewsets.ReadOnlyModelViewSet):
+class HolidayViewSet(SparseFieldsetMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve holidays."""
 
     permission_classes = (permissions.IsAuthenticated,)
@@ -83,12 +219,13 @@ class HolidayViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = models.Holiday.objects.all()
 
 
-class ContractViewSet(viewsets.ReadOnlyModelViewSet):
+class ContractViewSet(SparseFieldsetMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve contracts."""
 
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = serializers.ContractSerializer
     filterset_class = filters.ContractFilter
+    conditional_related = ('customer', 'company')
     queryset = (models.Contract.objects.all()
                 .select_related('company', 'customer')
                 .prefetch_related(
@@ -104,12 +241,13 @@ class ContractViewSet(viewsets.ReadOnlyModelViewSet):
         return self.queryset.filter(contractuser__user=self.request.user)
 
 
-class ContractUserViewSet(viewsets.ReadOnlyModelViewSet):
+class ContractUserViewSet(SparseFieldsetMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """List or retrieve contract users."""
 
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = serializers.ContractUserSerializer
     filterset_class = filters.ContractUserFilter
+    conditional_related = ('contract', 'contract_role')
     queryset = (models.ContractUser.objects.all()
                 .select_related('contract', 'contract__customer', 'contract_role', 'user')
                 .distinct())
@@ -118,12 +256,14 @@ class ContractUserViewSet(viewsets.ReadOnlyModelViewSet):
         return self.queryset.filter(user=self.request.user)
 
 
-class TimesheetViewSet(viewsets.ModelViewSet):
+class TimesheetViewSet(SparseFieldsetMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     """CRUD timesheets."""
 
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = serializers.TimesheetSerializer
     filterset_class = filters.TimesheetFilter
+    pagination_class = OptionalCursorPagination
+    cursor_ordering = ('year', 'month', 'id')
     queryset = models.Timesheet.objects.all()
 
     def get_queryset(self):
@@ -135,12 +275,15 @@ class TimesheetViewSet(viewsets.ModelViewSet):
         return super().perform_destroy(instance)
 
 
-class LeaveViewSet(viewsets.ModelViewSet):
+class LeaveViewSet(SparseFieldsetMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     """CRUD leave."""
 
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = serializers.LeaveSerializer
     filterset_class = filters.LeaveFilter
+    pagination_class = OptionalCursorPagination
+    cursor_ordering = ('id',)
+    conditional_related = ('leave_type', 'leavedate')
     queryset = (models.Leave.objects.all()
                 .select_related('leave_type')
                 .prefetch_related('leavedate_set'))
@@ -154,12 +297,15 @@ class LeaveViewSet(viewsets.ModelViewSet):
         return super().perform_destroy(instance)
 
 
-class WhereaboutViewSet(viewsets.ModelViewSet):
+class WhereaboutViewSet(SparseFieldsetMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     """CRUD whereabouts."""
 
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = serializers.WhereaboutSerializer
     filterset_class = filters.WhereaboutFilter
+    pagination_class = OptionalCursorPagination
+    cursor_ordering = ('starts_at', 'id')
+    conditional_related = ('location',)
     queryset = (models.Whereabout.objects.all()
                 .select_related('location'))
 
@@ -167,20 +313,40 @@ class WhereaboutViewSet(viewsets.ModelViewSet):
         return self.queryset.filter(timesheet__user=self.request.user)
 
 
-class PerformanceViewSet(viewsets.ModelViewSet):
+class PerformanceViewSet(SparseFieldsetMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     """CRUD performance."""
 
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = serializers.PerformanceSerializer
     filterset_class = filters.PerformanceFilter
+    pagination_class = OptionalCursorPagination
+    cursor_ordering = ('date', 'id')
+    conditional_related = ('contract',)
     queryset = (models.Performance.objects.all()
                 .select_related('contract', 'contract__customer'))
 
     def get_queryset(self):
         return self.queryset.filter(timesheet__user=self.request.user)
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, format=None):
+        """Create or update many performances at once, reporting errors per item."""
+        serializer = serializers.BulkPerformanceSerializer(data=request.data, context=self.get_serializer_context())
 
-class AttachmentViewSet(viewsets.ModelViewSet):
+        if not serializer.is_valid():
+            errors = serializer.errors
+            if isinstance(errors, list):
+                errors = [rest_validation_error_to_dict(exceptions.ValidationError(x)) if x else {} for x in errors]
+            else:
+                errors = rest_validation_error_to_dict(exceptions.ValidationError(errors))
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        created = any(not x['performance'].pk for x in serializer.validated_data)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+class AttachmentViewSet(SparseFieldsetMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     """CRUD attachments."""
 
     permission_classes = (permissions.IsAuthenticated,)
@@ -298,7 +464,20 @@ class RangeAvailabilityAPIView(APIView):
         users = users if not request.query_params.get('user', None) else \
             users.filter(id__in=list(map(int, request.query_params.get('user', None).split(','))))
 
-        data = calculation.get_availability(users, from_date, until_date, serialize=True)
+        if request.query_params.get('compact', 'false') == 'true':
+            data = calculation.get_compact_availability_info(users, from_date, until_date)
+            return Response(data, status=status.HTTP_200_OK)
+
+        if request.query_params.get('entities', 'false') == 'true':
+            entities = calculation.EntityMap()
+            data = calculation.get_availability(users, from_date, until_date, serialize=True, entities=entities)
+            return Response({'users': data, 'entities': entities.to_dict()}, status=status.HTTP_200_OK)
+
+        if request.query_params.get('stream', 'false') == 'true':
+            data = StreamingJSONObject(calculation.iter_availability(users, from_date, until_date, serialize=True))
+            return StreamingHttpResponse(iter_json(data), content_type='application/json')
+
+        data = availability_cache.get_availability(users, from_date, until_date)
 
         return Response(data, status=status.HTTP_200_OK)
 
@@ -318,13 +497,152 @@ class RangeInfoAPIView(APIView):
         detailed = request.query_params.get('detailed', 'false') == 'true'
         summary = request.query_params.get('summary', 'false') == 'true'
 
-        data = calculation.get_range_info([user], from_date, until_date, daily=daily, detailed=detailed,
-                                          summary=summary, serialize=True)
-        data = data[user.id]
+        if request.query_params.get('entities', 'false') == 'true':
+            entities = calculation.EntityMap()
+            data = calculation.get_range_info([user], from_date, until_date, daily=daily, detailed=detailed,
+                                              summary=summary, serialize=True, entities=entities)
+            data = data[user.id]
+            data['entities'] = entities.to_dict()
+            return Response(data)
+
+        if request.query_params.get('stream', 'false') == 'true':
+            data = dict(calculation.iter_range_info([user], from_date, until_date, daily=daily, detailed=detailed,
+                                                    summary=summary, serialize=True))
+            data = data[user.id]
+            return StreamingHttpResponse(iter_json(data), content_type='application/json')
+
+        # Closed months are served from their timesheet snapshot, unless details are needed
+        data = None
+        if not detailed:
+            data = calculation.get_snapshot_range_info(user, from_date, until_date, daily=daily, summary=summary)
+        if data is None:
+            data = calculation.get_range_info([user], from_date, until_date, daily=daily, detailed=detailed,
+                                              summary=summary, serialize=True)
+            data = data[user.id]
 
         return Response(data)
 
 
+class OvertimeCheckpointsAPIView(APIView):
+    """Get the monthly overtime and running overtime balance of the current user for a given date range."""
+
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, format=None):
+        """Get overtime checkpoints."""
+        from_date = dateutil.parser.parse(request.query_params.get('from', None)).date()
+        until_date = dateutil.parser.parse(request.query_params.get('until', None)).date()
+
+        checkpoints = (calculation.get_overtime_checkpoints(request.user, from_date, until_date)
+                       if until_date >= from_date else [])
+        data = serializers.UserOvertimeCheckpointSerializer(checkpoints, many=True).data
+
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class SyncAPIView(APIView):
+    """
+    Get the timesheets, leave, whereabouts and performances of the current user which changed since a sync token.
+
+    Changed objects are returned in full and deleted objects by type and id, along with a token for the next sync.
+    Without a token, or with a token older than the deletion journal reaches back, all objects are returned and the
+    response is marked as full. Objects changed shortly before the token are returned again, so changes committed
+    after the token was handed out are not missed.
+
+    A full sync returns the first page of every collection, along with a link to the next page of each collection
+    which has more objects. Those pages are requested for a single collection, by its name and a cursor. Objects
+    which change while paging are returned again by the next sync with the token of the first page.
+    """
+
+    permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = KeysetCursorPagination
+    cursor_ordering = ('id',)
+    page_size = 1000
+    margin = datetime.timedelta(minutes=1)
+
+    def get_token(self, timestamp):
+        """Get the sync token for the given timestamp."""
+        return str(int(timestamp.timestamp() * 1000000))
+
+    def parse_token(self, token):
+        """Get the timestamp of the given sync token."""
+        try:
+            return datetime.datetime.fromtimestamp(int(token) / 1000000, tz=datetime.timezone.utc)
+        except (TypeError, ValueError, OverflowError, OSError):
+            raise exceptions.ValidationError({'since': [_('Invalid sync token.')]})
+
+    def get_collections(self, user):
+        """Get the serializer class, queryset and change timestamp fields of every collection, by name."""
+        # Leave dates are part of their leave
+        return {
+            'timesheets': (serializers.TimesheetSerializer, TimesheetViewSet.queryset.filter(user=user),
+                           ['updated_at']),
+            'leave': (serializers.LeaveSerializer, LeaveViewSet.queryset.filter(user=user),
+                      ['updated_at', 'leavedate__updated_at']),
+            'whereabouts': (serializers.WhereaboutSerializer,
+                            WhereaboutViewSet.queryset.filter(timesheet__user=user), ['updated_at']),
+            'performances': (serializers.PerformanceSerializer,
+                             PerformanceViewSet.queryset.filter(timesheet__user=user), ['updated_at']),
+        }
+
+    def get_page(self, request, name, serializer_class, queryset):
+        """Get a page of the given collection, along with a link to its next page, if any."""
+        paginator = self.pagination_class()
+        paginator.page_size = self.page_size
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        next_link = paginator.get_next_link()
+        if next_link:
+            next_link = replace_query_param(next_link, 'collection', name)
+        return serializer_class(page, many=True, context={'request': request}).data, next_link
+
+    def get(self, request, format=None):
+        """Get the changes since the given sync token."""
+        user = request.user
+        now = timezone.now()
+        collections = self.get_collections(user)
+
+        # Further pages of a single collection of a full sync
+        name = request.query_params.get('collection')
+        if name:
+            if name not in collections:
+                raise exceptions.ValidationError({'collection': [_('Invalid collection.')]})
+            serializer_class, queryset, fields = collections[name]
+            page, next_link = self.get_page(request, name, serializer_class, queryset)
+            return Response({name: page, 'next': {name: next_link}}, status=status.HTTP_200_OK)
+
+        since = self.parse_token(request.query_params['since']) if request.query_params.get('since') else None
+        if (since is not None) and (since < now - datetime.timedelta(days=settings.SYNC_DELETION_RETENTION_DAYS)):
+            since = None
+
+        data = {
+            'token': self.get_token(now),
+            'full': since is None,
+        }
+        if since is None:
+            data['next'] = {}
+        for name, (serializer_class, queryset, fields) in collections.items():
+            if since is None:
+                data[name], data['next'][name] = self.get_page(request, name, serializer_class, queryset)
+                continue
+
+            changed = Q()
+            for field in fields:
+                changed |= Q(**{'%s__gte' % field: since - self.margin})
+            queryset = queryset.filter(changed)
+            queryset = queryset.distinct() if len(fields) > 1 else queryset
+            data[name] = serializer_class(queryset.order_by('id'), many=True, context={'request': request}).data
+
+        data['deleted'] = []
+        if since is not None:
+            data['deleted'] = [{'type': object_type, 'id': object_id} for object_type, object_id in
+                               (models.DeletedObject.objects
+                                .filter(user=user, created_at__gte=since - self.margin)
+                                .order_by('id')
+                                .values_list('object_type', 'object_id'))]
+
+        return Response(data, status=status.HTTP_200_OK)
+
+
 class EventsAPIView(APIView):
     """Get events."""
 
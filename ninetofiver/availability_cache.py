@@ -0,0 +1,122 @@
+"""Availability cache."""
+import uuid
+from django.core.cache import cache
+from django.db import transaction
+from ninetofiver.calculation import CalendarContext, iter_user_availability
+from ninetofiver.utils import month_date_range
+
+
+class AvailabilityCache(object):
+    """
+    Serialized availability per user and month, cached in the Django cache.
+
+    Cached months are stored under the version of their user and a shared version. Replacing the version of a user
+    drops the cached months of that user, replacing the shared version drops the cached months of all users.
+    Processes only see versions replaced by other processes through a cache backend they share, such as the database
+    cache used in production. A version dropped from a full cache is replaced as well, which only causes
+    recalculation.
+    """
+
+    VERSION_CACHE_KEY = 'availability_cache_version'
+    USER_VERSION_CACHE_KEY = 'availability_cache_user_version_%s'
+    CACHE_KEY = 'availability_cache_%s_%s_%s_%s_%s'
+    CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+    def get_versions(self, user_ids):
+        """Get the shared version and the versions of the given users, indexed by user ID."""
+        keys = [self.VERSION_CACHE_KEY] + [self.USER_VERSION_CACHE_KEY % user_id for user_id in user_ids]
+        versions = cache.get_many(keys)
+
+        for key in keys:
+            if key not in versions:
+                version = uuid.uuid4().hex
+                if not cache.add(key, version, None):
+                    version = cache.get(key, version)
+                versions[key] = version
+
+        return (versions[self.VERSION_CACHE_KEY],
+                {user_id: versions[self.USER_VERSION_CACHE_KEY % user_id] for user_id in user_ids})
+
+    def get_availability(self, users, from_date, until_date):
+        """
+        Get the serialized availability of the given users, as returned by calculation.get_availability.
+
+        Months which are not cached for the current version of their user are recalculated together and cached.
+        """
+        users = list(users)
+
+        months = []
+        year, month = from_date.year, from_date.month
+        while (year, month) <= (until_date.year, until_date.month):
+            months.append((year, month))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+        version, user_versions = self.get_versions([user.id for user in users])
+        keys = {(user.id, year, month): self.CACHE_KEY % (version, user_versions[user.id], user.id, year, month)
+                for user in users for year, month in months}
+        cached = cache.get_many(list(keys.values()))
+
+        month_data = {}
+        dirty = []
+        for user_month, key in keys.items():
+            if key in cached:
+                month_data[user_month] = cached[key]
+            else:
+                dirty.append(user_month)
+
+        if dirty:
+            month_data.update(self.calculate(users, dirty, keys))
+
+        res = {}
+        for user in users:
+            res[str(user.id)] = user_data = {}
+            for year, month in months:
+                month_from_date, month_until_date = month_date_range(year, month)
+                for day, day_data in enumerate(month_data[(user.id, year, month)]):
+                    date = month_from_date.replace(day=day + 1)
+                    if from_date <= date <= until_date:
+                        user_data[str(date)] = day_data
+
+        return res
+
+    def calculate(self, users, user_months, keys):
+        """Calculate and cache the availability of the given (user ID, year, month) combinations."""
+        user_ids = {user_id for user_id, year, month in user_months}
+        users = [user for user in users if user.id in user_ids]
+        month_ranges = {(year, month): month_date_range(year, month) for user_id, year, month in user_months}
+
+        # A single calendar context covers all months which need to be calculated
+        context = CalendarContext(users, min([x[0] for x in month_ranges.values()]),
+                                  max([x[1] for x in month_ranges.values()]))
+        users = {user.id: user for user in users}
+
+        res = {}
+        for user_id, year, month in user_months:
+            month_from_date, month_until_date = month_ranges[(year, month)]
+            res[(user_id, year, month)] = [day_data for date, day_data in
+                                           iter_user_availability(users[user_id], month_from_date, month_until_date,
+                                                                  context, serialize=True)]
+
+        cache.set_many({keys[user_month]: month_data for user_month, month_data in res.items()}, self.CACHE_TIMEOUT)
+
+        return res
+
+    def invalidate(self, user_ids=None):
+        """
+        Drop the cached months of the given users, or of all users.
+
+        This is repeated once the current transaction is committed, in case another process cached months before that.
+        """
+        user_ids = list(user_ids) if user_ids is not None else None
+        self.replace_versions(user_ids)
+        transaction.on_commit(lambda: self.replace_versions(user_ids))
+
+    def replace_versions(self, user_ids=None):
+        """Replace the versions of the given users, or the shared version."""
+        if user_ids is None:
+            cache.set(self.VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        else:
+            cache.set_many({self.USER_VERSION_CACHE_KEY % user_id: uuid.uuid4().hex for user_id in user_ids}, None)
+
+
+availability_cache = AvailabilityCache()
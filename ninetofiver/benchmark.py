@@ -0,0 +1,137 @@
+"""Calculation benchmarks."""
+import contextlib
+import datetime
+import io
+import random
+import statistics
+import time
+from django.contrib.auth import models as auth_models
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from ninetofiver import calculation
+from ninetofiver.holidays import holiday_calendar
+from ninetofiver.test_db_populator import TestDBPupulator
+
+
+# Sizes passed to the test database populator, as used by the create_test_data command
+SCALES = {
+    'small': (10, 50),
+    'normal': (70, 350),
+    'extensive': (100, 500),
+}
+
+FUNCTIONS = {
+    'get_range_info': lambda users, from_date, until_date: calculation.get_range_info(
+        users, from_date, until_date, daily=True, summary=True, serialize=True),
+    'get_availability': lambda users, from_date, until_date: calculation.get_availability(
+        users, from_date, until_date, serialize=True),
+    'get_availability_info': calculation.get_availability_info,
+    'get_internal_availability_info': calculation.get_internal_availability_info,
+}
+
+
+def populate(scale, seed):
+    """Populate the database with a dataset of the given scale, generated from the given seed."""
+    random.seed(seed)
+    # The populator reports its progress on stdout, which is reserved for the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        TestDBPupulator(*SCALES[scale]).execute()
+
+
+def measure(func, users, from_date, until_date, repeat=3):
+    """Time the given function for the given users and range, returning the durations and the amount of queries."""
+    durations = []
+    queries = 0
+
+    for i in range(repeat):
+        # Every run starts from cold caches
+        holiday_calendar.invalidate()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            func(users, from_date, until_date)
+            durations.append(time.perf_counter() - start)
+        queries = len(captured)
+
+    return durations, queries
+
+
+def run_benchmark(scales=('small',), user_counts=(1, 10), range_lengths=(7, 31, 365), functions=None, repeat=3,
+                  seed=925, from_date=None):
+    """
+    Benchmark calculation functions on generated datasets.
+
+    Every scale is populated from the same seed inside a transaction which is rolled back afterwards. The generated
+    timesheets and leaves are relative to the current month, so ranges start at the first day of the current month
+    by default.
+    """
+    from_date = from_date if from_date is not None else datetime.date.today().replace(day=1)
+    functions = functions if functions is not None else list(FUNCTIONS)
+
+    results = []
+    for scale in scales:
+        with transaction.atomic():
+            populate(scale, seed)
+            active_users = list(auth_models.User.objects.filter(is_active=True).order_by('id'))
+
+            for user_count in user_counts:
+                users = active_users[:user_count]
+                for range_length in range_lengths:
+                    until_date = from_date + datetime.timedelta(days=range_length - 1)
+                    for function in functions:
+                        durations, queries = measure(FUNCTIONS[function], users, from_date, until_date,
+                                                     repeat=repeat)
+                        results.append({
+                            'scale': scale,
+                            'users': len(users),
+                            'days': range_length,
+                            'function': function,
+                            'queries': queries,
+                            'min': min(durations),
+                            'mean': statistics.mean(durations),
+                            'median': statistics.median(durations),
+                        })
+
+            transaction.set_rollback(True)
+
+    return {
+        'seed': seed,
+        'repeat': repeat,
+        'from_date': str(from_date),
+        'results': results,
+    }
+
+
+def get_result_key(result):
+    """Get the key identifying a benchmark result across runs."""
+    return (result['scale'], result['users'], result['days'], result['function'])
+
+
+def compare_results(results, baseline, tolerance=0.25):
+    """
+    Compare benchmark results against baseline results.
+
+    A result regresses when it is slower than its baseline by more than the given fraction, or when it performs more
+    queries. Results without a baseline are skipped.
+    """
+    baseline_results = {get_result_key(result): result for result in baseline['results']}
+
+    res = []
+    for result in results['results']:
+        baseline_result = baseline_results.get(get_result_key(result))
+        if baseline_result is None:
+            continue
+
+        ratio = (result['min'] / baseline_result['min']) if baseline_result['min'] else None
+        res.append({
+            'scale': result['scale'],
+            'users': result['users'],
+            'days': result['days'],
+            'function': result['function'],
+            'ratio': ratio,
+            'queries': result['queries'],
+            'baseline_queries': baseline_result['queries'],
+            'regression': (((ratio is not None) and (ratio > 1 + tolerance)) or
+                           (result['queries'] > baseline_result['queries'])),
+        })
+
+    return res
@@ -1,85 +1,390 @@
 """Calculation."""
-from django.db.models import Q
+import multiprocessing
+from array import array
+from base64 import b64encode
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+from django.contrib.auth import models as auth_models
+from django.db import connections, transaction
+from django.db.models import Count, Min, Q, prefetch_related_objects
+from django.utils.functional import cached_property
 from decimal import Decimal
 from datetime import timedelta
-import copy
 from ninetofiver import models
 from ninetofiver.api_v2 import serializers
-from ninetofiver.utils import AvailabilityInfo
-
-
-def get_availability(users, from_date, until_date, serialize=False):
-    """Determine and return availability."""
+from ninetofiver.holidays import holiday_calendar
+from ninetofiver.request_cache import invalidate_request_cache, memoize
+from ninetofiver.utils import AvailabilityInfo, AvailabilityTags, IntervalIndex, StreamingJSONObject, month_date_range
+
+
+# Weekday hours for days without a work schedule
+NO_WEEKDAY_HOURS = (Decimal('0.00'),) * 7
+
+
+def round_half_even(numerator, denominator):
+    """Divide two integers, rounding half to even as round() does for floats and decimals."""
+    quotient, remainder = divmod(numerator, denominator)
+    if (remainder * 2 > denominator) or ((remainder * 2 == denominator) and (quotient % 2)):
+        quotient += 1
+    return quotient
+
+
+def to_hundredths(hours):
+    """
+    Convert hours to integer hundredths of an hour.
+
+    Hours may be given as an int, float or Decimal, and are rounded to two decimal places as round(hours, 2) would.
+    """
+    numerator, denominator = hours.as_integer_ratio()
+    return round_half_even(numerator * 100, denominator)
+
+
+def from_hundredths(hundredths):
+    """Convert integer hundredths of an hour to hours, as a Decimal with two decimal places."""
+    return Decimal(hundredths).scaleb(-2)
+
+
+class CalendarContext(object):
+    """
+    Calendar data for a set of users over a period.
+
+    Every dataset is loaded lazily, at most once, so a single context can be shared between the availability and
+    range info calculations for the same users and period.
+    """
+
+    def __init__(self, users, from_date, until_date):
+        self.users = users
+        self.from_date = from_date
+        self.until_date = until_date
+
+    @cached_property
+    def sickness_type_ids(self):
+        """Sickness leave type IDs."""
+        return memoize('sickness_leave_type_ids',
+                       lambda: list(models.LeaveType.objects.filter(sickness=True).values_list('id', flat=True)))
+
+    @cached_property
+    def employment_contract_data(self):
+        """Employment contracts for this period, indexed by user ID."""
+        employment_contracts = (models.EmploymentContract.objects
+                                .filter(
+                                    (Q(ended_at__isnull=True) & Q(started_at__lte=self.until_date)) |
+                                    (Q(started_at__lte=self.until_date) & Q(ended_at__gte=self.from_date)),
+                                    user__in=self.users)
+                                .order_by('started_at')
+                                .select_related('user', 'company', 'work_schedule'))
+        employment_contract_data = {}
+        for employment_contract in employment_contracts:
+            (employment_contract_data
+                .setdefault(employment_contract.user.id, [])
+                .append(employment_contract))
+        return employment_contract_data
+
+    @cached_property
+    def contract_user_work_schedule_data(self):
+        """Contract user work schedules for this period, indexed by user ID."""
+        contract_user_work_schedules = (models.ContractUserWorkSchedule.objects
+                                        .filter(contract_user__user__in=self.users)
+                                        .filter(Q(ends_at__isnull=True, starts_at__lte=self.until_date) |
+                                                Q(ends_at__isnull=False, starts_at__lte=self.until_date,
+                                                  ends_at__gte=self.from_date))
+                                        .select_related('contract_user', 'contract_user__user',
+                                                        'contract_user__contract_role', 'contract_user__contract',
+                                                        'contract_user__contract__customer'))
+        contract_user_work_schedule_data = {}
+        for contract_user_work_schedule in contract_user_work_schedules:
+            (contract_user_work_schedule_data
+                .setdefault(contract_user_work_schedule.contract_user.user.id, [])
+                .append(contract_user_work_schedule))
+        return contract_user_work_schedule_data
+
+    @cached_property
+    def leave_date_data(self):
+        """Approved and pending leave dates for this period, indexed by user ID, then by day."""
+        leave_dates = (models.LeaveDate.objects
+                       .filter(leave__user__in=self.users,
+                               leave__status__in=[models.STATUS_PENDING, models.STATUS_APPROVED],
+                               starts_at__date__gte=self.from_date, starts_at__date__lte=self.until_date)
+                       .select_related('leave', 'leave__leave_type', 'leave__user'))
+        leave_date_data = {}
+        for leave_date in leave_dates:
+            (leave_date_data
+                .setdefault(leave_date.leave.user.id, {})
+                .setdefault(leave_date.starts_at.date(), [])
+                .append(leave_date))
+        return leave_date_data
+
+    @cached_property
+    def holiday_data(self):
+        """Holidays for this period in the countries of the employment contracts, indexed by country, then by day."""
+        countries = {employment_contract.company.country
+                     for employment_contracts in self.employment_contract_data.values()
+                     for employment_contract in employment_contracts}
+        return holiday_calendar.get_range(countries, self.from_date, self.until_date)
+
+    @cached_property
+    def whereabout_data(self):
+        """Whereabouts for this period, indexed by user ID, then by day."""
+        whereabouts = (models.Whereabout.objects
+                       .filter(timesheet__user__in=self.users, starts_at__date__gte=self.from_date,
+                               starts_at__date__lte=self.until_date)
+                       .select_related('timesheet', 'timesheet__user', 'location'))
+        whereabout_data = {}
+        for whereabout in whereabouts:
+            (whereabout_data
+                .setdefault(whereabout.timesheet.user.id, {})
+                .setdefault(whereabout.starts_at.date(), [])
+                .append(whereabout))
+        return whereabout_data
+
+    @cached_property
+    def activity_performance_data(self):
+        """Activity performances for this period, indexed by user ID, then by day."""
+        activity_performances = (models.ActivityPerformance.objects
+                                 .filter(date__gte=self.from_date, date__lte=self.until_date,
+                                         timesheet__user__in=self.users)
+                                 .select_related('performance_type', 'contract_role', 'contract',
+                                                 'contract__customer', 'timesheet', 'timesheet__user'))
+        activity_performance_data = {}
+        for performance in activity_performances:
+            (activity_performance_data
+                .setdefault(performance.timesheet.user.id, {})
+                .setdefault(performance.date, [])
+                .append(performance))
+        return activity_performance_data
+
+    @cached_property
+    def standby_performance_data(self):
+        """Standby performances for this period, indexed by user ID, then by day."""
+        standby_performances = (models.StandbyPerformance.objects
+                                .filter(date__gte=self.from_date, date__lte=self.until_date,
+                                        timesheet__user__in=self.users)
+                                .select_related('contract', 'contract__customer', 'timesheet', 'timesheet__user'))
+        standby_performance_data = {}
+        for performance in standby_performances:
+            (standby_performance_data
+                .setdefault(performance.timesheet.user.id, {})
+                .setdefault(performance.date, [])
+                .append(performance))
+        return standby_performance_data
+
+    @cached_property
+    def leave_date_total_data(self):
+        """Approved and pending leave hundredths of an hour for this period, indexed by user ID, then by day."""
+        leave_dates = (models.LeaveDate.objects
+                       .filter(leave__user__in=self.users,
+                               leave__status__in=[models.STATUS_PENDING, models.STATUS_APPROVED],
+                               starts_at__date__gte=self.from_date, starts_at__date__lte=self.until_date)
+                       .values_list('leave__user', 'leave__status', 'starts_at', 'ends_at'))
+        leave_date_total_data = {}
+        for user_id, status, starts_at, ends_at in leave_dates:
+            # Rounded the same way as LeaveDate.duration
+            duration = to_hundredths((ends_at - starts_at).total_seconds() / 3600)
+            (leave_date_total_data
+                .setdefault(user_id, {})
+                .setdefault(starts_at.date(), [])
+                .append((status, duration)))
+        return leave_date_total_data
+
+    @cached_property
+    def activity_performance_total_data(self):
+        """
+        Performed hundredths of an hour for this period, indexed by user ID, then by day, then by contract ID.
+
+        Performances are grouped on duration and multiplier as well, so the normalized duration can still be rounded
+        per performance, as ActivityPerformance.normalized_duration does.
+        Contracts are kept in the order they were first performed on each day.
+        """
+        activity_performances = (models.ActivityPerformance.objects
+                                 .filter(date__gte=self.from_date, date__lte=self.until_date,
+                                         timesheet__user__in=self.users)
+                                 .values_list('timesheet__user', 'date', 'contract', 'duration',
+                                              'performance_type__multiplier')
+                                 .annotate(count=Count('id'), first_id=Min('id'))
+                                 .order_by())
+        activity_performance_total_data = {}
+        for user_id, date, contract_id, duration, multiplier, count, first_id in sorted(activity_performances,
+                                                                                         key=lambda x: x[6]):
+            contract_hours = (activity_performance_total_data
+                              .setdefault(user_id, {})
+                              .setdefault(date, {}))
+            normalized_duration = round_half_even(to_hundredths(duration) * to_hundredths(multiplier), 100)
+            contract_hours[contract_id] = contract_hours.get(contract_id, 0) + normalized_duration * count
+        return activity_performance_total_data
+
+    @cached_property
+    def standby_performance_total_data(self):
+        """
+        Standby days for this period, indexed by user ID, then by day, then by contract ID.
+
+        Contracts are kept in the order they were first performed on each day.
+        """
+        standby_performances = (models.StandbyPerformance.objects
+                                .filter(date__gte=self.from_date, date__lte=self.until_date,
+                                        timesheet__user__in=self.users)
+                                .values_list('timesheet__user', 'date', 'contract')
+                                .annotate(count=Count('id'), first_id=Min('id'))
+                                .order_by())
+        standby_performance_total_data = {}
+        for user_id, date, contract_id, count, first_id in sorted(standby_performances, key=lambda x: x[4]):
+            (standby_performance_total_data
+                .setdefault(user_id, {})
+                .setdefault(date, {}))[contract_id] = count
+        return standby_performance_total_data
+
+    @cached_property
+    def contract_data(self):
+        """Contracts performed on in this period, indexed by ID."""
+        contract_ids = set()
+        for performance_total_data in [self.activity_performance_total_data, self.standby_performance_total_data]:
+            for user_data in performance_total_data.values():
+                for day_data in user_data.values():
+                    contract_ids.update(day_data)
+        contracts = (models.Contract.objects
+                     .non_polymorphic()
+                     .filter(id__in=contract_ids)
+                     .select_related('customer', 'company'))
+        return {contract.id: contract for contract in contracts}
+
+    @cached_property
+    def employment_contract_indexes(self):
+        """Interval indexes of employment contracts, by user ID."""
+        return {user_id: IntervalIndex(employment_contracts, 'started_at', 'ended_at')
+                for user_id, employment_contracts in self.employment_contract_data.items()}
+
+    @cached_property
+    def contract_user_work_schedule_indexes(self):
+        """Interval indexes of contract user work schedules, by user ID."""
+        return {user_id: IntervalIndex(contract_user_work_schedules, 'starts_at', 'ends_at')
+                for user_id, contract_user_work_schedules in self.contract_user_work_schedule_data.items()}
+
+    def get_employment_contract_index(self, user_id):
+        """Get the employment contract interval index for the given user."""
+        return self.employment_contract_indexes.get(user_id) or IntervalIndex([])
+
+    def get_contract_user_work_schedule_index(self, user_id):
+        """Get the contract user work schedule interval index for the given user."""
+        return self.contract_user_work_schedule_indexes.get(user_id) or IntervalIndex([])
+
+    def get_employment_contract(self, user_id, date):
+        """Get the employment contract active for the given user on the given date, if any."""
+        return self.get_employment_contract_index(user_id).first(date)
+
+    def get_contract_user_work_schedules(self, user_id, date):
+        """Get the contract user work schedules active for the given user on the given date."""
+        return self.get_contract_user_work_schedule_index(user_id).get(date)
+
+    def prefetch_leave_details(self):
+        """Prefetch the attachments and leave dates of all leaves in this period, as needed for serialization."""
+        leaves = [leave_date.leave for user_data in self.leave_date_data.values()
+                  for day_data in user_data.values() for leave_date in day_data]
+        prefetch_related_objects(leaves, 'attachments', 'leavedate_set')
+
+
+def fill_weekday_hours(hours, offset, from_date, until_date, weekday_hours):
+    """Fill a per-day hours array from the given offset onwards with the weekday hours of a date range."""
+    count = (until_date - from_date).days + 1
+    weekday = from_date.weekday()
+    week = weekday_hours[weekday:] + weekday_hours[:weekday]
+    hours[offset:offset + count] = (week * (count // 7 + 1))[:count]
+
+
+class EntityMap(object):
+    """
+    Entities referenced from a normalized response, indexed by type, then by ID.
+
+    Days refer to entities by ID, so an entity which spans many days or users is only serialized once.
+    """
+
+    SERIALIZERS = {
+        'holidays': serializers.HolidaySerializer,
+        'leaves': serializers.LeaveSerializer,
+        'leave_dates': serializers.LeaveDateSerializer,
+        'whereabouts': serializers.WhereaboutSerializer,
+        'activity_performances': serializers.ActivityPerformanceSerializer,
+        'standby_performances': serializers.StandbyPerformanceSerializer,
+        'contracts': serializers.MinimalContractSerializer,
+    }
+
+    def __init__(self):
+        self.objects = {entity_type: {} for entity_type in self.SERIALIZERS}
+
+    def add(self, entity_type, obj):
+        """Add an object of the given entity type and return its ID."""
+        self.objects[entity_type].setdefault(obj.id, obj)
+        return obj.id
+
+    def add_all(self, entity_type, objs):
+        """Add objects of the given entity type and return their IDs."""
+        return [self.add(entity_type, obj) for obj in objs]
+
+    def to_dict(self):
+        """Serialize every entity once, indexed by type, then by ID."""
+        res = {}
+        for entity_type, objs in self.objects.items():
+            data = self.SERIALIZERS[entity_type](list(objs.values()), many=True).data
+            res[entity_type] = dict(zip(objs, data))
+        return res
+
+
+def get_availability(users, from_date, until_date, serialize=False, context=None, entities=None):
+    """
+    Determine and return availability.
+
+    With an EntityMap as entities, days refer to holidays, leave dates and whereabouts by ID, and the objects are
+    added to the entity map instead of being serialized.
+    """
     res = {}
 
-    # Fetch sickness leave type IDs
-    sickness_type_ids = list(models.LeaveType.objects.filter(sickness=True).values_list('id', flat=True))
-
-    # Fetch all employment contracts for this period
-    employment_contracts = (models.EmploymentContract.objects
-                            .filter(
-                                (Q(ended_at__isnull=True) & Q(started_at__lte=until_date)) |
-                                (Q(started_at__lte=until_date) & Q(ended_at__gte=from_date)),
-                                user__in=users)
-                            .order_by('started_at')
-                            .select_related('user', 'company', 'work_schedule'))
-    # Index employment contracts by user ID
-    employment_contract_data = {}
-    for employment_contract in employment_contracts:
-        (employment_contract_data
-            .setdefault(employment_contract.user.id, [])
-            .append(employment_contract))
-
-    # Fetch all leave dates for this period
-    leave_dates = (models.LeaveDate.objects
-                   .filter(Q(leave__status=models.STATUS_APPROVED) | Q(leave__status=models.STATUS_PENDING),
-                           leave__user__in=users, starts_at__date__gte=from_date, starts_at__date__lte=until_date)
-                   .select_related('leave', 'leave__leave_type', 'leave__user'))
-    # Index leave dates by day, then by user ID
-    leave_date_data = {}
-    for leave_date in leave_dates:
-        (leave_date_data
-            .setdefault(str(leave_date.starts_at.date()), {})
-            .setdefault(leave_date.leave.user.id, [])
-            .append(leave_date))
-
-    # Fetch all holidays for this period
-    holidays = (models.Holiday.objects
-                .filter(date__gte=from_date, date__lte=until_date))
-    # Index holidays by day, then by country
-    holiday_data = {}
-    for holiday in holidays:
-        (holiday_data
-            .setdefault(str(holiday.date), {})
-            .setdefault(holiday.country, [])
-            .append(holiday))
-
-    # Fetch all whereabouts for this period
-    whereabouts = (models.Whereabout.objects
-                   .filter(timesheet__user__in=users, starts_at__date__gte=from_date,
-                           starts_at__date__lte=until_date)
-                   .select_related('timesheet', 'timesheet__user', 'location'))
-    # Index whereabouts by day, then by user ID
-    whereabout_data = {}
-    for whereabout in whereabouts:
-        (whereabout_data
-            .setdefault(str(whereabout.starts_at.date()), {})
-            .setdefault(whereabout.timesheet.user.id, [])
-            .append(whereabout))
-
-    # Count days
-    day_count = (until_date - from_date).days + 1
+    # Load calendar data, unless a shared context was passed in
+    context = context if context is not None else CalendarContext(users, from_date, until_date)
 
     # Iterate over users
     for user in users:
-        # Initialize user data
-        res[str(user.id)] = user_data = {}
+        res[str(user.id)] = dict(iter_user_availability(user, from_date, until_date, context, serialize=serialize,
+                                                        entities=entities))
+
+    return res
+
+
+def iter_availability(users, from_date, until_date, serialize=False, chunk_size=25):
+    """
+    Determine availability, yielding it one user at a time.
+
+    Calendar data is loaded per chunk of users and the days of each user are produced lazily, so memory use does
+    not grow with the amount of users.
+    """
+    users = list(users)
+
+    for i in range(0, len(users), chunk_size):
+        chunk = users[i:i + chunk_size]
+        context = CalendarContext(chunk, from_date, until_date)
+
+        for user in chunk:
+            yield str(user.id), StreamingJSONObject(iter_user_availability(user, from_date, until_date, context,
+                                                                           serialize=serialize))
+
+
+def iter_user_availability(user, from_date, until_date, context, serialize=False, entities=None):
+    """Determine the availability of a single user from the given calendar context, yielding it day by day."""
+    sickness_type_ids = context.sickness_type_ids
+    user_leave_date_data = context.leave_date_data.get(user.id, {})
+    user_whereabout_data = context.whereabout_data.get(user.id, {})
+
+    # Iterate over employment contract boundaries
+    # Each segment has a single employment contract, which determines the work schedule and country of the user
+    for segment_from, segment_until, employment_contracts in (context.get_employment_contract_index(user.id)
+                                                              .iter_segments(from_date, until_date)):
+        employment_contract = employment_contracts[0] if employment_contracts else None
+        weekday_hours = employment_contract.work_schedule.weekday_hours if employment_contract else None
+        country_holiday_data = (context.holiday_data.get(employment_contract.company.country, {})
+                                if employment_contract else {})
 
         # Iterate over days
-        for i in range(day_count):
+        for i in range((segment_until - segment_from).days + 1):
             # Determine date for this day
-            current_date = copy.deepcopy(from_date) + timedelta(days=i)
-            user_data[str(current_date)] = user_day_data = {
+            current_date = segment_from + timedelta(days=i)
+            user_day_data = {
                 'work_hours': 0,
                 'holidays': [],
                 'leave': [],
@@ -87,218 +392,213 @@ def get_availability(users, from_date, until_date, serialize=False):
                 'whereabouts': [],
             }
 
-            # Get employment contract for this day
-            # This allows us to determine the work schedule and country of the user
-            employment_contract = None
-            try:
-                for ec in employment_contract_data[user.id]:
-                    if (ec.started_at <= current_date) and ((not ec.ended_at) or (ec.ended_at >= current_date)):
-                        employment_contract = ec
-                        break
-            except KeyError:
-                pass
-
-            work_schedule = employment_contract.work_schedule if employment_contract else None
-            country = employment_contract.company.country if employment_contract else None
-
             # No work occurs when there is no work_schedule, or no hours should be worked that day
-            if work_schedule:
-                user_day_data['work_hours'] = getattr(work_schedule, current_date.strftime('%A').lower(), 0.00)
+            if weekday_hours:
+                user_day_data['work_hours'] = weekday_hours[current_date.weekday()]
 
             # Holidays
-            try:
-                if country:
-                    user_day_data['holidays'] = holiday_data[str(current_date)][country][0:]
-            except KeyError:
-                pass
+            user_day_data['holidays'] = country_holiday_data.get(current_date, [])[0:]
 
             # Leave & Sickness
-            try:
-                for leave_date in leave_date_data[str(current_date)][user.id]:
-                    if leave_date.leave.leave_type.id in sickness_type_ids:
-                        user_day_data['sickness'] += [leave_date]
-                    else:
-                        user_day_data['leave'] += [leave_date]
-            except KeyError:
-                pass
+            for leave_date in user_leave_date_data.get(current_date, []):
+                if leave_date.leave.leave_type.id in sickness_type_ids:
+                    user_day_data['sickness'] += [leave_date]
+                else:
+                    user_day_data['leave'] += [leave_date]
 
             # Whereabouts
-            try:
-                user_day_data['whereabouts'] = whereabout_data[str(current_date)][user.id][0:]
-            except KeyError:
-                pass
-
-            if serialize:
-                user_day_data['whereabouts'] = serializers.WhereaboutSerializer(user_day_data['whereabouts'], many=True).data
-                user_day_data['holidays'] = serializers.HolidaySerializer(user_day_data['holidays'], many=True).data
+            user_day_data['whereabouts'] = user_whereabout_data.get(current_date, [])[0:]
+
+            if entities is not None:
+                user_day_data['whereabouts'] = entities.add_all('whereabouts', user_day_data['whereabouts'])
+                user_day_data['holidays'] = entities.add_all('holidays', user_day_data['holidays'])
+                user_day_data['leave'] = entities.add_all('leave_dates', user_day_data['leave'])
+                user_day_data['sickness'] = entities.add_all('leave_dates', user_day_data['sickness'])
+            elif serialize:
+                user_day_data['whereabouts'] = serializers.WhereaboutSerializer(user_day_data['whereabouts'],
+                                                                                many=True).data
+                user_day_data['holidays'] = serializers.HolidaySerializer(user_day_data['holidays'],
+                                                                          many=True).data
                 user_day_data['leave'] = serializers.LeaveDateSerializer(user_day_data['leave'], many=True).data
-                user_day_data['sickness'] = serializers.LeaveDateSerializer(user_day_data['sickness'], many=True).data
+                user_day_data['sickness'] = serializers.LeaveDateSerializer(user_day_data['sickness'],
+                                                                            many=True).data
 
-    return res
+            yield str(current_date), user_day_data
 
 
-def get_availability_info(users, from_date, until_date):
+def get_availability_info(users, from_date, until_date, context=None):
     """Determine and return availability info."""
     res = {}
 
-    # Fetch sickness leave type IDs
-    sickness_type_ids = list(models.LeaveType.objects.filter(sickness=True).values_list('id', flat=True))
-
-    # Fetch all employment contracts for this period
-    employment_contracts = (models.EmploymentContract.objects
-                            .filter(
-                                (Q(ended_at__isnull=True) & Q(started_at__lte=until_date)) |
-                                (Q(started_at__lte=until_date) & Q(ended_at__gte=from_date)),
-                                user__in=users)
-                            .order_by('started_at')
-                            .select_related('user', 'company', 'work_schedule'))
-    # Index employment contracts by user ID
-    employment_contract_data = {}
-    for employment_contract in employment_contracts:
-        (employment_contract_data
-            .setdefault(employment_contract.user.id, [])
-            .append(employment_contract))
-
-    # Fetch all leave dates for this period
-    leave_dates = (models.LeaveDate.objects
-                   .filter(Q(leave__status=models.STATUS_APPROVED) | Q(leave__status=models.STATUS_PENDING),
-                           leave__user__in=users, starts_at__date__gte=from_date, starts_at__date__lte=until_date)
-                   .select_related('leave', 'leave__leave_type', 'leave__user'))
-    # Index leave dates by day, then by user ID
-    leave_date_data = {}
-    for leave_date in leave_dates:
-        (leave_date_data
-            .setdefault(str(leave_date.starts_at.date()), {})
-            .setdefault(leave_date.leave.user.id, [])
-            .append(leave_date))
-
-    # Fetch all holidays for this period
-    holidays = (models.Holiday.objects
-                .filter(date__gte=from_date, date__lte=until_date))
-    # Index holidays by day, then by country
-    holiday_data = {}
-    for holiday in holidays:
-        (holiday_data
-            .setdefault(str(holiday.date), {})
-            .setdefault(holiday.country, [])
-            .append(holiday))
-
-    # Fetch all whereabouts for this period
-    whereabouts = (models.Whereabout.objects
-                   .filter(timesheet__user__in=users, starts_at__date__gte=from_date,
-                           starts_at__date__lte=until_date)
-                   .select_related('timesheet', 'timesheet__user', 'location'))
-    # Index whereabouts by day, then by user ID
-    whereabout_data = {}
-    for whereabout in whereabouts:
-        (whereabout_data
-            .setdefault(str(whereabout.starts_at.date()), {})
-            .setdefault(whereabout.timesheet.user.id, [])
-            .append(whereabout))
-
-    # Count days
-    day_count = (until_date - from_date).days + 1
-
-    # Iterate over users
+    user_availability_infos = get_user_availability_infos(users, from_date, until_date, context=context)
     for user in users:
-        # Initialize user data
-        res[str(user.id)] = user_data = {}
+        res[str(user.id)] = user_availability_infos[user.id].to_dict()
 
-        # Iterate over days
-        for i in range(day_count):
-            # Determine date for this day
-            current_date = copy.deepcopy(from_date) + timedelta(days=i)
-            user_data[str(current_date)] = user_day_info = AvailabilityInfo()
+    return res
 
-            # Get employment contract for this day
-            # This allows us to determine the work schedule and country of the user
-            employment_contract = None
-            try:
-                for ec in employment_contract_data[user.id]:
-                    if (ec.started_at <= current_date) and ((not ec.ended_at) or (ec.ended_at >= current_date)):
-                        employment_contract = ec
-                        break
-            except KeyError:
-                pass
-
-            work_schedule = employment_contract.work_schedule if employment_contract else None
-            country = employment_contract.company.country if employment_contract else None
 
-            # No work occurs when there is no work_schedule, or no hours should be worked that day
-            if (not work_schedule) or (getattr(work_schedule, current_date.strftime('%A').lower(), 0.00) <= 0):
-                user_day_info.add_tag('no_work')
+class UserAvailabilityInfo(object):
+    """
+    Availability info of a single user over a date range.
+
+    The tags of each day are kept as bit flags in an array indexed by day offset, leave dates in a dict by day offset.
+    Flags are 64-bit integers, unless more tags are in use (e.g. for many whereabout locations), in which case the
+    array is replaced by a list of integers of any size.
+    """
+
+    __slots__ = ('user', 'from_date', 'until_date', 'day_count', 'tags', 'flags', 'leave_dates')
+
+    def __init__(self, user, from_date, until_date, tags=None):
+        self.user = user
+        self.from_date = from_date
+        self.until_date = until_date
+        self.day_count = max(0, (until_date - from_date).days + 1)
+        self.tags = tags if tags is not None else AvailabilityTags()
+        self.flags = array('Q', [0]) * self.day_count
+        self.leave_dates = {}
+
+    def add_tag(self, day, tag):
+        """Add the given tag to the given day."""
+        bit = self.tags.get_bit(tag)
+        if (bit >> 64) and isinstance(self.flags, array):
+            self.flags = list(self.flags)
+        self.flags[day] |= bit
+
+    def has_tag(self, day, tag):
+        """Check whether the given day has the given tag."""
+        return bool(self.flags[day] & self.tags.bits.get(tag, 0))
+
+    def get_day(self, day):
+        """Get the availability info for the given day offset."""
+        return AvailabilityInfo(self.tags.get_tags(self.flags[day]), self.leave_dates.get(day, []))
+
+    def get(self, date):
+        """Get the availability info for the given date."""
+        return self.get_day((date - self.from_date).days)
+
+    def get_bitmap(self, tag):
+        """Get a bitmap of the days having the given tag, with the first day in the lowest bit of the first byte."""
+        bit = self.tags.bits.get(tag, 0)
+        bitmap = bytearray((self.day_count + 7) // 8)
+        for day, flags in enumerate(self.flags):
+            if flags & bit:
+                bitmap[day >> 3] |= 1 << (day & 7)
+        return bytes(bitmap)
+
+    def to_dict(self):
+        """Get the availability info as a dict, indexed by date string."""
+        return {str(self.from_date + timedelta(days=day)): self.get_day(day) for day in range(self.day_count)}
+
+
+def get_user_availability_infos(users, from_date, until_date, context=None):
+    """
+    Determine and return availability info, indexed by user ID.
+
+    The users share a single tag registry, so their availability flags use the same bits.
+    """
+    res = {}
+    tags = AvailabilityTags()
 
-            # Holidays
-            try:
-                if country and holiday_data[str(current_date)][country]:
-                    user_day_info.add_tag('holiday')
-            except KeyError:
-                pass
+    # Load calendar data, unless a shared context was passed in
+    context = context if context is not None else CalendarContext(users, from_date, until_date)
+    sickness_type_ids = context.sickness_type_ids
 
-            # Leave & Sickness
-            try:
-                for leave_date in leave_date_data[str(current_date)][user.id]:
+    # Iterate over users
+    for user in users:
+        # Initialize user data
+        res[user.id] = user_info = UserAvailabilityInfo(user, from_date, until_date, tags=tags)
+        user_leave_date_data = context.leave_date_data.get(user.id, {})
+        user_whereabout_data = context.whereabout_data.get(user.id, {})
+
+        # Iterate over employment contract boundaries
+        # Each segment has a single employment contract, which determines the work schedule and country of the user
+        for segment_from, segment_until, employment_contracts in (context.get_employment_contract_index(user.id)
+                                                                  .iter_segments(from_date, until_date)):
+            employment_contract = employment_contracts[0] if employment_contracts else None
+            weekday_hours = (employment_contract.work_schedule.weekday_hours if employment_contract
+                             else NO_WEEKDAY_HOURS)
+            country_holiday_data = (context.holiday_data.get(employment_contract.company.country, {})
+                                    if employment_contract else {})
+            offset = (segment_from - from_date).days
+
+            # Iterate over days
+            for i in range((segment_until - segment_from).days + 1):
+                # Determine date for this day
+                current_date = segment_from + timedelta(days=i)
+                day = offset + i
+
+                # No work occurs when there is no work_schedule, or no hours should be worked that day
+                if weekday_hours[current_date.weekday()] <= 0:
+                    user_info.add_tag(day, 'no_work')
+
+                # Holidays
+                if country_holiday_data.get(current_date):
+                    user_info.add_tag(day, 'holiday')
+
+                # Leave & Sickness
+                for leave_date in user_leave_date_data.get(current_date, []):
                     leave_status = leave_date.leave.status
                     # TODO: We will probably need to add the leave type to the structure here as well so that the
-                    # timesheet monthly overview report can distinguish between various kinds of leave for legal reasons?
-                    user_day_info.leave_dates.append(leave_date)
+                    # timesheet monthly overview report can distinguish between various kinds of leave for legal
+                    # reasons?
+                    user_info.leave_dates.setdefault(day, []).append(leave_date)
                     if leave_date.leave.leave_type.id in sickness_type_ids:
                         if leave_status == models.STATUS_APPROVED:
-                            user_day_info.add_tag('sickness')
+                            user_info.add_tag(day, 'sickness')
                         else:
-                            user_day_info.add_tag('sickness_pending')
+                            user_info.add_tag(day, 'sickness_pending')
                     else:
                         if leave_status == models.STATUS_APPROVED:
-                            user_day_info.add_tag('leave')
+                            user_info.add_tag(day, 'leave')
                         else:
-                            user_day_info.add_tag('leave_pending')
-            except KeyError:
-                pass
+                            user_info.add_tag(day, 'leave_pending')
 
-            # Whereabouts
-            try:
-                for whereabout in whereabout_data[str(current_date)][user.id]:
-                    user_day_info.add_tag('whereabout_%s' % whereabout.location.name.lower().replace(' ', '_'))
-            except KeyError:
-                pass
+                # Whereabouts
+                for whereabout in user_whereabout_data.get(current_date, []):
+                    user_info.add_tag(day, 'whereabout_%s' % whereabout.location.name.lower().replace(' ', '_'))
+
+    return res
+
+
+def get_compact_availability_info(users, from_date, until_date, context=None):
+    """
+    Determine and return availability info in a compact format.
+
+    The legend lists the tags in use. For every user, a base64 encoded bitmap of the days having each tag of the
+    legend is given, or None if no day has that tag. Bit n of byte m is set when day m * 8 + n of the range has the
+    tag.
+    """
+    users = list(users)
+    user_availability_infos = get_user_availability_infos(users, from_date, until_date, context=context)
+    tags = next(iter(user_availability_infos.values())).tags if user_availability_infos else AvailabilityTags()
+
+    res = {
+        'from': str(from_date),
+        'until': str(until_date),
+        'legend': list(tags.tags),
+        'users': {},
+    }
+
+    for user in users:
+        user_info = user_availability_infos[user.id]
+        used_flags = 0
+        for flags in user_info.flags:
+            used_flags |= flags
+
+        res['users'][str(user.id)] = [
+            b64encode(user_info.get_bitmap(tag)).decode('ascii') if used_flags >> i & 1 else None
+            for i, tag in enumerate(tags.tags)
+        ]
 
     return res
 
 
-def get_internal_availability_info(users, from_date, until_date):
+def get_internal_availability_info(users, from_date, until_date, context=None):
     """Determine and return availability info."""
     res = {}
 
-    # Fetch all employment contracts for this period
-    employment_contracts = (models.EmploymentContract.objects
-                            .filter(
-                                (Q(ended_at__isnull=True) & Q(started_at__lte=until_date)) |
-                                (Q(started_at__lte=until_date) & Q(ended_at__gte=from_date)),
-                                user__in=users)
-                            .order_by('started_at')
-                            .select_related('user', 'company', 'work_schedule'))
-    # Index employment contracts by user ID
-    employment_contract_data = {}
-    for employment_contract in employment_contracts:
-        (employment_contract_data
-            .setdefault(employment_contract.user.id, [])
-            .append(employment_contract))
-
-    # Fetch contract user work schedules
-    contract_user_work_schedules = (models.ContractUserWorkSchedule.objects
-                                    .filter(contract_user__user__in=users)
-                                    .filter(Q(ends_at__isnull=True, starts_at__lte=until_date) |
-                                            Q(ends_at__isnull=False, starts_at__lte=until_date,
-                                              ends_at__gte=from_date))
-                                    .select_related('contract_user', 'contract_user__user',
-                                                    'contract_user__contract_role', 'contract_user__contract',
-                                                    'contract_user__contract__customer'))
-    # Index contract user work schedules by user
-    contract_user_work_schedule_data = {}
-    for contract_user_work_schedule in contract_user_work_schedules:
-        (contract_user_work_schedule_data
-            .setdefault(contract_user_work_schedule.contract_user.user.id, [])
-            .append(contract_user_work_schedule))
+    # Load calendar data, unless a shared context was passed in
+    context = context if context is not None else CalendarContext(users, from_date, until_date)
 
     # Count days
     day_count = (until_date - from_date).days + 1
@@ -307,47 +607,36 @@ def get_internal_availability_info(users, from_date, until_date):
     for user in users:
         # Initialize user data
         res[str(user.id)] = user_data = {}
+        employment_contract_index = context.get_employment_contract_index(user.id)
+        contract_user_work_schedule_index = context.get_contract_user_work_schedule_index(user.id)
+
         # Iterate over days
         for i in range(day_count):
             # Determine date for this day
-            current_date = copy.deepcopy(from_date) + timedelta(days=i)
+            current_date = from_date + timedelta(days=i)
+            weekday = current_date.weekday()
             user_data[str(current_date)] = user_day_tags = []
 
             # Get employment contract for this day
             # This allows us to determine the work schedule and country of the user
-            employment_contract = None
-            try:
-                for ec in employment_contract_data[user.id]:
-                    if (ec.started_at <= current_date) and ((not ec.ended_at) or (ec.ended_at >= current_date)):
-                        employment_contract = ec
-                        break
-            except KeyError:
-                pass
-
-            valid_contract_user_work_schedules = []
+            employment_contract = employment_contract_index.first(current_date)
+            work_hours = employment_contract.work_schedule.weekday_hours[weekday] if employment_contract else 0
+
+            # Get contract user work schedules for this day
+            valid_contract_user_work_schedules = contract_user_work_schedule_index.get(current_date)
             contract_user_day_scheduled_hours = Decimal('0.00')
+            for contract_user_work_schedule in valid_contract_user_work_schedules:
+                contract_user_day_scheduled_hours += contract_user_work_schedule.weekday_hours[weekday]
 
-            try:
-                for contract_user_work_schedule in contract_user_work_schedule_data.get(user.id, []):
-                    if (contract_user_work_schedule.starts_at <= current_date) and \
-                            ((not contract_user_work_schedule.ends_at) or
-                                (contract_user_work_schedule.ends_at >= current_date)):
-                        valid_contract_user_work_schedules.append(contract_user_work_schedule)
-                        contract_user_day_scheduled_hours += getattr(contract_user_work_schedule,
-                                                                     current_date.strftime('%A').lower(), Decimal('0.00'))
-            except KeyError:
-                pass
-
-            employment_contract_work_schedule = employment_contract.work_schedule if employment_contract else None
             # No work occurs when there is no work_schedule, or no hours should be worked that day
-            if (not employment_contract_work_schedule) or (getattr(employment_contract_work_schedule, current_date.strftime('%A').lower(), 0.00) <= 0):
+            if work_hours <= 0:
                 user_day_tags.append('no_employment_contract_work_schedule')
 
             if (not valid_contract_user_work_schedules or contract_user_day_scheduled_hours <= 0):
                 user_day_tags.append('no_contract_user_work_schedule')
 
             # If no hours available
-            math_check = getattr(employment_contract_work_schedule, current_date.strftime('%A').lower(), 0) - contract_user_day_scheduled_hours
+            math_check = work_hours - contract_user_day_scheduled_hours
             if (math_check <= 0):
                 user_day_tags.append('not_available_for_internal_work')
 
@@ -357,215 +646,723 @@ def get_internal_availability_info(users, from_date, until_date):
     return res
 
 
-def get_range_info(users, from_date, until_date, daily=False, detailed=False, summary=False, serialize=False):
-    """Determine and return range info."""
-    res = {}
+class UserRangeInfo(object):
+    """
+    Hours of a single user over a date range, kept in per-day arrays indexed by day offset.
+
+    Hours are kept in integer hundredths of an hour, and only converted to Decimal hours on output.
+    """
+
+    __slots__ = ('user', 'from_date', 'until_date', 'day_count', 'work_hours', 'holiday_hours', 'leave_hours',
+                 'pending_leave_hours', 'performed_hours', 'standby_days', 'holidays', 'leaves',
+                 'activity_performances', 'standby_performances', 'performance_summary', '_prefix_sums')
+
+    PREFIX_SUM_FIELDS = ('work_hours', 'holiday_hours', 'leave_hours', 'pending_leave_hours', 'performed_hours',
+                         'standby_days')
+
+    HOUR_FIELDS = ('work_hours', 'holiday_hours', 'leave_hours', 'pending_leave_hours', 'performed_hours',
+                   'remaining_hours', 'total_hours', 'overtime_hours')
+
+    def __init__(self, user, from_date, until_date):
+        self.user = user
+        self.from_date = from_date
+        self.until_date = until_date
+        self.day_count = max(0, (until_date - from_date).days + 1)
+        self.work_hours = [0] * self.day_count
+        self.holiday_hours = [0] * self.day_count
+        self.leave_hours = [0] * self.day_count
+        self.pending_leave_hours = [0] * self.day_count
+        self.performed_hours = [0] * self.day_count
+        self.standby_days = [0] * self.day_count
+        self.holidays = {}
+        self.leaves = {}
+        self.activity_performances = {}
+        self.standby_performances = {}
+        self.performance_summary = {}
+        self._prefix_sums = None
+
+    def get_prefix_sums(self):
+        """
+        Get cumulative sums of the per-day arrays, by field name.
+
+        Item n of each array holds the sum of the first n days, so the total of any sub-range takes two lookups.
+        The sums are calculated the first time they are needed.
+        """
+        if self._prefix_sums is None:
+            self._prefix_sums = {field: list(accumulate(getattr(self, field), initial=0))
+                                 for field in self.PREFIX_SUM_FIELDS}
+        return self._prefix_sums
+
+    def range_totals(self, from_date=None, until_date=None):
+        """Get the totals for the given sub-range, which defaults to the full range."""
+        start = 0 if from_date is None else min(max(0, (from_date - self.from_date).days), self.day_count)
+        end = self.day_count if until_date is None else min(max(0, (until_date - self.from_date).days + 1),
+                                                            self.day_count)
+        end = max(start, end)
+        prefix_sums = self.get_prefix_sums()
+
+        totals = {field: prefix_sums[field][end] - prefix_sums[field][start] for field in self.PREFIX_SUM_FIELDS}
+        return self.get_hours(totals['work_hours'], totals['holiday_hours'], totals['leave_hours'],
+                              totals['pending_leave_hours'], totals['performed_hours'])
+
+    @staticmethod
+    def get_hours(work_hours, holiday_hours, leave_hours, pending_leave_hours, performed_hours):
+        """Get the hours and derived totals for the given hundredths of an hour, converted to Decimal hours."""
+        total_hours = holiday_hours + leave_hours + performed_hours
+        return {
+            'work_hours': from_hundredths(work_hours),
+            'holiday_hours': from_hundredths(holiday_hours),
+            'leave_hours': from_hundredths(leave_hours),
+            'pending_leave_hours': from_hundredths(pending_leave_hours),
+            'performed_hours': from_hundredths(performed_hours),
+            'remaining_hours': from_hundredths(max(0, work_hours - total_hours)),
+            'total_hours': from_hundredths(total_hours),
+            'overtime_hours': from_hundredths(abs(min(0, work_hours - total_hours))),
+        }
+
+    def to_dict(self, daily=False, detailed=False, summary=False, serialize=False, stream=False, entities=None):
+        """
+        Get the range info as a dict.
+
+        With stream, the daily details are produced lazily as a streaming JSON object.
+        With an EntityMap as entities, objects are referred to by ID and added to the entity map instead.
+        """
+        res = self.range_totals()
+
+        if daily:
+            details = self.iter_details(detailed=detailed, serialize=serialize, entities=entities)
+            res['details'] = StreamingJSONObject(details) if stream else dict(details)
+
+        if summary:
+            res['summary'] = {
+                'performances': [dict(performance, duration=from_hundredths(performance['duration']))
+                                 for performance in self.performance_summary.values()],
+            }
+
+            if entities is not None:
+                for performance in res['summary']['performances']:
+                    performance['contract'] = entities.add('contracts', performance['contract'])
+            elif serialize:
+                for performance in res['summary']['performances']:
+                    performance['contract'] = serializers.MinimalContractSerializer(performance['contract']).data
+
+        return res
+
+    def iter_details(self, detailed=False, serialize=False, entities=None):
+        """Get the daily range info, yielding it day by day."""
+        for day in range(self.day_count):
+            day_res = self.get_hours(self.work_hours[day], self.holiday_hours[day], self.leave_hours[day],
+                                     self.pending_leave_hours[day], self.performed_hours[day])
+
+            if detailed:
+                day_res['holidays'] = self.holidays.get(day, [])
+                day_res['leaves'] = self.leaves.get(day, [])
+                day_res['activity_performances'] = self.activity_performances.get(day, [])
+                day_res['standby_performances'] = self.standby_performances.get(day, [])
+
+                if entities is not None:
+                    day_res['holidays'] = entities.add_all('holidays', day_res['holidays'])
+                    day_res['leaves'] = entities.add_all('leaves', day_res['leaves'])
+                    day_res['activity_performances'] = entities.add_all('activity_performances',
+                                                                        day_res['activity_performances'])
+                    day_res['standby_performances'] = entities.add_all('standby_performances',
+                                                                       day_res['standby_performances'])
+                elif serialize:
+                    day_res['holidays'] = serializers.HolidaySerializer(day_res['holidays'], many=True).data
+                    day_res['leaves'] = serializers.LeaveSerializer(day_res['leaves'], many=True).data
+                    day_res['activity_performances'] = serializers.ActivityPerformanceSerializer(
+                        day_res['activity_performances'], many=True).data
+                    day_res['standby_performances'] = serializers.StandbyPerformanceSerializer(
+                        day_res['standby_performances'], many=True).data
+
+            yield str(self.from_date + timedelta(days=day)), day_res
+
+
+def calculate_user_range_info(user, from_date, until_date, context, detailed=False):
+    """
+    Calculate the range info of a single user from the given calendar context.
+
+    Without detailed, leave and performances are aggregated in the database and the range info holds no objects for
+    them.
+    """
+    info = UserRangeInfo(user, from_date, until_date)
+
+    # Work and holiday hours follow the work schedule of the employment contract of each segment
+    for segment_from, segment_until, employment_contracts in (context.get_employment_contract_index(user.id)
+                                                              .iter_segments(from_date, until_date)):
+        if not employment_contracts:
+            continue
+
+        employment_contract = employment_contracts[0]
+        weekday_hours = tuple(map(to_hundredths, employment_contract.work_schedule.weekday_hours))
+        fill_weekday_hours(info.work_hours, (segment_from - from_date).days, segment_from, segment_until,
+                           weekday_hours)
+
+        for date, country_holidays in context.holiday_data.get(employment_contract.company.country, {}).items():
+            if segment_from <= date <= segment_until:
+                day = (date - from_date).days
+                info.holiday_hours[day] += weekday_hours[date.weekday()]
+                info.holidays.setdefault(day, []).extend(country_holidays)
+
+    # Leave and performances are only loaded as objects when details are needed, otherwise only their totals are
+    if detailed:
+        add_user_range_info_details(info, context)
+    else:
+        add_user_range_info_totals(info, context)
+
+    return info
+
+
+def add_user_range_info_details(info, context):
+    """Add the leave and performances of the user of the given range info, loaded as objects."""
+    user, from_date, until_date = info.user, info.from_date, info.until_date
+
+    # Leave
+    for date, leave_dates in context.leave_date_data.get(user.id, {}).items():
+        if not (from_date <= date <= until_date):
+            continue
+
+        day = (date - from_date).days
+        for leave_date in leave_dates:
+            duration = to_hundredths(leave_date.duration)
+            if leave_date.leave.status == models.STATUS_APPROVED:
+                info.leave_hours[day] += duration
+            else:
+                info.pending_leave_hours[day] += duration
+            info.leaves.setdefault(day, []).append(leave_date.leave)
+
+    # Performances are walked in day order, so the summary lists contracts in the order they were first performed
+    activity_performance_data = context.activity_performance_data.get(user.id, {})
+    standby_performance_data = context.standby_performance_data.get(user.id, {})
+    for date in sorted(set(activity_performance_data) | set(standby_performance_data)):
+        if not (from_date <= date <= until_date):
+            continue
+
+        day = (date - from_date).days
+        for performance in activity_performance_data.get(date, []):
+            duration = to_hundredths(performance.normalized_duration)
+            info.performed_hours[day] += duration
+            info.activity_performances.setdefault(day, []).append(performance)
+            info.performance_summary.setdefault(performance.contract.id, {
+                'contract': performance.contract,
+                'duration': 0,
+                'standby_days': 0,
+            })['duration'] += duration
+
+        for performance in standby_performance_data.get(date, []):
+            info.standby_days[day] += 1
+            info.standby_performances.setdefault(day, []).append(performance)
+            info.performance_summary.setdefault(performance.contract.id, {
+                'contract': performance.contract,
+                'duration': 0,
+                'standby_days': 0,
+            })['standby_days'] += 1
+
+
+def add_user_range_info_totals(info, context):
+    """Add the leave and performance totals of the user of the given range info, as aggregated in the database."""
+    user, from_date, until_date = info.user, info.from_date, info.until_date
+
+    # Leave
+    for date, leave_dates in context.leave_date_total_data.get(user.id, {}).items():
+        if not (from_date <= date <= until_date):
+            continue
+
+        day = (date - from_date).days
+        for status, duration in leave_dates:
+            if status == models.STATUS_APPROVED:
+                info.leave_hours[day] += duration
+            else:
+                info.pending_leave_hours[day] += duration
+
+    # Performances are walked in day order, so the summary lists contracts in the order they were first performed
+    activity_performance_data = context.activity_performance_total_data.get(user.id, {})
+    standby_performance_data = context.standby_performance_total_data.get(user.id, {})
+    for date in sorted(set(activity_performance_data) | set(standby_performance_data)):
+        if not (from_date <= date <= until_date):
+            continue
+
+        day = (date - from_date).days
+        for contract_id, duration in activity_performance_data.get(date, {}).items():
+            info.performed_hours[day] += duration
+            info.performance_summary.setdefault(contract_id, {
+                'contract': context.contract_data.get(contract_id),
+                'duration': 0,
+                'standby_days': 0,
+            })['duration'] += duration
+
+        for contract_id, count in standby_performance_data.get(date, {}).items():
+            info.standby_days[day] += count
+            info.performance_summary.setdefault(contract_id, {
+                'contract': context.contract_data.get(contract_id),
+                'duration': 0,
+                'standby_days': 0,
+            })['standby_days'] += count
+
+
+def get_ledger_range_infos(users, from_date, until_date, context=None):
+    """
+    Get the range info of the given users from the user day ledger.
+
+    Users for whom the ledger does not hold every day of the range are recalculated and stored in the ledger first.
+    Ledger rows only hold hours, so the resulting range info has no details or summary.
+    """
+    res = {user.id: UserRangeInfo(user, from_date, until_date) for user in users}
+    filled_days = dict.fromkeys(res, 0)
+
+    ledger_rows = (models.UserDayLedger.objects
+                   .filter(user__in=users, date__gte=from_date, date__lte=until_date)
+                   .values_list('user_id', 'date', 'work_hours', 'holiday_hours', 'leave_hours',
+                                'pending_leave_hours', 'performed_hours', 'standby_count'))
+    for (user_id, date, work_hours, holiday_hours, leave_hours, pending_leave_hours, performed_hours,
+         standby_count) in ledger_rows:
+        info = res[user_id]
+        day = (date - from_date).days
+        info.work_hours[day] = to_hundredths(work_hours)
+        info.holiday_hours[day] = to_hundredths(holiday_hours)
+        info.leave_hours[day] = to_hundredths(leave_hours)
+        info.pending_leave_hours[day] = to_hundredths(pending_leave_hours)
+        info.performed_hours[day] = to_hundredths(performed_hours)
+        info.standby_days[day] = standby_count
+        filled_days[user_id] += 1
+
+    stale_users = [info.user for user_id, info in res.items() if filled_days[user_id] < info.day_count]
+    if stale_users:
+        res.update(refresh_user_day_ledger(stale_users, from_date, until_date, context=context))
+
+    return res
+
 
-    # Fetch all employment contracts for this period
-    employment_contracts = (models.EmploymentContract.objects
-                            .filter(
-                                (Q(ended_at__isnull=True) & Q(started_at__lte=until_date)) |
-                                (Q(started_at__lte=until_date) & Q(ended_at__gte=from_date)),
-                                user__in=users)
-                            .order_by('started_at')
-                            .select_related('user', 'company', 'work_schedule'))
-    # Index employment contracts by user ID
-    employment_contract_data = {}
-    for employment_contract in employment_contracts:
-        (employment_contract_data
-            .setdefault(employment_contract.user.id, [])
-            .append(employment_contract))
-
-    # Fetch all leave dates for this period
+def refresh_user_day_ledger(users, from_date, until_date, context=None):
+    """Recalculate the user day ledger of the given users over the given range and return their range info."""
+    context = context if context is not None else CalendarContext(users, from_date, until_date)
+    res = {user.id: calculate_user_range_info(user, from_date, until_date, context) for user in users}
+
+    ledger_rows = []
+    for info in res.values():
+        for day in range(info.day_count):
+            ledger_row = models.UserDayLedger(
+                user=info.user,
+                date=from_date + timedelta(days=day),
+                work_hours=from_hundredths(info.work_hours[day]),
+                holiday_hours=from_hundredths(info.holiday_hours[day]),
+                leave_hours=from_hundredths(info.leave_hours[day]),
+                pending_leave_hours=from_hundredths(info.pending_leave_hours[day]),
+                performed_hours=from_hundredths(info.performed_hours[day]),
+                standby_count=info.standby_days[day],
+            )
+            # Bulk creation bypasses save(), so the polymorphic content type is set here
+            ledger_row.pre_save_polymorphic()
+            ledger_rows.append(ledger_row)
+
+    with transaction.atomic():
+        invalidate_user_day_ledger(users, from_date, until_date)
+        models.UserDayLedger.objects.bulk_create(ledger_rows, batch_size=1000, ignore_conflicts=True)
+
+    return res
+
+
+def invalidate_user_day_ledger(users=None, from_date=None, until_date=None):
+    """Remove user day ledger rows, so they are recalculated the next time they are needed."""
+    ledger_rows = models.UserDayLedger.objects.all()
+    if users is not None:
+        ledger_rows = ledger_rows.filter(user__in=users)
+    if from_date:
+        ledger_rows = ledger_rows.filter(date__gte=from_date)
+    if until_date:
+        ledger_rows = ledger_rows.filter(date__lte=until_date)
+    ledger_rows.delete()
+
+
+def invalidate_user_hours(users=None, from_date=None, until_date=None):
+    """
+    Remove everything calculated from the hours of the given users in the given range.
+
+    This covers the user day ledger rows of the range, the snapshots of the closed timesheets of the months of the
+    range, and the overtime checkpoints from the month of from_date onwards, as their running balances include the
+    range.
+    """
+    invalidate_user_day_ledger(users, from_date, until_date)
+    invalidate_timesheet_snapshots(users, from_date, until_date)
+    invalidate_overtime_checkpoints(users, from_date)
+
+
+def invalidate_performance_hours(user_dates):
+    """
+    Remove everything calculated from performances on the given (user ID, date) pairs.
+
+    Used by the performance signals, and by bulk saves of performances which bypass them. The dates of each user are
+    invalidated as a single range, and standby performances memoized for duplicate checks are forgotten.
+    """
+    dates = {}
+    for user_id, date in user_dates:
+        dates.setdefault(user_id, set()).add(date)
+    for user_id, user_dates in dates.items():
+        invalidate_user_hours([user_id], min(user_dates), max(user_dates))
+
+    invalidate_request_cache('standby_performance_ids')
+
+
+def get_month_index(year, month):
+    """Get a number for the given month, which increases by one for every month."""
+    return year * 12 + month - 1
+
+
+def get_overtime_checkpoints(user, from_date, until_date):
+    """
+    Get the overtime checkpoints of the given user for the months of the given range, ordered by month.
+
+    Checkpoints are kept for consecutive months, starting at the first month of the first employment contract of the
+    user, so running balances include all months before the range. Missing checkpoints are calculated and stored
+    first.
+    """
+    from_index = get_month_index(from_date.year, from_date.month)
+    until_index = get_month_index(until_date.year, until_date.month)
+
+    checkpoints = list(models.UserOvertimeCheckpoint.objects
+                       .filter(user=user, year__lte=until_date.year)
+                       .order_by('year', 'month'))
+    checkpoints = [x for x in checkpoints if get_month_index(x.year, x.month) <= until_index]
+
+    # Determine the first month of the checkpoints, then keep those which follow it without gaps
+    start_index = from_index
+    started_at = models.EmploymentContract.objects.filter(user=user).aggregate(started_at=Min('started_at'))
+    if started_at['started_at']:
+        start_index = min(start_index, get_month_index(started_at['started_at'].year, started_at['started_at'].month))
+    if checkpoints:
+        start_index = min(start_index, get_month_index(checkpoints[0].year, checkpoints[0].month))
+
+    valid_count = 0
+    for checkpoint in checkpoints:
+        if get_month_index(checkpoint.year, checkpoint.month) != start_index + valid_count:
+            break
+        valid_count += 1
+    checkpoints = checkpoints[:valid_count]
+
+    if start_index + valid_count <= until_index:
+        balance = checkpoints[-1].balance if checkpoints else Decimal('0.00')
+        checkpoints += refresh_overtime_checkpoints(user, start_index + valid_count, until_index, balance)
+
+    return checkpoints[max(0, from_index - start_index):]
+
+
+def refresh_overtime_checkpoints(user, from_index, until_index, balance):
+    """
+    Recalculate the overtime checkpoints of the given user for the given months, and return them.
+
+    Months are given as month indexes, and the running balance continues from the given balance.
+    """
+    months = [(index // 12, index % 12 + 1) for index in range(from_index, until_index + 1)]
+    month_ranges = [month_date_range(year, month) for year, month in months]
+    from_date, until_date = month_ranges[0][0], month_ranges[-1][1]
+    info = calculate_user_range_info(user, from_date, until_date, CalendarContext([user], from_date, until_date))
+
+    # Overtime leave counts as used overtime
+    used_overtime_hours = {}
     leave_dates = (models.LeaveDate.objects
-                   .filter(leave__user__in=users, leave__status__in=[models.STATUS_PENDING, models.STATUS_APPROVED],
+                   .filter(leave__user=user, leave__status=models.STATUS_APPROVED, leave__leave_type__overtime=True,
                            starts_at__date__gte=from_date, starts_at__date__lte=until_date)
-                   .select_related('leave', 'leave__leave_type', 'leave__user')
-                   .prefetch_related('leave__attachments', 'leave__leavedate_set'))
-    # Index leave dates by day, then by user ID
-    leave_date_data = {}
-    for leave_date in leave_dates:
-        (leave_date_data
-            .setdefault(str(leave_date.starts_at.date()), {})
-            .setdefault(leave_date.leave.user.id, [])
-            .append(leave_date))
-
-    # Fetch all holidays for this period
-    holidays = (models.Holiday.objects
-                .filter(date__gte=from_date, date__lte=until_date))
-    # Index holidays by day, then by country
-    holiday_data = {}
-    for holiday in holidays:
-        (holiday_data
-            .setdefault(str(holiday.date), {})
-            .setdefault(holiday.country, [])
-            .append(holiday))
-
-    # Fetch all activity performances for this period
-    activity_performances = (models.ActivityPerformance.objects
-                             .filter(date__gte=from_date, date__lte=until_date, timesheet__user__in=users)
-                             .select_related('performance_type', 'contract_role', 'contract',
-                                             'contract__customer', 'timesheet', 'timesheet__user'))
-    # Index activity performances by day, then by user ID
-    activity_performance_data = {}
-    for performance in activity_performances:
-        (activity_performance_data
-            .setdefault(str(performance.date), {})
-            .setdefault(performance.timesheet.user.id, [])
-            .append(performance))
-
-    # Fetch all standby performances for this period
-    standby_performances = (models.StandbyPerformance.objects
-                             .filter(date__gte=from_date, date__lte=until_date, timesheet__user__in=users)
-                            .select_related('contract', 'contract__customer', 'timesheet', 'timesheet__user'))
-    # Index standby performances by day, then by user ID
-    standby_performance_data = {}
-    for performance in standby_performances:
-        (standby_performance_data
-            .setdefault(str(performance.date), {})
-            .setdefault(performance.timesheet.user.id, [])
-            .append(performance))
+                   .values_list('starts_at', 'ends_at'))
+    for starts_at, ends_at in leave_dates:
+        month = (starts_at.year, starts_at.month)
+        used_overtime_hours[month] = (used_overtime_hours.get(month, 0) +
+                                      to_hundredths((ends_at - starts_at).total_seconds() / 3600))
+
+    checkpoints = []
+    for (year, month), (month_from_date, month_until_date) in zip(months, month_ranges):
+        totals = info.range_totals(month_from_date, month_until_date)
+        month_used_overtime_hours = from_hundredths(used_overtime_hours.get((year, month), 0))
+        balance += totals['overtime_hours'] - totals['remaining_hours'] - month_used_overtime_hours
+
+        checkpoint = models.UserOvertimeCheckpoint(
+            user=user,
+            year=year,
+            month=month,
+            overtime_hours=totals['overtime_hours'],
+            remaining_hours=totals['remaining_hours'],
+            used_overtime_hours=month_used_overtime_hours,
+            balance=balance,
+        )
+        # Bulk creation bypasses save(), so the polymorphic content type is set here
+        checkpoint.pre_save_polymorphic()
+        checkpoints.append(checkpoint)
+
+    with transaction.atomic():
+        invalidate_overtime_checkpoints([user], from_date)
+        models.UserOvertimeCheckpoint.objects.bulk_create(checkpoints, ignore_conflicts=True)
+
+    return checkpoints
+
+
+def invalidate_overtime_checkpoints(users=None, from_date=None):
+    """Remove overtime checkpoints from the month of the given date onwards, so they are recalculated when needed."""
+    checkpoints = models.UserOvertimeCheckpoint.objects.all()
+    if users is not None:
+        checkpoints = checkpoints.filter(user__in=users)
+    if from_date:
+        checkpoints = checkpoints.filter(Q(year__gt=from_date.year) |
+                                         Q(year=from_date.year, month__gte=from_date.month))
+    checkpoints.delete()
+
+
+def get_range_info(users, from_date, until_date, daily=False, detailed=False, summary=False, serialize=False,
+                   context=None, use_ledger=False, entities=None):
+    """
+    Determine and return range info.
+
+    With use_ledger, hours are read from the user day ledger instead of being calculated. This only applies to calls
+    without details or summary, which need the underlying objects.
+    With an EntityMap as entities, days and the summary refer to objects by ID, and the objects are added to the
+    entity map instead of being serialized.
+    """
+    if use_ledger and not (detailed or summary):
+        range_infos = get_ledger_range_infos(users, from_date, until_date, context=context)
+    else:
+        # Load calendar data, unless a shared context was passed in
+        context = context if context is not None else CalendarContext(users, from_date, until_date)
+        if detailed and serialize:
+            context.prefetch_leave_details()
+        range_infos = {user.id: calculate_user_range_info(user, from_date, until_date, context, detailed=detailed)
+                       for user in users}
+
+    # Results are indexed by user ID
+    res = {}
+    for user in users:
+        res[user.id] = range_infos[user.id].to_dict(daily=daily, detailed=detailed, summary=summary,
+                                                    serialize=serialize, entities=entities)
 
-    # Count days
-    day_count = (until_date - from_date).days + 1
+    return res
 
-    for user in users:
-        # Results are indexed by user ID
-        user_res = res[user.id] = {}
-        user_res['work_hours'] = 0
-        user_res['holiday_hours'] = 0
-        user_res['leave_hours'] = 0
-        user_res['pending_leave_hours'] = 0
-        user_res['performed_hours'] = 0
-        user_res['remaining_hours'] = 0
-        user_res['total_hours'] = 0
-        user_res['overtime_hours'] = 0
-        user_res['details'] = {}
-        user_res['summary'] = {
-            'performances': {},
-        }
 
-        # Iterate over days
-        for i in range(day_count):
-            # Determine date for this day
-            current_date = copy.deepcopy(from_date) + timedelta(days=i)
-
-            day_res = user_res['details'][str(current_date)] = {}
-            day_res['work_hours'] = 0
-            day_res['holiday_hours'] = 0
-            day_res['leave_hours'] = 0
-            day_res['pending_leave_hours'] = 0
-            day_res['performed_hours'] = 0
-            day_res['remaining_hours'] = 0
-            day_res['total_hours'] = 0
-            day_res['overtime_hours'] = 0
-            day_res['holidays'] = []
-            day_res['leaves'] = []
-            day_res['activity_performances'] = []
-            day_res['standby_performances'] = []
+def get_range_info_batch(requests, daily=False, detailed=False, summary=False, serialize=False, context=None):
+    """
+    Determine and return range info for many (user, from_date, until_date) requests at once.
 
-            # Get employment contract for this day
-            # This allows us to determine the work schedule and country of the user
-            employment_contract = None
-            try:
-                for ec in employment_contract_data[user.id]:
-                    if (ec.started_at <= current_date) and ((not ec.ended_at) or (ec.ended_at >= current_date)):
-                        employment_contract = ec
-                        break
-            except KeyError:
-                pass
-
-            work_schedule = employment_contract.work_schedule if employment_contract else None
-            country = employment_contract.company.country if employment_contract else None
-
-            # Work hours
-            if work_schedule:
-                duration = getattr(work_schedule, current_date.strftime('%A').lower(), Decimal('0.00'))
-                user_res['work_hours'] += duration
-                day_res['work_hours'] += duration
+    Calendar data is loaded once, over the users and the union of the ranges of all requests.
+    Results are returned as a list, in the order of the given requests.
+    """
+    requests = list(requests)
+    if detailed and serialize and requests:
+        context = context if context is not None else get_batch_calendar_context(requests)
+        context.prefetch_leave_details()
 
-            # Holidays
-            try:
-                if country and holiday_data[str(current_date)][country]:
-                    duration = getattr(work_schedule, current_date.strftime('%A').lower(), Decimal('0.00'))
-                    user_res['holiday_hours'] += duration
-                    day_res['holiday_hours'] += duration
-                    day_res['holidays'] += holiday_data[str(current_date)][country]
-            except KeyError:
-                pass
-
-            # Leave
-            try:
-                for leave_date in leave_date_data[str(current_date)][user.id]:
-                    duration = leave_date.duration
-                    if leave_date.leave.status == models.STATUS_APPROVED:
-                        user_res['leave_hours'] += duration
-                        day_res['leave_hours'] += duration
-                    else:
-                        user_res['pending_leave_hours'] += duration
-                        day_res['pending_leave_hours'] += duration
-                    day_res['leaves'].append(leave_date.leave)
-            except KeyError:
-                pass
-
-            # Activity performance
-            try:
-                for performance in activity_performance_data[str(current_date)][user.id]:
-                    duration = performance.normalized_duration
-                    user_res['performed_hours'] += duration
-                    day_res['performed_hours'] += duration
-                    day_res['activity_performances'].append(performance)
-                    user_res['summary']['performances'].setdefault(performance.contract.id, {
-                        'contract': performance.contract,
-                        'duration': 0,
-                        'standby_days': 0,
-                    })['duration'] += duration
-            except KeyError:
-                pass
-
-            # Standby performance
-            try:
-                for performance in standby_performance_data[str(current_date)][user.id]:
-                    day_res['standby_performances'].append(performance)
-                    user_res['summary']['performances'].setdefault(performance.contract.id, {
-                        'contract': performance.contract,
-                        'duration': 0,
-                        'standby_days': 0,
-                    })['standby_days'] += 1
-            except KeyError:
-                pass
-
-            day_res['total_hours'] = (day_res['holiday_hours'] + day_res['leave_hours'] + day_res['performed_hours'])
-            day_res['overtime_hours'] = abs(min(0, day_res['work_hours'] - day_res['total_hours']))
-            day_res['remaining_hours'] = max(0, day_res['work_hours'] - day_res['total_hours'])
-
-        user_res['total_hours'] = user_res['holiday_hours'] + user_res['leave_hours'] + user_res['performed_hours']
-        user_res['overtime_hours'] = abs(min(0, user_res['work_hours'] - user_res['total_hours']))
-        user_res['remaining_hours'] = max(0, user_res['work_hours'] - user_res['total_hours'])
-        user_res['summary']['performances'] = user_res['summary']['performances'].values()
-
-        if not summary:
-            user_res.pop('summary', None)
-        elif serialize:
-            for performance in user_res['summary']['performances']:
-                performance['contract'] = serializers.MinimalContractSerializer(performance['contract']).data
-
-        if not detailed:
-            for day, day_data in user_res['details'].items():
-                day_data.pop('leaves', None)
-                day_data.pop('holidays', None)
-                day_data.pop('activity_performances', None)
-                day_data.pop('standby_performances', None)
-        elif serialize:
-            for day, day_data in user_res['details'].items():
-                day_data['holidays'] = serializers.HolidaySerializer(day_data['holidays'], many=True).data
-                day_data['leaves'] = serializers.LeaveSerializer(day_data['leaves'], many=True).data
-                day_data['activity_performances'] = serializers.ActivityPerformanceSerializer(
-                    day_data['activity_performances'], many=True).data
-                day_data['standby_performances'] = serializers.StandbyPerformanceSerializer(
-                    day_data['standby_performances'], many=True).data
-
-        if not daily:
-            user_res.pop('details', None)
+    return [info.to_dict(daily=daily, detailed=detailed, summary=summary, serialize=serialize)
+            for info in get_user_range_info_batch(requests, detailed=detailed, context=context)]
+
+
+def get_user_range_info_batch(requests, detailed=False, context=None):
+    """
+    Calculate and return UserRangeInfo objects for many (user, from_date, until_date) requests at once.
+
+    The returned objects can be sliced into sub-ranges with UserRangeInfo.range_totals without any further queries.
+    """
+    requests = list(requests)
+    if not requests:
+        return []
+
+    context = context if context is not None else get_batch_calendar_context(requests)
+
+    return [calculate_user_range_info(user, from_date, until_date, context, detailed=detailed)
+            for user, from_date, until_date in requests]
+
+
+def get_batch_calendar_context(requests):
+    """Get a calendar context covering the users and the union of the ranges of the given requests."""
+    users = list({user.id: user for user, from_date, until_date in requests}.values())
+    from_date = min([x[1] for x in requests])
+    until_date = max([x[2] for x in requests])
+    return CalendarContext(users, from_date, until_date)
+
+
+def get_timesheet_range_info_batch(timesheets, daily=False, summary=False):
+    """
+    Determine and return the range info of the months of the given timesheets, as get_range_info_batch would.
+
+    Closed timesheets are served from their snapshots, which are created first for those which have none yet.
+    Results are returned as a list, in the order of the given timesheets.
+    """
+    timesheets = list(timesheets)
+
+    closed_timesheets = [x for x in timesheets if x.status == models.STATUS_CLOSED]
+    snapshots = {x.timesheet_id: x for x in models.TimesheetSnapshot.objects.filter(timesheet__in=closed_timesheets)}
+    missing_timesheets = [x for x in closed_timesheets if x.id not in snapshots]
+    if missing_timesheets:
+        snapshots.update(create_timesheet_snapshots(missing_timesheets))
+
+    timesheets_to_calculate = [x for x in timesheets if x.id not in snapshots]
+    range_infos = get_range_info_batch([(x.user, *x.get_date_range()) for x in timesheets_to_calculate],
+                                       daily=daily, summary=summary)
+    range_infos = dict(zip([x.id for x in timesheets_to_calculate], range_infos))
+
+    # Contracts are loaded the same way as CalendarContext.contract_data does
+    contracts = {}
+    if summary and snapshots:
+        contract_ids = {x['contract'] for snapshot in snapshots.values() for x in snapshot.contract_summary}
+        contracts = (models.Contract.objects
+                     .non_polymorphic()
+                     .filter(id__in=contract_ids)
+                     .select_related('customer', 'company'))
+        contracts = {contract.id: contract for contract in contracts}
+
+    return [range_infos[x.id] if x.id in range_infos else
+            get_timesheet_snapshot_range_info(snapshots[x.id], daily=daily, summary=summary, contracts=contracts)
+            for x in timesheets]
+
+
+def create_timesheet_snapshots(timesheets):
+    """Calculate and store snapshots of the given closed timesheets, and return them indexed by timesheet ID."""
+    timesheets = list(timesheets)
+    user_range_infos = get_user_range_info_batch([(x.user, *x.get_date_range()) for x in timesheets])
+
+    snapshots = {}
+    for timesheet, info in zip(timesheets, user_range_infos):
+        snapshot = models.TimesheetSnapshot(
+            timesheet=timesheet,
+            range_info=info.to_dict(daily=True, summary=True, serialize=True),
+            contract_summary=[{
+                'contract': performance['contract'].id,
+                'duration': from_hundredths(performance['duration']),
+                'standby_days': performance['standby_days'],
+            } for performance in info.performance_summary.values()],
+        )
+        # Bulk creation bypasses save(), so the polymorphic content type is set here
+        snapshot.pre_save_polymorphic()
+        snapshots[timesheet.id] = snapshot
+
+    models.TimesheetSnapshot.objects.bulk_create(list(snapshots.values()), ignore_conflicts=True)
+
+    return snapshots
+
+
+def get_timesheet_snapshot_range_info(snapshot, daily=False, summary=False, serialize=False, contracts=None):
+    """
+    Get the range info stored in a timesheet snapshot, as get_range_info would return it.
+
+    Without serialize, the summary holds the contract objects from contracts, indexed by ID.
+    """
+    res = {field: Decimal(snapshot.range_info[field]) for field in UserRangeInfo.HOUR_FIELDS}
+
+    if daily:
+        res['details'] = {day: {field: Decimal(day_res[field]) for field in UserRangeInfo.HOUR_FIELDS}
+                          for day, day_res in snapshot.range_info['details'].items()}
+
+    if summary:
+        if serialize:
+            performances = [dict(performance, duration=Decimal(performance['duration']))
+                            for performance in snapshot.range_info['summary']['performances']]
+        else:
+            performances = [dict(performance, contract=contracts.get(performance['contract']),
+                                 duration=Decimal(performance['duration']))
+                            for performance in snapshot.contract_summary]
+        res['summary'] = {'performances': performances}
 
     return res
+
+
+def invalidate_timesheet_snapshots(users=None, from_date=None, until_date=None):
+    """Remove the snapshots of the timesheets of the given users in the given range, so they are recreated."""
+    snapshots = models.TimesheetSnapshot.objects.all()
+    if users is not None:
+        snapshots = snapshots.filter(timesheet__user__in=users)
+    if from_date:
+        snapshots = snapshots.filter(Q(timesheet__year__gt=from_date.year) |
+                                     Q(timesheet__year=from_date.year, timesheet__month__gte=from_date.month))
+    if until_date:
+        snapshots = snapshots.filter(Q(timesheet__year__lt=until_date.year) |
+                                     Q(timesheet__year=until_date.year, timesheet__month__lte=until_date.month))
+    snapshots.delete()
+
+
+def get_snapshot_range_info(user, from_date, until_date, daily=False, summary=False):
+    """
+    Get the serialized range info of the given user from a timesheet snapshot, if any.
+
+    This only applies to ranges covering exactly the month of a closed timesheet. Snapshots which were removed
+    because the data they were calculated from changed are recreated first.
+    """
+    if (from_date.day != 1) or (until_date != month_date_range(from_date.year, from_date.month)[1]):
+        return None
+
+    timesheet = (models.Timesheet.objects
+                 .filter(user=user, year=from_date.year, month=from_date.month, status=models.STATUS_CLOSED)
+                 .select_related('user', 'timesheetsnapshot')
+                 .first())
+    if not timesheet:
+        return None
+
+    try:
+        snapshot = timesheet.timesheetsnapshot
+    except models.TimesheetSnapshot.DoesNotExist:
+        snapshot = create_timesheet_snapshots([timesheet])[timesheet.id]
+
+    return get_timesheet_snapshot_range_info(snapshot, daily=daily, summary=summary, serialize=True)
+
+
+def iter_range_info(users, from_date, until_date, daily=False, detailed=False, summary=False, serialize=False,
+                    chunk_size=25):
+    """
+    Determine range info, yielding it one user at a time.
+
+    Calendar data is loaded per chunk of users and daily details are produced lazily, so the result can be streamed
+    without building it in memory as a whole.
+    """
+    users = list(users)
+
+    for i in range(0, len(users), chunk_size):
+        chunk = users[i:i + chunk_size]
+        context = CalendarContext(chunk, from_date, until_date)
+        if detailed and serialize:
+            context.prefetch_leave_details()
+
+        for user in chunk:
+            info = calculate_user_range_info(user, from_date, until_date, context, detailed=detailed)
+            yield user.id, info.to_dict(daily=daily, detailed=detailed, summary=summary, serialize=serialize,
+                                        stream=True)
+
+
+def get_range_info_parallel(users, from_date, until_date, daily=False, detailed=False, summary=False,
+                            serialize=False, shard_size=25, max_workers=None):
+    """
+    Determine and return range info, calculating shards of users in parallel worker processes.
+
+    Workers are forked, so they share the configuration of this process, and each opens its own database
+    connection. The connections of this process are closed before forking so they are never shared with a worker,
+    they are reopened when next used. Workers only see committed data.
+
+    This is meant for management commands and batch jobs. Inside a transaction, such as a request with
+    ATOMIC_REQUESTS, closing the connections would drop the transaction, so range info is calculated in this process
+    instead.
+    """
+    users = list(users)
+    user_ids = [user.id for user in users]
+    shards = [user_ids[i:i + shard_size] for i in range(0, len(user_ids), shard_size)]
+    options = {
+        'daily': daily,
+        'detailed': detailed,
+        'summary': summary,
+        'serialize': serialize,
+    }
+
+    # A single shard is not worth the overhead of a worker process
+    if (len(shards) <= 1) or (max_workers == 1) or any(x.in_atomic_block for x in connections.all()):
+        return get_range_info(users, from_date, until_date, **options)
+
+    res = {}
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('fork')) as executor:
+        futures = [executor.submit(calculate_range_info_shard, shard, from_date, until_date, options)
+                   for shard in shards]
+        for future in futures:
+            res.update(future.result())
+
+    # Results are indexed by user ID, in the order of the given users
+    return {user.id: res[user.id] for user in users}
+
+
+def calculate_range_info_shard(user_ids, from_date, until_date, options):
+    """Determine and return range info for a shard of users, in a worker process."""
+    try:
+        users = list(auth_models.User.objects.filter(id__in=user_ids))
+        return get_range_info(users, from_date, until_date, **options)
+    finally:
+        connections.close_all()
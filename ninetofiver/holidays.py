@@ -0,0 +1,101 @@
+"""Holiday calendar."""
+import uuid
+from django.core.cache import cache
+from django.db import transaction
+from ninetofiver import models
+from ninetofiver.request_cache import get_request_cache, memoize
+
+
+class HolidayCalendar(object):
+    """
+    Holidays per country and year, cached in the Django cache and in process memory.
+
+    Cached holidays are stored under a shared version, which is replaced on invalidation. The version is read once per
+    request, so holidays kept in the memory of a process are dropped by the first request which sees a new version.
+    Other processes only see a new version through a cache backend they share, such as the database cache used in
+    production.
+    """
+
+    VERSION_CACHE_KEY = 'holiday_calendar_version'
+    CACHE_KEY = 'holiday_calendar_%s_%s_%s'
+    CACHE_TIMEOUT = 60 * 60 * 24
+
+    def __init__(self):
+        self.memory = {}
+
+    def get_version(self):
+        """Get the current version of the cached holidays, read once per request."""
+        return memoize((self.VERSION_CACHE_KEY,), self.read_version)
+
+    def read_version(self):
+        """Read the current version of the cached holidays from the Django cache."""
+        version = cache.get(self.VERSION_CACHE_KEY)
+        if version is None:
+            version = uuid.uuid4().hex
+            if not cache.add(self.VERSION_CACHE_KEY, version, None):
+                version = cache.get(self.VERSION_CACHE_KEY, version)
+        return version
+
+    def get_year(self, country, year, version=None):
+        """Get the holidays of the given country and year, indexed by day."""
+        version = version if version is not None else self.get_version()
+        key = (str(country), year)
+
+        entry = self.memory.get(key)
+        if entry and (entry[0] == version):
+            return entry[1]
+
+        cache_key = self.CACHE_KEY % (version, key[0], year)
+        holidays = cache.get(cache_key)
+        if holidays is None:
+            holidays = list(models.Holiday.objects.filter(country=key[0], date__year=year).order_by('id'))
+            cache.set(cache_key, holidays, self.CACHE_TIMEOUT)
+
+        holiday_data = {}
+        for holiday in holidays:
+            holiday_data.setdefault(holiday.date, []).append(holiday)
+        self.memory[key] = (version, holiday_data)
+
+        return holiday_data
+
+    def get_holidays(self, country, date):
+        """Get the holidays of the given country on the given date."""
+        return self.get_year(country, date.year).get(date, [])
+
+    def get_range(self, countries, from_date, until_date):
+        """Get the holidays of the given countries in the given range, indexed by country, then by day."""
+        version = self.get_version()
+        res = {}
+
+        for country in countries:
+            country_holiday_data = res.setdefault(str(country), {})
+            for year in range(from_date.year, until_date.year + 1):
+                for date, holidays in self.get_year(country, year, version=version).items():
+                    if from_date <= date <= until_date:
+                        country_holiday_data[date] = holidays
+
+        return res
+
+    def invalidate(self):
+        """
+        Drop all cached holidays.
+
+        This is repeated once the current transaction is committed, in case another process cached holidays before
+        that.
+        """
+        self.replace_version()
+        transaction.on_commit(self.replace_version)
+
+    def replace_version(self):
+        """Replace the shared version of the cached holidays."""
+        version = uuid.uuid4().hex
+        cache.set(self.VERSION_CACHE_KEY, version, None)
+        self.memory.clear()
+
+        # The rest of the current request uses the new version as well
+        request_cache = get_request_cache()
+        if request_cache is not None:
+            request_cache.set((self.VERSION_CACHE_KEY,), version)
+
+
+holiday_calendar = HolidayCalendar()
@@ -0,0 +1,75 @@
+"""Benchmark calculation."""
+import json
+import logging
+from dateutil import parser
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ninetofiver.benchmark import FUNCTIONS, SCALES, compare_results, run_benchmark
+
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Benchmark calculation functions on generated datasets."""
+
+    args = ''
+    help = ('Populate datasets at several scales, time calculation functions across user counts and range lengths and '
+            'write the results to stdout or a file as JSON. Generated data is rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=str, action='append', default=[], choices=list(SCALES),
+                            help='Scale of the generated dataset, can be given multiple times, defaults to small')
+        parser.add_argument('--users', type=int, action='append', default=[],
+                            help='Amount of users to calculate, can be given multiple times, defaults to 1 and 10')
+        parser.add_argument('--days', type=int, action='append', default=[],
+                            help='Length of the range in days, can be given multiple times, defaults to 7, 31 and 365')
+        parser.add_argument('--function', type=str, action='append', default=[], choices=list(FUNCTIONS),
+                            help='Function to benchmark, can be given multiple times, defaults to all functions')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Amount of times every function is timed')
+        parser.add_argument('--seed', type=int, default=925,
+                            help='Seed used to generate the datasets')
+        parser.add_argument('--from-date', type=str, default=None,
+                            help='First date of the ranges, defaults to the start of the current month')
+        parser.add_argument('--output', type=str, default=None,
+                            help='Path of the file to write the results to, defaults to stdout')
+        parser.add_argument('--baseline', type=str, default=None,
+                            help='Path of a results file to compare the results against')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Fraction by which a result may be slower than its baseline')
+
+    def handle(self, *args, **options):
+        """Benchmark calculation functions on generated datasets."""
+        if not settings.DEBUG:
+            raise CommandError('Benchmarks generate test data and can only be run with DEBUG enabled')
+
+        from_date = parser.parse(options['from_date']).date() if options['from_date'] else None
+
+        results = run_benchmark(scales=options['scale'] or ['small'], user_counts=options['users'] or [1, 10],
+                                range_lengths=options['days'] or [7, 31, 365],
+                                functions=options['function'] or None, repeat=max(1, options['repeat']),
+                                seed=options['seed'], from_date=from_date)
+        log.info('Ran %s benchmarks' % len(results['results']))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+        else:
+            self.stdout.write(json.dumps(results, indent=2))
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+            comparisons = compare_results(results, baseline, tolerance=options['tolerance'])
+            for comparison in comparisons:
+                self.stderr.write('%s%s, %s users, %s days, %s: %sx time, %s queries (baseline %s)' % (
+                    'REGRESSION ' if comparison['regression'] else '', comparison['scale'], comparison['users'],
+                    comparison['days'], comparison['function'],
+                    '%.2f' % comparison['ratio'] if comparison['ratio'] is not None else '-',
+                    comparison['queries'], comparison['baseline_queries']))
+
+            regressions = [x for x in comparisons if x['regression']]
+            if regressions:
+                raise CommandError('%s of %s benchmarks regressed' % (len(regressions), len(comparisons)))
@@ -0,0 +1,55 @@
+"""Calculate range info."""
+import datetime
+import json
+import logging
+from dateutil import parser
+from django.core.management.base import BaseCommand
+from django.contrib.auth import models as auth_models
+from rest_framework.utils.encoders import JSONEncoder
+from ninetofiver.calculation import get_range_info_parallel
+
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Calculate range info for many users in parallel."""
+
+    args = ''
+    help = 'Calculate range info for all active users, or the given users, and write it to stdout as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from-date', type=str, default=None,
+                            help='First date of the range, defaults to the start of the current year')
+        parser.add_argument('--until-date', type=str, default=None,
+                            help='Last date of the range, defaults to the end of the current year')
+        parser.add_argument('--user', type=int, action='append', default=[],
+                            help='ID of a user to calculate, can be given multiple times')
+        parser.add_argument('--daily', action='store_true', default=False,
+                            help='Include daily details')
+        parser.add_argument('--summary', action='store_true', default=False,
+                            help='Include a summary of performances per contract')
+        parser.add_argument('--shard-size', type=int, default=25,
+                            help='Amount of users to calculate in each worker process')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Amount of worker processes, defaults to the amount of CPUs')
+
+    def handle(self, *args, **options):
+        """Calculate range info for many users in parallel."""
+        today = datetime.date.today()
+        from_date = today.replace(month=1, day=1)
+        if options['from_date']:
+            from_date = parser.parse(options['from_date']).date()
+        until_date = today.replace(month=12, day=31)
+        if options['until_date']:
+            until_date = parser.parse(options['until_date']).date()
+
+        users = auth_models.User.objects.all().order_by('id')
+        users = users.filter(id__in=options['user']) if options['user'] else users.filter(is_active=True)
+
+        range_info = get_range_info_parallel(users, from_date, until_date, daily=options['daily'],
+                                             summary=options['summary'], serialize=True,
+                                             shard_size=max(1, options['shard_size']), max_workers=options['workers'])
+        log.info('Calculated range info for %s users' % len(range_info))
+
+        self.stdout.write(json.dumps(range_info, cls=JSONEncoder))
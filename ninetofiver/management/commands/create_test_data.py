@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand
-from ninetofiver.test_db_populator import TestDBPupulator
+from ninetofiver.test_db_populator import BulkDBPopulator, TestDBPupulator
 
 
 class Command(BaseCommand):
@@ -16,10 +16,34 @@ class Command(BaseCommand):
             choices=['small', 'normal', 'extensive'],
             default="normal"
         )
+        parser.add_argument(
+            "--bulk",
+            action="store_true",
+            default=False,
+            help="Generate a large dataset using bulk inserts, bypassing validation"
+        )
+        parser.add_argument("--users", type=int, default=2000, help="Amount of users to generate in bulk mode")
+        parser.add_argument("--years", type=int, default=5, help="Amount of years to generate in bulk mode")
+        parser.add_argument(
+            "--performances",
+            type=int,
+            default=5000000,
+            help="Approximate amount of performances to generate in bulk mode"
+        )
+        parser.add_argument("--seed", type=int, default=925, help="Seed used to generate data in bulk mode")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Amount of rows per insert in bulk mode")
 
     def handle(self, *args, **options):
         """Create a new timesheet for the current month for each user."""
-        if options["ammount"] == "small":
+        if options["bulk"]:
+            BulkDBPopulator(
+                users=options["users"],
+                years=options["years"],
+                performances=options["performances"],
+                seed=options["seed"],
+                chunk_size=max(1, options["chunk_size"]),
+            ).execute()
+        elif options["ammount"] == "small":
             TestDBPupulator(10, 50).execute()
         elif options["ammount"] == "normal":
             TestDBPupulator(70, 350).execute()
@@ -0,0 +1,23 @@
+"""Prune deleted objects."""
+import datetime
+import logging
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ninetofiver import models
+
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Remove journaled deletions which are older than the sync deletion retention period."""
+
+    args = ''
+    help = 'Remove journaled deletions which syncing clients no longer ask for'
+
+    def handle(self, *args, **options):
+        """Remove journaled deletions which are older than the sync deletion retention period."""
+        until = timezone.now() - datetime.timedelta(days=settings.SYNC_DELETION_RETENTION_DAYS)
+        count = models.DeletedObject.objects.filter(created_at__lt=until).delete()[0]
+        log.info('Removed %s journaled deletions' % count)
@@ -0,0 +1,63 @@
+"""Rebuild the user day ledger."""
+import datetime
+import logging
+from dateutil import parser
+from django.core.management.base import BaseCommand
+from django.contrib.auth import models as auth_models
+from django.db.models import Min
+from ninetofiver import models
+from ninetofiver.calculation import refresh_user_day_ledger
+from ninetofiver.request_cache import request_cache
+
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Rebuild the user day ledger."""
+
+    args = ''
+    help = 'Recalculate the user day ledger for all users, or for the given users and date range'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from-date', type=str, default=None,
+                            help='First date to rebuild, defaults to the start of the earliest employment contract')
+        parser.add_argument('--until-date', type=str, default=None,
+                            help='Last date to rebuild, defaults to today')
+        parser.add_argument('--user', type=int, action='append', default=[],
+                            help='ID of a user to rebuild, can be given multiple times')
+        parser.add_argument('--chunk-size', type=int, default=25,
+                            help='Amount of users to recalculate at once')
+
+    def handle(self, *args, **options):
+        """Rebuild the user day ledger."""
+        users = auth_models.User.objects.all().order_by('id')
+        if options['user']:
+            users = users.filter(id__in=options['user'])
+        users = list(users)
+
+        from_date = parser.parse(options['from_date']).date() if options['from_date'] else None
+        if not from_date:
+            from_date = (models.EmploymentContract.objects
+                         .filter(user__in=users)
+                         .aggregate(from_date=Min('started_at'))['from_date'])
+        until_date = parser.parse(options['until_date']).date() if options['until_date'] else datetime.date.today()
+
+        if (not from_date) or (until_date < from_date):
+            log.info('Nothing to rebuild')
+            return
+
+        # Rebuild in chunks of users and years, so memory use stays bounded for long histories
+        chunk_size = max(1, options['chunk_size'])
+        with request_cache() as cache:
+            for i in range(0, len(users), chunk_size):
+                chunk = users[i:i + chunk_size]
+                chunk_from_date = from_date
+                while chunk_from_date <= until_date:
+                    chunk_until_date = min(until_date, chunk_from_date.replace(month=12, day=31))
+                    refresh_user_day_ledger(chunk, chunk_from_date, chunk_until_date)
+                    chunk_from_date = chunk_until_date + datetime.timedelta(days=1)
+
+                log.info('Rebuilt user day ledger for users %s to %s' % (chunk[0], chunk[-1]))
+
+        log.debug('Request cache: %s' % cache.get_stats())
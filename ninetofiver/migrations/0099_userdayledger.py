@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-18 09:12
+
+from django.conf import settings
+import dirtyfields.dirtyfields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ninetofiver', '0098_event_help_text_alter_event_ends_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDayLedger',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('date', models.DateField()),
+                ('work_hours', models.DecimalField(decimal_places=2, default=0.0, max_digits=6)),
+                ('holiday_hours', models.DecimalField(decimal_places=2, default=0.0, max_digits=6)),
+                ('leave_hours', models.DecimalField(decimal_places=2, default=0.0, max_digits=6)),
+                ('pending_leave_hours', models.DecimalField(decimal_places=2, default=0.0, max_digits=6)),
+                ('performed_hours', models.DecimalField(decimal_places=2, default=0.0, max_digits=6)),
+                ('standby_count', models.PositiveIntegerField(default=0)),
+                ('polymorphic_ctype', models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='polymorphic_%(app_label)s.%(class)s_set+', to='contenttypes.contenttype')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+                'abstract': False,
+                'base_manager_name': 'objects',
+                'unique_together': {('user', 'date')},
+            },
+            bases=(dirtyfields.dirtyfields.DirtyFieldsMixin, models.Model),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2 on 2026-10-18 15:20
+
+import django.core.serializers.json
+import dirtyfields.dirtyfields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('ninetofiver', '0100_userovertimecheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimesheetSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('range_info', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('contract_summary', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('polymorphic_ctype', models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='polymorphic_%(app_label)s.%(class)s_set+', to='contenttypes.contenttype')),
+                ('timesheet', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='ninetofiver.timesheet')),
+            ],
+            options={
+                'ordering': ['id'],
+                'abstract': False,
+                'base_manager_name': 'objects',
+            },
+            bases=(dirtyfields.dirtyfields.DirtyFieldsMixin, models.Model),
+        ),
+    ]
@@ -12,7 +12,8 @@ from django.contrib.auth import models as auth_models
 from django.contrib.auth.models import User
 from django.core import validators
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connections, models, router
 from django.urls import reverse
 from django.utils.translation import gettext as _
 from django.utils import timezone
@@ -23,6 +24,8 @@ from polymorphic.models import PolymorphicManager
 from polymorphic.models import PolymorphicModel
 from recurrence.fields import RecurrenceField
 
+from ninetofiver.request_cache import memoize
+
 log = logging.getLogger(__name__)
 
 
@@ -59,6 +62,9 @@ PERIOD_WEEKLY = 'weekly'
 PERIOD_MONTHLY = 'monthly'
 PERIOD_YEARLY = 'yearly'
 
+# Weekdays, ordered like date.weekday()
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
 # Permissions
 PERMISSION_RECEIVE_PENDING_LEAVE_REMINDER = 'receive_pending_leave_reminder'
 PERMISSION_RECEIVE_MODIFIED_ATTACHMENT_NOTIFICATION = 'receive_modified_attachment_notification'
@@ -68,6 +74,58 @@ PERMISSION_RECEIVE_BDAY_ANNIVERSARY_REMINDER = 'receive_bday_anniversary_reminde
 class BaseManager(PolymorphicManager):
     """Base manager."""
 
+    def bulk_create_polymorphic(self, objs):
+        """
+        Insert objects of subclasses of the model, with a single insert per subclass table.
+
+        The bulk_create method of Django does not support multi-table inheritance. Here, the rows of the model are
+        inserted first and their IDs are copied to the parent links of the subclass rows. On databases which cannot
+        return the IDs of all rows of an insert, such as MySQL, the rows of the model are inserted one by one, as the
+        IDs of a single insert are not guaranteed to be consecutive. Rows are inserted through QuerySet._insert, like
+        bulk_create does, and related objects should be saved before.
+        Validation and signals are bypassed, so callers should invalidate what the signals of the objects would.
+        """
+        objs = list(objs)
+        if not objs:
+            return objs
+
+        using = router.db_for_write(self.model)
+        now = timezone.now()
+        for obj in objs:
+            for field in obj._meta.concrete_fields:
+                if field.is_relation and field.is_cached(obj) and (getattr(obj, field.name) is not None):
+                    setattr(obj, field.attname, getattr(obj, field.name).pk)
+            obj.pre_save_polymorphic(using=using)
+            obj.created_at = obj.updated_at = now
+
+        queryset = self.model._base_manager.using(using)
+        fields = [x for x in self.model._meta.local_concrete_fields if not x.primary_key]
+        returning_fields = [self.model._meta.pk]
+        if connections[using].features.can_return_rows_from_bulk_insert:
+            rows = queryset._insert(objs, fields=fields, returning_fields=returning_fields, raw=True, using=using)
+        else:
+            rows = [queryset._insert([obj], fields=fields, returning_fields=returning_fields, raw=True,
+                                     using=using)[0] for obj in objs]
+        ids = [row[0] for row in rows]
+        if (len(ids) != len(objs)) or (None in ids):
+            raise DatabaseError('Could not determine the IDs of the inserted objects.')
+
+        subclass_objs = {}
+        for obj, pk in zip(objs, ids):
+            for model in [obj.__class__] + obj._meta.get_parent_list():
+                setattr(obj, model._meta.pk.attname, pk)
+            obj._state.adding = False
+            obj._state.db = using
+            subclass_objs.setdefault(obj.__class__, []).append(obj)
+
+        for model, model_objs in subclass_objs.items():
+            chain = list(reversed(model._meta.get_parent_list())) + [model]
+            for chain_model in chain[chain.index(self.model) + 1:]:
+                chain_model._base_manager.using(using)._insert(
+                    model_objs, fields=chain_model._meta.local_concrete_fields, raw=True, using=using)
+
+        return objs
+
 
 class BaseModel(DirtyFieldsMixin, PolymorphicModel):
     """Abstract base model."""
@@ -265,6 +323,11 @@ class WorkSchedule(BaseModel):
         """Return a string representation."""
         return self.name
 
+    @property
+    def weekday_hours(self):
+        """Get the hours to work on each weekday, indexed like date.weekday()."""
+        return tuple(getattr(self, weekday) for weekday in WEEKDAYS)
+
 
 class EmploymentContractType(BaseModel):
     """Employment contract type model."""
@@ -987,6 +1050,11 @@ class ContractUserWorkSchedule(BaseModel):
         """Return a string representation."""
         return '%s - %s' % (self.contract_user, self.starts_at)
 
+    @property
+    def weekday_hours(self):
+        """Get the hours to work on each weekday, indexed like date.weekday()."""
+        return tuple(getattr(self, weekday) for weekday in WEEKDAYS)
+
     def perform_additional_validation(self):
         """Perform additional validation on the object."""
         super().perform_additional_validation()
@@ -1176,15 +1244,18 @@ class ActivityPerformance(Performance):
 
         if self.contract and self.contract_role:
             # Ensure the contract role is valid for the contract and contract_user
-            allowed = ContractUser.objects.filter(contract=self.contract, user=self.timesheet.user,
-                                                  contract_role=self.contract_role).count()
-            if not allowed:
+            allowed_contract_role_ids = memoize(
+                ('contract_user_contract_role_ids', self.contract.id, self.timesheet.user.id),
+                lambda: set(ContractUser.objects.filter(contract=self.contract, user=self.timesheet.user)
+                            .values_list('contract_role', flat=True)))
+            if self.contract_role.id not in allowed_contract_role_ids:
                 raise ValidationError({'contract_role':
                                            _('The selected contract role is not valid for that user on that contract.')})
 
         if self.contract:
             # Ensure the performance type is valid for the contract
-            allowed_types = list(self.contract.performance_types.all())
+            allowed_types = memoize(('contract_performance_types', self.contract.id),
+                                    lambda: list(self.contract.performance_types.all()))
             active = self.contract.active
 
             if allowed_types and (self.performance_type not in allowed_types):
@@ -1212,12 +1283,11 @@ class StandbyPerformance(Performance):
         super().perform_additional_validation()
 
         # Check whether the user already has a standby planned during this time frame
-        existing = self.__class__.objects.filter(contract=self.contract, timesheet=self.timesheet, date=self.date)
-
-        if self.pk:
-            existing = existing.exclude(id=self.pk)
-
-        existing = existing.count()
+        existing_ids = memoize(('standby_performance_ids', self.contract_id, self.timesheet_id, self.date),
+                               lambda: set(self.__class__.objects
+                                           .filter(contract=self.contract, timesheet=self.timesheet, date=self.date)
+                                           .values_list('id', flat=True)))
+        existing = len(existing_ids - {self.pk})
 
         if existing:
             raise ValidationError({'date':
@@ -1418,3 +1488,94 @@ class Quote(BaseModel):
             return True
     
         return False
+
+
+class UserDayLedger(BaseModel):
+    """
+    User day ledger model.
+
+    Holds the calculated hours of a user for a single day, so range info can be read without recalculating it.
+    Rows are removed by signals whenever the data they were calculated from changes, and are recalculated the next
+    time they are needed.
+
+    """
+
+    user = models.ForeignKey(auth_models.User, on_delete=models.CASCADE)
+    date = models.DateField()
+    work_hours = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
+    holiday_hours = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
+    leave_hours = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
+    pending_leave_hours = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
+    performed_hours = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
+    standby_count = models.PositiveIntegerField(default=0)
+
+    class Meta(BaseModel.Meta):
+        unique_together = (('user', 'date'),)
+
+    def __str__(self):
+        """Return a string representation."""
+        return '%s - %s' % (self.user, self.date)
+
+
+class UserOvertimeCheckpoint(BaseModel):
+    """
+    User overtime checkpoint model.
+
+    Holds the overtime of a user for a single month, along with the running overtime balance up to and including that
+    month. Checkpoints are kept for consecutive months. Signals remove them from the first month whose data changes
+    onwards, and they are recalculated the next time they are needed.
+
+    """
+
+    user = models.ForeignKey(auth_models.User, on_delete=models.CASCADE)
+    year = models.PositiveIntegerField()
+    month = models.PositiveIntegerField()
+    overtime_hours = models.DecimalField(max_digits=8, decimal_places=2, default=0.00)
+    remaining_hours = models.DecimalField(max_digits=8, decimal_places=2, default=0.00)
+    used_overtime_hours = models.DecimalField(max_digits=8, decimal_places=2, default=0.00)
+    balance = models.DecimalField(max_digits=8, decimal_places=2, default=0.00)
+
+    class Meta(BaseModel.Meta):
+        unique_together = (('user', 'year', 'month'),)
+
+    def __str__(self):
+        """Return a string representation."""
+        return '%s - %04d-%02d' % (self.user, self.year, self.month)
+
+
+class TimesheetSnapshot(BaseModel):
+    """
+    Timesheet snapshot model.
+
+    Holds the range info of the month of a closed timesheet, so it is not recalculated every time it is needed.
+    The snapshot is removed when the timesheet is reactivated, and whenever the hours of its month are invalidated
+    because data it was calculated from changed, such as leave, holidays or work schedules. Removed snapshots are
+    recreated the next time the range info of a closed timesheet is needed.
+
+    """
+
+    timesheet = models.OneToOneField(Timesheet, on_delete=models.CASCADE)
+    range_info = models.JSONField(encoder=DjangoJSONEncoder)
+    contract_summary = models.JSONField(encoder=DjangoJSONEncoder)
+
+    def __str__(self):
+        """Return a string representation."""
+        return str(self.timesheet)
+
+
+class DeletedObject(BaseModel):
+    """
+    Deleted object model.
+
+    Journals the deletion of an object of a user, so clients syncing their copies of it can delete it as well.
+    Entries are pruned once they are older than the sync deletion retention period.
+
+    """
+
+    user = models.ForeignKey(auth_models.User, on_delete=models.CASCADE)
+    object_type = models.CharField(max_length=255)
+    object_id = models.PositiveIntegerField()
+
+    def __str__(self):
+        """Return a string representation."""
+        return '%s - %s %s' % (self.user, self.object_type, self.object_id)
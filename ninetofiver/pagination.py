@@ -1,4 +1,12 @@
+import json
+from base64 import b64decode, b64encode
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
 
 
 class CustomizablePageNumberPagination(pagination.PageNumberPagination):
@@ -8,3 +16,96 @@ class CustomizablePageNumberPagination(pagination.PageNumberPagination):
     page_size = 25
     page_size_query_param = 'page_size'
     max_page_size = 1000
+
+
+class KeysetCursorPagination(pagination.CursorPagination):
+
+    """
+    Cursor pagination which continues after the values of the ordering fields of the last object on a page.
+
+    Objects are ordered by the cursor_ordering of the view, which should end with a unique field. Pages are fetched
+    with a single query without counting or skipping rows, so every page is equally fast. Only next links are given.
+    """
+
+    page_size = 25
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = ('id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+
+        results = list(queryset[:page_size + 1])
+        self.has_next = len(results) > page_size
+        self.page = results[:page_size]
+
+        return self.page
+
+    def get_position_filter(self, position):
+        """Get a filter for objects which come after the given values of the ordering fields."""
+        filters = []
+        for i, field in enumerate(self.ordering):
+            lookups = {x.lstrip('-'): value for x, value in zip(self.ordering[:i], position)}
+            lookups['%s__%s' % (field.lstrip('-'), 'lt' if field.startswith('-') else 'gt')] = position[i]
+            filters.append(Q(**lookups))
+        return reduce(lambda x, y: x | y, filters)
+
+    def decode_cursor(self, request, model):
+        """Get the values of the ordering fields of the given model from the cursor in the request, if any."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            position = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(position, list)) or (len(position) != len(self.ordering)):
+            raise NotFound(self.invalid_cursor_message)
+
+        try:
+            return [model._meta.get_field(x.lstrip('-')).to_python(value) for x, value in zip(self.ordering, position)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_cursor(self, obj):
+        """Get a cursor for the values of the ordering fields of the given object."""
+        position = [obj._meta.get_field(x.lstrip('-')).value_to_string(obj) for x in self.ordering]
+        return b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+    def get_next_link(self):
+        if not (self.has_next and self.page):
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param,
+                                   self.get_cursor(self.page[-1]))
+
+    def get_previous_link(self):
+        return None
+
+
+class OptionalCursorPagination(CustomizablePageNumberPagination):
+
+    """Page number pagination which switches to keyset cursor pagination when a cursor parameter is given."""
+
+    cursor_pagination_class = KeysetCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_pagination = None
+        if self.cursor_pagination_class.cursor_query_param in request.query_params:
+            self.cursor_pagination = self.cursor_pagination_class()
+            return self.cursor_pagination.paginate_queryset(queryset, request, view=view)
+
+        return super().paginate_queryset(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+
+        return super().get_paginated_response(data)
@@ -0,0 +1,104 @@
+"""Request cache."""
+import contextvars
+import logging
+from contextlib import contextmanager
+
+
+log = logging.getLogger(__name__)
+
+active_request_cache = contextvars.ContextVar('ninetofiver_request_cache', default=None)
+
+
+class RequestCache(object):
+    """Memoized values, kept for the duration of a single request or command run."""
+
+    def __init__(self):
+        self._values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_set(self, key, func):
+        """Get the value for the given key, calculating it with func if it is not known yet."""
+        try:
+            value = self._values[key]
+        except KeyError:
+            self.misses += 1
+            value = self._values[key] = func()
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Memoize the given value for the given key."""
+        self._values[key] = value
+
+    def invalidate(self, prefix):
+        """Forget the memoized values for the given key, and for tuple keys starting with it."""
+        for key in [x for x in self._values if (x == prefix) or (isinstance(x, tuple) and x[:1] == (prefix,))]:
+            del self._values[key]
+
+    def clear(self):
+        """Forget all memoized values."""
+        self._values.clear()
+
+    def get_stats(self):
+        """Get the hit and miss counters of this cache."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._values),
+        }
+
+
+def get_request_cache():
+    """Get the active request cache, if any."""
+    return active_request_cache.get()
+
+
+@contextmanager
+def request_cache():
+    """Activate a new request cache for the enclosed code, such as a management command run."""
+    cache = RequestCache()
+    token = active_request_cache.set(cache)
+    try:
+        yield cache
+    finally:
+        active_request_cache.reset(token)
+
+
+def memoize(key, func):
+    """
+    Get a value from the active request cache, calculating it with func if it is not known yet.
+
+    Without an active request cache, func is called every time.
+    """
+    cache = get_request_cache()
+    return func() if cache is None else cache.get_or_set(key, func)
+
+
+def clear_request_cache():
+    """Forget all values memoized in the active request cache, if any."""
+    cache = get_request_cache()
+    if cache is not None:
+        cache.clear()
+
+
+def invalidate_request_cache(prefix):
+    """Forget the values memoized in the active request cache for the given key prefix, if any."""
+    cache = get_request_cache()
+    if cache is not None:
+        cache.invalidate(prefix)
+
+
+class RequestCacheMiddleware(object):
+    """Activate a request cache for every request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with request_cache() as cache:
+            response = self.get_response(request)
+
+        log.debug('Request cache for %s: %s' % (request.path, cache.get_stats()))
+        return response
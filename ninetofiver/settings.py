@@ -122,6 +122,7 @@ class Base(Configuration):
         'django.contrib.auth.middleware.AuthenticationMiddleware',
         'django.contrib.messages.middleware.MessageMiddleware',
         'django.middleware.clickjacking.XFrameOptionsMiddleware',
+        'ninetofiver.request_cache.RequestCacheMiddleware',
     ]
 
     ROOT_URLCONF = 'ninetofiver.urls'
@@ -338,6 +339,8 @@ class Base(Configuration):
     BASE_URL = values.Value('http://localhost:8000')
     # Default starting hour for working days
     DEFAULT_WORKING_DAY_STARTING_HOUR = 9
+    # Amount of days deletions are journaled for syncing clients
+    SYNC_DELETION_RETENTION_DAYS = 90
 
     # Mattermost integration
     MATTERMOST_INCOMING_WEBHOOK_URL = values.Value(None)
@@ -471,6 +474,18 @@ class Dev(Base):
 class Prod(Base):
     """Prod configuration."""
 
+    # Cache shared by all worker processes, create its table using "python manage.py createcachetable"
+    # It holds the availability of every user per month, so it is allowed to grow well beyond the default size
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'ninetofiver_cache',
+            'OPTIONS': {
+                'MAX_ENTRIES': 100000,
+            },
+        }
+    }
+
     # Logging
     LOGGING = {
         'version': 1,
@@ -2,9 +2,14 @@
 from django_auth_ldap.backend import populate_user
 from django.contrib.auth import models as auth_models
 from django.dispatch import receiver
-from django.db.models.signals import post_save, pre_save, m2m_changed, pre_delete
+from django.db.models import Min, Max
+from django.db.models.signals import post_save, pre_save, m2m_changed, pre_delete, post_delete
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from ninetofiver import models, notifications
+from ninetofiver import models, notifications, calculation
+from ninetofiver.availability_cache import availability_cache
+from ninetofiver.holidays import holiday_calendar
+from ninetofiver.request_cache import clear_request_cache
 from ninetofiver.utils import send_mail, get_users_with_permission
 
 
@@ -70,6 +75,9 @@ def on_leave_pre_save(sender, instance, created=False, **kwargs):
 @receiver(pre_save, sender=models.Timesheet)
 def on_timesheet_pre_save(sender, instance, created=False, **kwargs):
     """Process pre-save event for a timesheet."""
+    # The snapshot of a timesheet only changes along with its status
+    instance._status_changed = instance._state.adding or ('status' in instance.get_dirty_fields())
+
     if (not created) and instance.is_dirty():
         dirty = instance.get_dirty_fields()
 
@@ -91,6 +99,20 @@ def on_timesheet_pre_save(sender, instance, created=False, **kwargs):
                 )
 
 
+@receiver(post_save, sender=models.Timesheet)
+def on_timesheet_post_save(sender, instance, created=False, **kwargs):
+    """Process post-save event for a timesheet."""
+    if not getattr(instance, '_status_changed', True):
+        return
+
+    # The range info of closed timesheets is kept in a snapshot, which is removed when they are reactivated
+    # Changes to the data it was calculated from remove it as well, through invalidate_user_hours
+    if instance.status == models.STATUS_CLOSED:
+        calculation.create_timesheet_snapshots([instance])
+    elif not created:
+        models.TimesheetSnapshot.objects.filter(timesheet=instance).delete()
+
+
 @receiver(pre_save, sender=models.ContractUserGroup)
 def on_contract_user_group_pre_save(sender, instance, created=False, **kwargs):
     """Process pre-save event for a contract user group."""
@@ -206,4 +228,209 @@ def on_attachment_pre_delete(sender, instance, **kwargs):
 
     if timesheets or leaves:
         notifications.send_attachments_modified_notification(attachments=[instance], action='removed',
-                                                             timesheets=timesheets, leaves=leaves)
\ No newline at end of file
+                                                             timesheets=timesheets, leaves=leaves)
+
+
+@receiver(pre_save, sender=models.ActivityPerformance)
+@receiver(pre_save, sender=models.StandbyPerformance)
+def on_performance_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for a performance."""
+    # If the performance moved to another day or timesheet, the ledger of its old day is outdated as well
+    if instance.pk and instance.is_dirty(check_relationship=True):
+        dirty = instance.get_dirty_fields(check_relationship=True)
+        if ('date' in dirty) or ('timesheet' in dirty):
+            old_date = dirty.get('date', instance.date)
+            old_user_ids = (models.Timesheet.objects
+                            .filter(pk=dirty.get('timesheet', instance.timesheet_id))
+                            .values_list('user_id', flat=True))
+            calculation.invalidate_performance_hours([(x, old_date) for x in old_user_ids])
+
+
+@receiver(post_save, sender=models.ActivityPerformance)
+@receiver(post_save, sender=models.StandbyPerformance)
+@receiver(post_delete, sender=models.ActivityPerformance)
+@receiver(post_delete, sender=models.StandbyPerformance)
+def on_performance_post_save_or_delete(sender, instance, **kwargs):
+    """Process post-save and post-delete events for a performance."""
+    calculation.invalidate_performance_hours([(instance.timesheet.user_id, instance.date)])
+
+
+@receiver(pre_save, sender=models.LeaveDate)
+def on_leave_date_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for a leave date."""
+    # If the leave date moved to another day or leave, the ledger of its old day is outdated as well
+    if instance.pk and instance.is_dirty(check_relationship=True):
+        dirty = instance.get_dirty_fields(check_relationship=True)
+        if ('starts_at' in dirty) or ('leave' in dirty):
+            old_date = dirty.get('starts_at', instance.starts_at).date()
+            old_user_ids = (models.Leave.objects
+                            .filter(pk=dirty.get('leave', instance.leave_id))
+                            .values_list('user_id', flat=True))
+            calculation.invalidate_user_hours(list(old_user_ids), old_date, old_date)
+            availability_cache.invalidate(old_user_ids)
+
+
+@receiver(post_save, sender=models.LeaveDate)
+@receiver(post_delete, sender=models.LeaveDate)
+def on_leave_date_post_save_or_delete(sender, instance, **kwargs):
+    """Process post-save and post-delete events for a leave date."""
+    date = instance.starts_at.date()
+    calculation.invalidate_user_hours([instance.leave.user_id], date, date)
+    availability_cache.invalidate([instance.leave.user_id])
+
+
+@receiver(post_save, sender=models.Leave)
+def on_leave_post_save(sender, instance, **kwargs):
+    """Process post-save event for a leave."""
+    # The status of a leave determines whether its leave dates count as leave or as pending leave
+    date_range = instance.leavedate_set.aggregate(from_date=Min('starts_at'), until_date=Max('starts_at'))
+    if date_range['from_date']:
+        calculation.invalidate_user_hours([instance.user_id], date_range['from_date'].date(),
+                                          date_range['until_date'].date())
+        availability_cache.invalidate([instance.user_id])
+
+
+@receiver(pre_save, sender=models.Holiday)
+def on_holiday_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for a holiday."""
+    if instance.pk and instance.is_dirty():
+        old_date = instance.get_dirty_fields().get('date', instance.date)
+        calculation.invalidate_user_hours(None, old_date, old_date)
+
+
+@receiver(post_save, sender=models.Holiday)
+@receiver(post_delete, sender=models.Holiday)
+def on_holiday_post_save_or_delete(sender, instance, **kwargs):
+    """Process post-save and post-delete events for a holiday."""
+    calculation.invalidate_user_hours(None, instance.date, instance.date)
+    holiday_calendar.invalidate()
+    availability_cache.invalidate()
+
+
+@receiver(pre_save, sender=models.EmploymentContract)
+def on_employment_contract_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for an employment contract."""
+    # If the employment contract moved to another user, the ledger of the old user is outdated as well
+    if instance.pk and instance.is_dirty(check_relationship=True):
+        old_user_id = instance.get_dirty_fields(check_relationship=True).get('user', None)
+        if old_user_id:
+            calculation.invalidate_user_hours([old_user_id])
+            availability_cache.invalidate([old_user_id])
+
+
+@receiver(post_save, sender=models.EmploymentContract)
+@receiver(post_delete, sender=models.EmploymentContract)
+def on_employment_contract_post_save_or_delete(sender, instance, **kwargs):
+    """Process post-save and post-delete events for an employment contract."""
+    calculation.invalidate_user_hours([instance.user_id])
+    availability_cache.invalidate([instance.user_id])
+
+
+@receiver(post_save, sender=models.PerformanceType)
+@receiver(post_delete, sender=models.PerformanceType)
+def on_performance_type_post_save_or_delete(sender, instance, **kwargs):
+    """Process post-save and post-delete events for a performance type."""
+    # The multiplier of a performance type determines the normalized duration of its performances
+    calculation.invalidate_user_hours(models.ActivityPerformance.objects
+                                      .filter(performance_type=instance)
+                                      .values_list('timesheet__user_id', flat=True)
+                                      .distinct())
+
+
+@receiver(pre_save, sender=models.Company)
+def on_company_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for a company."""
+    # The country of a company determines the holidays of the users it employs
+    if instance.pk and ('country' in instance.get_dirty_fields()):
+        calculation.invalidate_user_hours(models.EmploymentContract.objects
+                                          .filter(company=instance)
+                                          .values_list('user_id', flat=True)
+                                          .distinct())
+
+
+@receiver(post_save, sender=models.WorkSchedule)
+def on_work_schedule_post_save(sender, instance, **kwargs):
+    """Process post-save event for a work schedule."""
+    calculation.invalidate_user_hours(auth_models.User.objects.filter(employmentcontract__work_schedule=instance))
+    availability_cache.invalidate(models.EmploymentContract.objects
+                                  .filter(work_schedule=instance)
+                                  .values_list('user_id', flat=True)
+                                  .distinct())
+
+
+@receiver(pre_save, sender=models.Whereabout)
+def on_whereabout_pre_save(sender, instance, **kwargs):
+    """Process pre-save event for a whereabout."""
+    # If the whereabout moved to another timesheet, the availability of its old user is outdated as well
+    if instance.pk and instance.is_dirty(check_relationship=True):
+        old_timesheet_id = instance.get_dirty_fields(check_relationship=True).get('timesheet', None)
+        if old_timesheet_id:
+            availability_cache.invalidate(models.Timesheet.objects
+                                          .filter(pk=old_timesheet_id)
+                                          .values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=models.Whereabout)
+@receiver(post_delete, sender=models.Whereabout)
+def on_whereabout_post_save_or_delete(sender, instance, **kwargs):
+    """Process post-save and post-delete events for a whereabout."""
+    availability_cache.invalidate([instance.timesheet.user_id])
+
+
+@receiver(post_save, sender=models.LeaveType)
+@receiver(post_delete, sender=models.LeaveType)
+def on_leave_type_post_save_or_delete(sender, instance, **kwargs):
+    """Process post-save and post-delete events for a leave type."""
+    # Leave types determine which leave counts as used overtime
+    calculation.invalidate_overtime_checkpoints()
+
+
+@receiver(post_save, sender=models.Company)
+@receiver(post_delete, sender=models.Company)
+@receiver(post_save, sender=models.LeaveType)
+@receiver(post_delete, sender=models.LeaveType)
+@receiver(post_save, sender=models.Location)
+@receiver(post_delete, sender=models.Location)
+def on_availability_reference_data_changed(sender, **kwargs):
+    """Process changes to reference data which is part of the cached availability of all users."""
+    # Countries determine holidays, leave types determine sickness and locations are part of whereabouts
+    availability_cache.invalidate()
+
+
+@receiver(post_save, sender=models.LeaveType)
+@receiver(post_delete, sender=models.LeaveType)
+@receiver(post_save, sender=models.PerformanceType)
+@receiver(post_delete, sender=models.PerformanceType)
+@receiver(post_save, sender=models.ContractRole)
+@receiver(post_delete, sender=models.ContractRole)
+@receiver(post_save, sender=models.ContractUser)
+@receiver(post_delete, sender=models.ContractUser)
+@receiver(m2m_changed, sender=models.Contract.performance_types.through)
+def on_reference_data_changed(sender, **kwargs):
+    """Process changes to reference data which may be memoized in the request cache."""
+    clear_request_cache()
+
+
+@receiver(post_delete, sender=models.LeaveDate)
+def on_leave_date_post_delete(sender, instance, **kwargs):
+    """Process post-delete event for a leave date."""
+    # Syncing clients keep leave dates as part of their leave, so the leave has changed for them
+    models.Leave.objects.filter(pk=instance.leave_id).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=models.Timesheet)
+@receiver(post_delete, sender=models.Leave)
+@receiver(post_delete, sender=models.Whereabout)
+@receiver(post_delete, sender=models.ActivityPerformance)
+@receiver(post_delete, sender=models.StandbyPerformance)
+def on_synced_object_post_delete(sender, instance, origin=None, **kwargs):
+    """Process post-delete events for objects which clients keep copies of."""
+    # Objects deleted along with their user leave nothing to sync, and the user can no longer be referred to
+    if isinstance(origin, auth_models.User):
+        return
+
+    if isinstance(instance, (models.Timesheet, models.Leave)):
+        user_id = instance.user_id
+    else:
+        user_id = instance.timesheet.user_id
+    models.DeletedObject.objects.create(user_id=user_id, object_type=sender.__name__, object_id=instance.pk)
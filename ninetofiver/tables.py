@@ -14,6 +14,7 @@ from django_tables2.export.export import TableExport
 from django_tables2.utils import A
 
 from ninetofiver import models
+from ninetofiver.request_cache import memoize
 from ninetofiver.utils import month_date_range, format_duration, dates_in_range
 from math import floor
 
@@ -541,7 +542,7 @@ class UserGroupLeaveOverviewTable(BaseTable):
         """Constructor."""
         # Create an additional column for every leave type
         extra_columns = []
-        for leave_type in models.LeaveType.objects.order_by('name'):
+        for leave_type in memoize('leave_types_by_name', lambda: list(models.LeaveType.objects.order_by('name'))):
             column = SummedHoursColumn(accessor=A('leave_type_hours.%s' % leave_type.name))
             extra_columns.append([leave_type.name, column])
         kwargs['extra_columns'] = extra_columns
@@ -577,7 +578,7 @@ class UserLeaveOverviewTable(BaseTable):
         """Constructor."""
         # Create an additional column for every leave type
         extra_columns = []
-        for leave_type in models.LeaveType.objects.order_by('name'):
+        for leave_type in memoize('leave_types_by_name', lambda: list(models.LeaveType.objects.order_by('name'))):
             column = SummedHoursColumn(accessor=A('leave_type_hours.%s' % leave_type.name))
             extra_columns.append([leave_type.name, column])
         kwargs['extra_columns'] = extra_columns
@@ -1,5 +1,6 @@
 from calendar import monthrange
 import datetime
+from decimal import Decimal
 from itertools import product
 import logging
 import random
@@ -7,9 +8,18 @@ import random
 from dateutil.relativedelta import relativedelta
 from dateutil import tz
 from django.conf import settings
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User, Group
+from django.core.management.color import no_style
+from django.db import connection, router
+from django.db.models import Max
+from django.utils import timezone
 from django_countries import countries
 
+from ninetofiver import calculation
+from ninetofiver.availability_cache import availability_cache
+from ninetofiver.holidays import holiday_calendar
+
 from ninetofiver.models import (
     Timesheet,
     WorkSchedule,
@@ -39,6 +49,9 @@ from ninetofiver.models import (
     Training,
     InvoiceItem,
     Contract,
+    UserInfo,
+    STATUS_ACTIVE,
+    STATUS_CLOSED,
     STATUS_PENDING,
     STATUS_APPROVED,
 )
@@ -841,3 +854,362 @@ class TestDBPupulator:
         xprint(" - Training:", len(self.trainings))
 
         xprint("Populator complete!")
+
+
+class BulkDBPopulator:
+    """
+    Fill the database with a large, realistic dataset for performance work.
+
+    Rows are inserted in chunks, bypassing validation and signals. IDs are assigned up front, so rows of models using
+    multi-table inheritance can be inserted into every table of the model, and rows can refer to each other before
+    they are inserted. All randomness comes from the given seed, so the same seed results in the same dataset for
+    the same database contents and current month.
+    """
+
+    LEAVE_TYPES = [
+        ("Vacation", "vacation", False, False),
+        ("Sickness", "sickness", False, True),
+        ("Recup", "recup", True, False),
+        ("Unpaid", "unpaid", False, False),
+    ]
+    COUNTRIES = ["BE", "CZ", "PL"]
+    HOLIDAYS = {
+        "BE": [(1, 1, "New Year's Day"), (5, 1, "Labour Day"), (7, 21, "National Day"), (8, 15, "Assumption"),
+               (11, 1, "All Saints' Day"), (11, 11, "Armistice Day"), (12, 25, "Christmas Day")],
+        "CZ": [(1, 1, "New Year's Day"), (5, 1, "Labour Day"), (5, 8, "Liberation Day"),
+               (7, 5, "Saints Cyril and Methodius Day"), (9, 28, "Statehood Day"), (12, 25, "Christmas Day"),
+               (12, 26, "St. Stephen's Day")],
+        "PL": [(1, 1, "New Year's Day"), (5, 1, "Labour Day"), (5, 3, "Constitution Day"), (8, 15, "Assumption Day"),
+               (11, 11, "Independence Day"), (12, 25, "Christmas Day"), (12, 26, "Second Day of Christmas")],
+    }
+    # Work schedules, with the weight of users working at them
+    WORK_SCHEDULES = [
+        ("Fulltime1 (8h/day)", [8, 8, 8, 8, 8, 0, 0], 70),
+        ("Fulltime2 (7.6h/day)", [7.6, 7.6, 7.6, 7.6, 7.6, 0, 0], 15),
+        ("Parttime3 (4/5)", [8, 8, 8, 8, 0, 0, 0], 10),
+        ("Parttime4 (4h/day)", [4, 4, 4, 4, 4, 0, 0], 5),
+    ]
+    # Locations, with the weight of whereabouts at them
+    LOCATIONS = [
+        ("Home", 40),
+        ("Office", 50),
+        ("Customer site", 10),
+    ]
+    # Chance of a work day starting a leave of the given type, and the range of its length in work days
+    LEAVES = [
+        ("Vacation", 0.025, (1, 10)),
+        ("Sickness", 0.01, (1, 3)),
+        ("Recup", 0.005, (1, 1)),
+    ]
+
+    def __init__(self, users=2000, years=5, performances=5000000, seed=925, chunk_size=5000):
+        if not settings.DEBUG:
+            log.error("settings.DEBUG is False. Aborting")
+            exit(1)
+
+        self.user_count = users
+        self.performance_count = performances
+        self.chunk_size = chunk_size
+        self.random = random.Random(seed)
+        self.tzinfo = timezone.get_current_timezone()
+
+        today = datetime.date.today()
+        self.until_date = today.replace(day=monthrange(today.year, today.month)[1])
+        self.from_date = today.replace(day=1) - relativedelta(years=years, months=-1)
+
+        # Last assigned ID per table, pending rows and inserted row counts per model
+        self.ids = {}
+        self.pending = {}
+        self.counts = {}
+
+        self.holiday_dates = {}
+        self.users = []
+        self.user_contracts = {}
+        self.user_timesheets = {}
+
+    def execute(self):
+        """Order of methods is important"""
+        xprint("Populate tables in bulk")
+        self._populate_reference_tables()
+        self._populate_holidays()
+        self._populate_users()
+        self._populate_contracts()
+        self._populate_timesheets()
+        self._populate_user_days()
+        self.flush()
+        self._reset_sequences()
+
+        # Signals were bypassed, so drop everything calculated or cached from the previous contents
+        calculation.invalidate_user_hours()
+        holiday_calendar.invalidate()
+        availability_cache.invalidate()
+
+        for model, count in self.counts.items():
+            xprint(" - %s:" % model.__name__, count)
+        xprint("Populator complete!")
+
+    def get_model_chain(self, model):
+        """Get the concrete models a row of the given model is stored in, starting with the topmost parent."""
+        return list(reversed(model._meta.get_parent_list())) + [model]
+
+    def assign_id(self, obj):
+        """Assign the next free ID to the given object."""
+        chain = self.get_model_chain(obj.__class__)
+        if chain[0] not in self.ids:
+            self.ids[chain[0]] = chain[0]._base_manager.aggregate(max_id=Max("id"))["max_id"] or 0
+        self.ids[chain[0]] += 1
+
+        for model in chain:
+            setattr(obj, model._meta.pk.attname, self.ids[chain[0]])
+
+        return obj
+
+    def add(self, obj):
+        """Queue the given object for insertion, inserting all queued objects once enough are queued."""
+        if obj.pk is None:
+            self.assign_id(obj)
+        if hasattr(obj, "pre_save_polymorphic"):
+            obj.pre_save_polymorphic()
+
+        pending = self.pending.setdefault(obj.__class__, [])
+        pending.append(obj)
+        if len(pending) >= self.chunk_size:
+            self.flush()
+
+        return obj
+
+    def flush(self):
+        """Insert all queued objects, in the order their models were first queued in."""
+        for model, objs in self.pending.items():
+            if not objs:
+                continue
+
+            for chain_model in self.get_model_chain(model):
+                chain_model._base_manager._insert(objs, fields=chain_model._meta.local_concrete_fields,
+                                                  using=router.db_for_write(chain_model))
+
+            self.counts[model] = self.counts.get(model, 0) + len(objs)
+            objs.clear()
+
+    def _reset_sequences(self):
+        """Move ID sequences past the assigned IDs, on databases which do not do so on their own."""
+        statements = connection.ops.sequence_reset_sql(no_style(), list(self.ids))
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    def get_or_create(self, model, defaults=None, **kwargs):
+        """Get the first object of the given model matching the given lookups, or create it."""
+        obj = model.objects.filter(**kwargs).first()
+        if obj is None:
+            obj = model(**kwargs, **(defaults or {}))
+            obj.save()
+        return obj
+
+    def _populate_reference_tables(self):
+        """Get or create the small tables everything else refers to."""
+        self.leave_types = {}
+        for leave_name, leave_desc, leave_overtime, leave_sickness in self.LEAVE_TYPES:
+            self.leave_types[leave_name] = self.get_or_create(
+                LeaveType, name=leave_name,
+                defaults=dict(description=leave_desc, overtime=leave_overtime, sickness=leave_sickness))
+
+        self.internal_companies = {}
+        for i, country in enumerate(self.COUNTRIES):
+            self.internal_companies[country] = self.get_or_create(
+                Company, vat_identification_number="%s925%05d" % (country, i),
+                defaults=dict(name="Bulk internal %s" % country, address="Bulk address %s" % i, country=country,
+                              internal=True))
+        self.customers = []
+        for i in range(25):
+            country = self.COUNTRIES[i % len(self.COUNTRIES)]
+            self.customers.append(self.get_or_create(
+                Company, vat_identification_number="%s925%05d" % (country, i + len(self.COUNTRIES)),
+                defaults=dict(name="Bulk customer %s" % i, address="Bulk customer address %s" % i, country=country,
+                              internal=False)))
+
+        self.locations = [self.get_or_create(Location, name=name) for name, weight in self.LOCATIONS]
+        self.location_weights = [weight for name, weight in self.LOCATIONS]
+
+        self.work_schedules = [
+            (self.get_or_create(WorkSchedule, name=name, defaults=dict(zip(
+                ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"], hours))), hours)
+            for name, hours, weight in self.WORK_SCHEDULES
+        ]
+        self.work_schedule_weights = [weight for name, hours, weight in self.WORK_SCHEDULES]
+
+        self.performance_types = [
+            self.get_or_create(PerformanceType, name="Normal", multiplier=1),
+            self.get_or_create(PerformanceType, name="Overtime", multiplier=1.5),
+        ]
+        self.contract_role = self.get_or_create(ContractRole, name="Bulk contract role")
+        self.employment_contract_type = self.get_or_create(EmploymentContractType, name="Bulk employee")
+
+    def _populate_holidays(self):
+        """Add fixed holidays for every country and year, keeping track of all holiday dates."""
+        existing = set(Holiday.objects.filter(date__range=(self.from_date, self.until_date))
+                       .values_list("name", "date", "country"))
+        for name, date, country in existing:
+            self.holiday_dates.setdefault(str(country), set()).add(date)
+
+        for country, holidays in self.HOLIDAYS.items():
+            for year in range(self.from_date.year, self.until_date.year + 1):
+                for month, day, name in holidays:
+                    date = datetime.date(year, month, day)
+                    self.holiday_dates.setdefault(country, set()).add(date)
+                    if (name, date, country) not in existing:
+                        self.add(Holiday(name=name, date=date, country=country))
+
+    def _populate_users(self):
+        """Add users, their user info and employment contracts."""
+        password = make_password(None)
+
+        for i in range(self.user_count):
+            country = self.COUNTRIES[self.random.randrange(len(self.COUNTRIES))]
+            work_schedule, hours = self.random.choices(self.work_schedules, self.work_schedule_weights)[0]
+
+            # Most users were hired before the range, others during it, and some have left
+            if self.random.random() < 0.8:
+                started_at = self.from_date - datetime.timedelta(days=self.random.randrange(1, 3 * 365))
+            else:
+                started_at = self.from_date + datetime.timedelta(
+                    days=self.random.randrange((self.until_date - self.from_date).days))
+            ended_at = None
+            if self.random.random() < 0.1:
+                ended_at = started_at + datetime.timedelta(
+                    days=self.random.randrange(1, max(2, (self.until_date - started_at).days)))
+
+            user = self.assign_id(User(first_name="Bulk%s" % i, last_name="User", password=password,
+                                       is_active=(ended_at is None) or (ended_at >= self.until_date)))
+            user.username = "bulk_user_%s" % user.id
+            user.email = "bulk_user_%s@example.com" % user.id
+            self.add(user)
+
+            self.add(UserInfo(user=user, country=country, gender=self.random.choice(["m", "f"]),
+                              birth_date=datetime.date(1960, 1, 1) + datetime.timedelta(
+                                  days=self.random.randrange(40 * 365))))
+            self.add(EmploymentContract(user=user, company=self.internal_companies[country],
+                                        employment_contract_type=self.employment_contract_type,
+                                        work_schedule=work_schedule, started_at=started_at, ended_at=ended_at))
+            self.users.append((user, country, hours, max(started_at, self.from_date),
+                               min(ended_at or self.until_date, self.until_date)))
+
+    def _populate_contracts(self):
+        """Add contracts and assign every user to a few of them."""
+        contracts = []
+        for i in range(max(10, self.user_count // 5)):
+            kind = self.random.random()
+            kwargs = dict(
+                name="Bulk contract %s" % i,
+                customer=self.customers[self.random.randrange(len(self.customers))],
+                company=self.internal_companies[self.COUNTRIES[i % len(self.COUNTRIES)]],
+                starts_at=self.from_date - datetime.timedelta(days=self.random.randrange(365)),
+            )
+            if kind < 0.6:
+                contract = ConsultancyContract(day_rate=self.random.randrange(400, 1000), **kwargs)
+            elif kind < 0.9:
+                contract = ProjectContract(fixed_fee=self.random.randrange(10000, 100000), **kwargs)
+            else:
+                contract = SupportContract(day_rate=self.random.randrange(400, 1000), **kwargs)
+            contracts.append(self.add(contract))
+
+        for user, country, hours, from_date, until_date in self.users:
+            self.user_contracts[user.id] = self.random.sample(contracts, self.random.randint(1, 3))
+            for contract in self.user_contracts[user.id]:
+                self.add(ContractUser(user=user, contract=contract, contract_role=self.contract_role))
+
+    def _populate_timesheets(self):
+        """Add a timesheet for every month each user is employed in, closing those of past months."""
+        current_month = (self.until_date.year, self.until_date.month)
+
+        for user, country, hours, from_date, until_date in self.users:
+            self.user_timesheets[user.id] = timesheets = {}
+            month = from_date.replace(day=1)
+            while month <= until_date:
+                timesheets[(month.year, month.month)] = self.add(Timesheet(
+                    user=user, year=month.year, month=month.month,
+                    status=STATUS_CLOSED if (month.year, month.month) < current_month else STATUS_ACTIVE))
+                month += relativedelta(months=1)
+
+    def get_work_days(self, user, country, hours, from_date, until_date):
+        """Get the dates and scheduled hours of the work days of the given user."""
+        holiday_dates = self.holiday_dates.get(country, set())
+        date = from_date
+        while date <= until_date:
+            if hours[date.weekday()] and (date not in holiday_dates):
+                yield date, hours[date.weekday()]
+            date += datetime.timedelta(days=1)
+
+    def _populate_user_days(self):
+        """Add leaves, whereabouts and performances for the work days of every user."""
+        # Spread performances over the work days which are expected to remain after taking leave
+        work_day_count = sum(sum(1 for x in self.get_work_days(*user_data)) for user_data in self.users)
+        leave_days = sum(chance * (min_days + max_days) / 2
+                         for leave_type, chance, (min_days, max_days) in self.LEAVES)
+        performances_per_day = self.performance_count / max(1, work_day_count / (1 + leave_days))
+
+        for i, (user, country, hours, from_date, until_date) in enumerate(self.users):
+            leave = None
+            leave_days = 0
+
+            for date, day_hours in self.get_work_days(user, country, hours, from_date, until_date):
+                timesheet = self.user_timesheets[user.id][(date.year, date.month)]
+
+                # Start a new leave, spanning a few work days
+                if not leave_days:
+                    for leave_type, chance, (min_days, max_days) in self.LEAVES:
+                        if self.random.random() < chance:
+                            leave = self.add(Leave(user=user, leave_type=self.leave_types[leave_type],
+                                                   description="Bulk %s" % leave_type.lower(),
+                                                   status=STATUS_APPROVED if date <= datetime.date.today()
+                                                   else self.random.choice([STATUS_PENDING, STATUS_APPROVED])))
+                            leave_days = self.random.randint(min_days, max_days)
+                            break
+
+                if leave_days:
+                    leave_days -= 1
+                    # Single days off are sometimes half days
+                    leave_hours = day_hours if (leave_days or self.random.random() < 0.8) else day_hours / 2
+                    self.add(LeaveDate(leave=leave, timesheet=timesheet,
+                                       starts_at=self.get_datetime(date, 9),
+                                       ends_at=self.get_datetime(date, 9 + leave_hours)))
+                    day_hours -= leave_hours
+                    if not day_hours:
+                        continue
+
+                # Whereabouts for most work days
+                if self.random.random() < 0.9:
+                    location = self.random.choices(self.locations, self.location_weights)[0]
+                    starts_at = 8 + self.random.randrange(5) / 4
+                    self.add(Whereabout(timesheet=timesheet, location=location,
+                                        starts_at=self.get_datetime(date, starts_at),
+                                        ends_at=self.get_datetime(date, starts_at + day_hours)))
+
+                self._populate_performances(user, timesheet, date, day_hours, performances_per_day)
+
+            if not (i + 1) % 100:
+                xprint(" - Populated %s of %s users" % (i + 1, len(self.users)))
+
+    def _populate_performances(self, user, timesheet, date, hours, performances_per_day):
+        """Add performances for a work day, splitting roughly the scheduled hours over them."""
+        count = int(performances_per_day) + (self.random.random() < performances_per_day % 1)
+        quarters = max(1, round(hours * 4 * self.random.uniform(0.9, 1.15)))
+        count = min(count, quarters)
+        if not count:
+            return
+
+        bounds = [0] + sorted(self.random.sample(range(1, quarters), count - 1)) + [quarters]
+        for x in range(count):
+            self.add(ActivityPerformance(
+                timesheet=timesheet,
+                date=date,
+                contract=self.random.choice(self.user_contracts[user.id]),
+                performance_type=self.performance_types[1 if self.random.random() < 0.02 else 0],
+                contract_role=self.contract_role,
+                description="Bulk activity performance",
+                duration=Decimal(bounds[x + 1] - bounds[x]) / 4,
+            ))
+
+    def get_datetime(self, date, hours):
+        """Get the datetime at the given amount of hours after the start of the given date."""
+        return datetime.datetime.combine(date, datetime.time(), tzinfo=self.tzinfo) + datetime.timedelta(hours=hours)
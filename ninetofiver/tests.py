@@ -1,14 +1,27 @@
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import models as auth_models
+from django.core.cache import cache
+from django.db import connection
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from rest_assured import testcases
 from django.utils.timezone import utc
-from ninetofiver import factories, models
+from ninetofiver import benchmark, calculation, factories, models
+from ninetofiver.availability_cache import availability_cache
+from ninetofiver.holidays import holiday_calendar
+from ninetofiver.request_cache import (clear_request_cache, get_request_cache, invalidate_request_cache, memoize,
+                                      request_cache)
+from ninetofiver.test_db_populator import BulkDBPopulator
+from ninetofiver.utils import IntervalIndex
 from decimal import Decimal
 from datetime import timedelta
 import logging
+import random
 import tempfile
 import datetime
+import types
 
 
 log = logging.getLogger(__name__)
@@ -246,3 +259,527 @@ class AdminReportViewTests(AuthenticatedAPITestCase):
         """Test the project contract budget overview report view."""
         response = self.client.get(reverse('admin_report_project_contract_budget_overview'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class IntervalIndexTests(SimpleTestCase):
+    """Interval index tests."""
+
+    def setUp(self):
+        super().setUp()
+        self.first = types.SimpleNamespace(starts_at=datetime.date(2020, 1, 1), ends_at=datetime.date(2020, 1, 31))
+        self.second = types.SimpleNamespace(starts_at=datetime.date(2020, 1, 15), ends_at=None)
+        self.index = IntervalIndex([self.first, self.second])
+
+    def test_get(self):
+        """Test fetching the items active on a date."""
+        self.assertEqual(self.index.get(datetime.date(2019, 12, 31)), ())
+        self.assertEqual(self.index.get(datetime.date(2020, 1, 1)), (self.first,))
+        self.assertEqual(self.index.get(datetime.date(2020, 1, 31)), (self.first, self.second))
+        self.assertEqual(self.index.get(datetime.date(2030, 1, 1)), (self.second,))
+        self.assertEqual(self.index.first(datetime.date(2020, 1, 20)), self.first)
+        self.assertIsNone(IntervalIndex([]).first(datetime.date(2020, 1, 20)))
+
+    def test_iter_segments(self):
+        """Test walking the segment boundaries of a date range."""
+        segments = list(self.index.iter_segments(datetime.date(2019, 12, 30), datetime.date(2020, 2, 5)))
+        self.assertEqual(segments, [
+            (datetime.date(2019, 12, 30), datetime.date(2019, 12, 31), ()),
+            (datetime.date(2020, 1, 1), datetime.date(2020, 1, 14), (self.first,)),
+            (datetime.date(2020, 1, 15), datetime.date(2020, 1, 31), (self.first, self.second)),
+            (datetime.date(2020, 2, 1), datetime.date(2020, 2, 5), (self.second,)),
+        ])
+
+
+class HourArithmeticTests(SimpleTestCase):
+    """Integer hour arithmetic tests, comparing randomly generated cases against Decimal arithmetic."""
+
+    def setUp(self):
+        super().setUp()
+        self.random = random.Random(925)
+
+    def random_hours(self, maximum=2400):
+        """Get a random amount of hours with two decimal places."""
+        return Decimal(self.random.randint(0, maximum)).scaleb(-2)
+
+    def test_to_hundredths(self):
+        """Test converting hours to hundredths of an hour, rounded like LeaveDate.duration."""
+        for i in range(5000):
+            seconds = self.random.choice([self.random.randint(0, 86400), self.random.randint(0, 1440) * 60,
+                                          self.random.randint(0, 86400 * 10 ** 6) / 10 ** 6])
+            expected = Decimal(str(round(seconds / 3600, 2)))
+            self.assertEqual(calculation.from_hundredths(calculation.to_hundredths(seconds / 3600)), expected)
+
+            hours = self.random_hours()
+            self.assertEqual(calculation.to_hundredths(hours), hours * 100)
+
+    def test_normalized_duration(self):
+        """Test rounding normalized durations, like ActivityPerformance.normalized_duration."""
+        for i in range(5000):
+            duration, multiplier = self.random_hours(), self.random_hours(maximum=400)
+            normalized_duration = calculation.round_half_even(
+                calculation.to_hundredths(duration) * calculation.to_hundredths(multiplier), 100)
+            self.assertEqual(calculation.from_hundredths(normalized_duration), round(duration * multiplier, 2))
+
+    def test_get_hours(self):
+        """Test deriving totals from sums of hundredths of an hour."""
+        for i in range(1000):
+            hours = [[self.random_hours() for day in range(self.random.randint(0, 10))] for field in range(5)]
+            work_hours, holiday_hours, leave_hours, pending_leave_hours, performed_hours = [sum(x) for x in hours]
+            total_hours = holiday_hours + leave_hours + performed_hours
+
+            res = calculation.UserRangeInfo.get_hours(*[sum(calculation.to_hundredths(y) for y in x) for x in hours])
+            self.assertEqual(res, {
+                'work_hours': work_hours,
+                'holiday_hours': holiday_hours,
+                'leave_hours': leave_hours,
+                'pending_leave_hours': pending_leave_hours,
+                'performed_hours': performed_hours,
+                'remaining_hours': max(0, work_hours - total_hours),
+                'total_hours': total_hours,
+                'overtime_hours': abs(min(0, work_hours - total_hours)),
+            })
+            for value in res.values():
+                self.assertEqual(value.as_tuple().exponent, -2)
+
+
+class RangeInfoTests(TestCase):
+    """Range info calculation tests."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = factories.UserFactory.create()
+        self.company = factories.InternalCompanyFactory.create(country='BE')
+        self.work_schedule = factories.WorkScheduleFactory.create(monday=8, tuesday=8, wednesday=8, thursday=8,
+                                                                  friday=8, saturday=0, sunday=0)
+        factories.EmploymentContractFactory.create(
+            user=self.user,
+            company=self.company,
+            work_schedule=self.work_schedule,
+            employment_contract_type=factories.EmploymentContractTypeFactory.create(),
+            started_at=datetime.date(2024, 1, 1),
+            ended_at=None,
+        )
+        factories.HolidayFactory.create(date=datetime.date(2024, 1, 1), country='BE')
+        self.from_date = datetime.date(2024, 1, 1)
+        self.until_date = datetime.date(2024, 1, 7)
+
+    def test_range_info(self):
+        """Test calculating range info."""
+        range_info = calculation.get_range_info([self.user], self.from_date, self.until_date, daily=True)[self.user.id]
+        self.assertEqual(range_info['work_hours'], Decimal('40.00'))
+        self.assertEqual(range_info['holiday_hours'], Decimal('8.00'))
+        self.assertEqual(range_info['remaining_hours'], Decimal('32.00'))
+        self.assertEqual(len(range_info['details']), 7)
+        self.assertEqual(range_info['details']['2024-01-06']['work_hours'], Decimal('0.00'))
+
+    def test_ledger_range_info(self):
+        """Test reading range info from the user day ledger."""
+        range_info = calculation.get_range_info([self.user], self.from_date, self.until_date, use_ledger=True)
+        self.assertEqual(range_info[self.user.id]['work_hours'], Decimal('40.00'))
+        self.assertEqual(range_info[self.user.id]['remaining_hours'], Decimal('32.00'))
+        self.assertEqual(models.UserDayLedger.objects.filter(user=self.user).count(), 7)
+
+        # Adding a holiday should invalidate the ledger for that day
+        factories.HolidayFactory.create(date=datetime.date(2024, 1, 2), country='BE')
+        self.assertEqual(models.UserDayLedger.objects.filter(user=self.user).count(), 6)
+
+        range_info = calculation.get_range_info([self.user], self.from_date, self.until_date, use_ledger=True)
+        self.assertEqual(range_info[self.user.id]['holiday_hours'], Decimal('16.00'))
+        self.assertEqual(range_info[self.user.id]['remaining_hours'], Decimal('24.00'))
+
+    def test_ledger_invalidation(self):
+        """Test invalidating the user day ledger when performance types or company countries change."""
+        timesheet = factories.OpenTimesheetFactory.create(user=self.user, year=2024, month=1)
+        performance_type = factories.PerformanceTypeFactory.create(multiplier=Decimal('1.00'))
+        contract = factories.ProjectContractFactory.create(active=True, company=self.company)
+        contract_role = factories.ContractRoleFactory.create()
+        factories.ContractUserFactory.create(user=self.user, contract=contract, contract_role=contract_role)
+        factories.ActivityPerformanceFactory.create(timesheet=timesheet, date=datetime.date(2024, 1, 2),
+                                                    contract=contract, contract_role=contract_role,
+                                                    performance_type=performance_type, duration=Decimal('2.00'))
+        range_info = calculation.get_range_info([self.user], self.from_date, self.until_date, use_ledger=True)
+        self.assertEqual(range_info[self.user.id]['performed_hours'], Decimal('2.00'))
+
+        # Changing the multiplier of a performance type should invalidate the ledger of its users
+        performance_type.multiplier = Decimal('1.50')
+        performance_type.save()
+        self.assertFalse(models.UserDayLedger.objects.filter(user=self.user).exists())
+        range_info = calculation.get_range_info([self.user], self.from_date, self.until_date, use_ledger=True)
+        self.assertEqual(range_info[self.user.id]['performed_hours'], Decimal('3.00'))
+
+        # Changing the country of a company should invalidate the ledger of its employees
+        self.company.country = 'NL'
+        self.company.save()
+        self.assertFalse(models.UserDayLedger.objects.filter(user=self.user).exists())
+        range_info = calculation.get_range_info([self.user], self.from_date, self.until_date, use_ledger=True)
+        self.assertEqual(range_info[self.user.id]['holiday_hours'], Decimal('0.00'))
+
+    def test_range_info_batch(self):
+        """Test calculating range info for several ranges at once."""
+        requests = [
+            (self.user, self.from_date, self.until_date),
+            (self.user, datetime.date(2024, 1, 8), datetime.date(2024, 1, 14)),
+            (self.user, datetime.date(2023, 12, 25), datetime.date(2023, 12, 31)),
+        ]
+        range_infos = calculation.get_range_info_batch(requests, summary=True)
+        self.assertEqual(len(range_infos), 3)
+        for request, range_info in zip(requests, range_infos):
+            self.assertEqual(range_info, calculation.get_range_info([request[0]], request[1], request[2],
+                                                                    summary=True)[self.user.id])
+        self.assertEqual(range_infos[1]['remaining_hours'], Decimal('40.00'))
+        self.assertEqual(range_infos[2]['work_hours'], Decimal('0.00'))
+        self.assertEqual(calculation.get_range_info_batch([]), [])
+
+    def test_range_info_totals(self):
+        """Test range info totals aggregated in the database match those calculated from objects."""
+        timesheet = factories.OpenTimesheetFactory.create(user=self.user, year=2024, month=1)
+        performance_type = factories.PerformanceTypeFactory.create(multiplier=Decimal('1.50'))
+        contract = factories.ProjectContractFactory.create(active=True, company=self.company)
+        contract_role = factories.ContractRoleFactory.create()
+        factories.ContractUserFactory.create(user=self.user, contract=contract, contract_role=contract_role)
+        for date in [datetime.date(2024, 1, 2), datetime.date(2024, 1, 2), datetime.date(2024, 1, 3)]:
+            factories.ActivityPerformanceFactory.create(timesheet=timesheet, date=date, contract=contract,
+                                                        contract_role=contract_role,
+                                                        performance_type=performance_type, duration=Decimal('0.33'))
+
+        totals = calculation.get_range_info([self.user], self.from_date, self.until_date, summary=True)
+        details = calculation.get_range_info([self.user], self.from_date, self.until_date, detailed=True,
+                                             summary=True)
+        self.assertEqual(totals[self.user.id]['performed_hours'], Decimal('1.50'))
+        self.assertEqual(totals[self.user.id]['performed_hours'], details[self.user.id]['performed_hours'])
+        self.assertEqual(totals[self.user.id]['summary'], details[self.user.id]['summary'])
+
+    def test_overtime_checkpoints(self):
+        """Test calculating monthly overtime checkpoints."""
+        checkpoints = calculation.get_overtime_checkpoints(self.user, datetime.date(2024, 2, 10),
+                                                           datetime.date(2024, 3, 5))
+        self.assertEqual([(x.year, x.month) for x in checkpoints], [(2024, 2), (2024, 3)])
+        self.assertEqual(checkpoints[0].remaining_hours, Decimal('168.00'))
+        # Running balances include the months since the start of the employment contract
+        self.assertEqual(checkpoints[0].balance, Decimal('-344.00'))
+        self.assertEqual(checkpoints[1].balance, Decimal('-512.00'))
+        self.assertEqual(models.UserOvertimeCheckpoint.objects.filter(user=self.user).count(), 3)
+
+        # Changes to hours should invalidate the checkpoints from their month onwards
+        factories.HolidayFactory.create(date=datetime.date(2024, 2, 1), country='BE')
+        self.assertEqual(models.UserOvertimeCheckpoint.objects.filter(user=self.user).count(), 1)
+
+        checkpoints = calculation.get_overtime_checkpoints(self.user, datetime.date(2024, 2, 1),
+                                                           datetime.date(2024, 2, 29))
+        self.assertEqual(checkpoints[0].balance, Decimal('-336.00'))
+
+        # Changes to the country of the company should invalidate all checkpoints of its employees
+        self.company.country = 'NL'
+        self.company.save()
+        self.assertFalse(models.UserOvertimeCheckpoint.objects.filter(user=self.user).exists())
+
+    def test_timesheet_snapshot(self):
+        """Test serving the range info of closed timesheets from their snapshot."""
+        timesheet = factories.OpenTimesheetFactory.create(user=self.user, year=2024, month=1)
+        expected = calculation.get_range_info_batch([(self.user, *timesheet.get_date_range())], daily=True,
+                                                    summary=True)[0]
+
+        timesheet.status = models.STATUS_PENDING
+        timesheet.save()
+        timesheet.status = models.STATUS_CLOSED
+        timesheet.save()
+        self.assertTrue(models.TimesheetSnapshot.objects.filter(timesheet=timesheet).exists())
+
+        # Saving the timesheet without changing its status should leave its snapshot as is
+        with CaptureQueriesContext(connection) as queries:
+            timesheet.save()
+        self.assertFalse([x for x in queries if 'timesheetsnapshot' in x['sql'].lower()])
+
+        range_info = calculation.get_timesheet_range_info_batch([timesheet], daily=True, summary=True)[0]
+        self.assertEqual(range_info, expected)
+        self.assertEqual(calculation.get_snapshot_range_info(self.user, datetime.date(2024, 1, 1),
+                                                             datetime.date(2024, 1, 31))['work_hours'],
+                         Decimal('184.00'))
+        self.assertIsNone(calculation.get_snapshot_range_info(self.user, datetime.date(2024, 1, 1),
+                                                              datetime.date(2024, 1, 30)))
+
+        # Changes to the data the snapshot was calculated from should replace it
+        factories.HolidayFactory.create(date=datetime.date(2024, 1, 2), country='BE')
+        self.assertFalse(models.TimesheetSnapshot.objects.filter(timesheet=timesheet).exists())
+        self.assertEqual(calculation.get_snapshot_range_info(self.user, datetime.date(2024, 1, 1),
+                                                             datetime.date(2024, 1, 31))['holiday_hours'],
+                         Decimal('16.00'))
+        self.assertTrue(models.TimesheetSnapshot.objects.filter(timesheet=timesheet).exists())
+
+        # Reactivating the timesheet should remove its snapshot
+        timesheet.status = models.STATUS_ACTIVE
+        timesheet.save()
+        self.assertFalse(models.TimesheetSnapshot.objects.filter(timesheet=timesheet).exists())
+
+    def test_user_availability_info(self):
+        """Test availability info indexed by day offset."""
+        availability = calculation.get_user_availability_infos([self.user], self.from_date, self.until_date)
+        user_availability = availability[self.user.id]
+        self.assertEqual(user_availability.day_count, 7)
+        self.assertEqual(user_availability.get_day(0).day_tags, ['holiday'])
+        self.assertEqual(user_availability.get(datetime.date(2024, 1, 6)).day_tags, ['no_work'])
+        self.assertEqual(calculation.get_availability_info([self.user], self.from_date, self.until_date)
+                         [str(self.user.id)]['2024-01-03'].day_tags, [])
+
+    def test_compact_availability_info(self):
+        """Test availability info as tag bitmaps."""
+        availability = calculation.get_compact_availability_info([self.user], self.from_date, self.until_date)
+        bitmaps = dict(zip(availability['legend'], availability['users'][str(self.user.id)]))
+        self.assertEqual(bitmaps['holiday'], 'AQ==')
+        self.assertEqual(bitmaps['no_work'], 'YA==')
+        self.assertIsNone(bitmaps['leave'])
+
+    def test_availability_info_tag_overflow(self):
+        """Test availability info with more tags than fit in 64-bit flags."""
+        user_availability = calculation.UserAvailabilityInfo(self.user, self.from_date, self.until_date)
+        tags = ['whereabout_location_%s' % i for i in range(70)]
+        for tag in tags:
+            user_availability.add_tag(2, tag)
+        user_availability.add_tag(3, 'holiday')
+
+        self.assertEqual(user_availability.get_day(2).day_tags, tags)
+        self.assertEqual(user_availability.get_day(3).day_tags, ['holiday'])
+        self.assertTrue(user_availability.has_tag(2, tags[-1]))
+        self.assertEqual(user_availability.get_bitmap(tags[-1]), bytes([4]))
+
+    def test_range_totals(self):
+        """Test slicing sub-range totals from range info."""
+        user_range_info = calculation.get_user_range_info_batch([(self.user, self.from_date, self.until_date)])[0]
+        self.assertEqual(user_range_info.range_totals(), calculation.get_range_info(
+            [self.user], self.from_date, self.until_date)[self.user.id])
+
+        range_totals = user_range_info.range_totals(datetime.date(2024, 1, 2), datetime.date(2024, 1, 3))
+        self.assertEqual(range_totals['work_hours'], Decimal('16.00'))
+        self.assertEqual(range_totals['holiday_hours'], Decimal('0.00'))
+        self.assertEqual(user_range_info.range_totals(datetime.date(2024, 2, 1))['work_hours'], 0)
+
+    def test_range_info_parallel(self):
+        """Test calculating range info in shards."""
+        # A single shard is calculated in this process, as workers would not see the data of this test transaction
+        range_info = calculation.get_range_info_parallel([self.user], self.from_date, self.until_date, summary=True)
+        self.assertEqual(range_info, calculation.get_range_info([self.user], self.from_date, self.until_date,
+                                                                summary=True))
+
+        # Inside a transaction, shards are calculated in this process as well, keeping the transaction intact
+        users = [self.user, factories.UserFactory.create()]
+        range_info = calculation.get_range_info_parallel(users, self.from_date, self.until_date, summary=True,
+                                                         shard_size=1, max_workers=2)
+        self.assertTrue(connection.in_atomic_block)
+        self.assertEqual(range_info, calculation.get_range_info(users, self.from_date, self.until_date, summary=True))
+
+
+class RangeInfoParallelTests(TransactionTestCase):
+    """Parallel range info calculation tests, using committed data which worker processes can see."""
+
+    def setUp(self):
+        super().setUp()
+        company = factories.InternalCompanyFactory.create(country='BE')
+        work_schedule = factories.WorkScheduleFactory.create(monday=8, tuesday=8, wednesday=8, thursday=8, friday=8,
+                                                             saturday=0, sunday=0)
+        self.users = factories.UserFactory.create_batch(3)
+        for i, user in enumerate(self.users):
+            factories.EmploymentContractFactory.create(
+                user=user,
+                company=company,
+                work_schedule=work_schedule,
+                employment_contract_type=factories.EmploymentContractTypeFactory.create(),
+                started_at=datetime.date(2024, 1, 1 + i),
+                ended_at=None,
+            )
+        factories.HolidayFactory.create(date=datetime.date(2024, 1, 1), country='BE')
+        self.from_date = datetime.date(2024, 1, 1)
+        self.until_date = datetime.date(2024, 1, 31)
+
+    def test_range_info_parallel(self):
+        """Test calculating range info in shards in worker processes."""
+        range_info = calculation.get_range_info_parallel(self.users, self.from_date, self.until_date, daily=True,
+                                                         summary=True, serialize=True, shard_size=1, max_workers=2)
+        self.assertEqual(list(range_info), [user.id for user in self.users])
+        self.assertEqual(range_info, calculation.get_range_info(self.users, self.from_date, self.until_date,
+                                                                daily=True, summary=True, serialize=True))
+
+
+class HolidayCalendarTests(TestCase):
+    """Holiday calendar tests."""
+
+    def test_holiday_calendar(self):
+        """Test looking up holidays through the holiday calendar."""
+        holiday = factories.HolidayFactory.create(date=datetime.date(2024, 5, 1), country='BE')
+        factories.HolidayFactory.create(date=datetime.date(2024, 5, 1), country='NL')
+
+        self.assertEqual(holiday_calendar.get_holidays('BE', datetime.date(2024, 5, 1)), [holiday])
+        self.assertEqual(holiday_calendar.get_holidays('BE', datetime.date(2024, 5, 2)), [])
+        self.assertEqual(list(holiday_calendar.get_range(['BE'], datetime.date(2024, 1, 1),
+                                                         datetime.date(2025, 12, 31))['BE']),
+                         [datetime.date(2024, 5, 1)])
+
+        # Changes to holidays should invalidate the calendar
+        holiday.delete()
+        self.assertEqual(holiday_calendar.get_holidays('BE', datetime.date(2024, 5, 1)), [])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_holiday_calendar_version(self):
+        """Test reading the version of the holiday calendar once per request."""
+        with request_cache():
+            version = holiday_calendar.get_version()
+            # Versions replaced by other processes are seen by the next request
+            cache.set(holiday_calendar.VERSION_CACHE_KEY, 'other', None)
+            self.assertEqual(holiday_calendar.get_version(), version)
+            holiday_calendar.invalidate()
+            self.assertNotIn(holiday_calendar.get_version(), [version, 'other'])
+
+        with request_cache():
+            cache.set(holiday_calendar.VERSION_CACHE_KEY, 'other', None)
+            self.assertEqual(holiday_calendar.get_version(), 'other')
+
+        # The version is replaced again once the transaction is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            holiday_calendar.invalidate()
+            version = cache.get(holiday_calendar.VERSION_CACHE_KEY)
+        self.assertNotEqual(cache.get(holiday_calendar.VERSION_CACHE_KEY), version)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AvailabilityCacheTests(TestCase):
+    """Availability cache tests."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = factories.UserFactory.create()
+        factories.EmploymentContractFactory.create(
+            user=self.user,
+            company=factories.InternalCompanyFactory.create(country='BE'),
+            work_schedule=factories.WorkScheduleFactory.create(monday=8, tuesday=8, wednesday=8, thursday=8,
+                                                               friday=8, saturday=0, sunday=0),
+            employment_contract_type=factories.EmploymentContractTypeFactory.create(),
+            started_at=datetime.date(2024, 1, 1),
+            ended_at=None,
+        )
+        self.from_date = datetime.date(2024, 1, 25)
+        self.until_date = datetime.date(2024, 2, 5)
+
+    def test_availability_cache(self):
+        """Test serving availability from the availability cache."""
+        availability = availability_cache.get_availability([self.user], self.from_date, self.until_date)
+        self.assertEqual(availability, calculation.get_availability([self.user], self.from_date, self.until_date,
+                                                                    serialize=True))
+        self.assertEqual(len(availability[str(self.user.id)]), 12)
+
+        # Cached months should be served without querying
+        with self.assertNumQueries(0):
+            self.assertEqual(availability_cache.get_availability([self.user], self.from_date, self.until_date),
+                             availability)
+
+        # Changes to holidays should invalidate the cache
+        factories.HolidayFactory.create(date=datetime.date(2024, 2, 1), country='BE')
+        availability = availability_cache.get_availability([self.user], self.from_date, self.until_date)
+        self.assertEqual(len(availability[str(self.user.id)]['2024-02-01']['holidays']), 1)
+
+        # Changes to whereabouts should invalidate the cache of their user
+        timesheet = factories.OpenTimesheetFactory.create(user=self.user, year=2024, month=1)
+        factories.WhereaboutFactory.create(timesheet=timesheet,
+                                           starts_at=datetime.datetime(2024, 1, 26, 9, tzinfo=utc),
+                                           ends_at=datetime.datetime(2024, 1, 26, 17, tzinfo=utc))
+        availability = availability_cache.get_availability([self.user], self.from_date, self.until_date)
+        self.assertEqual(len(availability[str(self.user.id)]['2024-01-26']['whereabouts']), 1)
+
+
+@override_settings(DEBUG=True)
+class BenchmarkTests(TestCase):
+    """Calculation benchmark tests."""
+
+    def test_run_benchmark(self):
+        """Test benchmarking calculation functions on a generated dataset."""
+        user_count = auth_models.User.objects.count()
+        results = benchmark.run_benchmark(user_counts=[2], range_lengths=[31], repeat=2)
+
+        self.assertEqual([x['function'] for x in results['results']], list(benchmark.FUNCTIONS))
+        for result in results['results']:
+            self.assertEqual((result['scale'], result['users'], result['days']), ('small', 2, 31))
+            self.assertGreater(result['queries'], 0)
+            self.assertLessEqual(result['min'], result['median'])
+
+        # Generated data should be rolled back
+        self.assertEqual(auth_models.User.objects.count(), user_count)
+
+    def test_compare_results(self):
+        """Test comparing benchmark results against a baseline."""
+        def get_results(duration, queries):
+            return {'results': [{'scale': 'small', 'users': 1, 'days': 7, 'function': 'get_range_info',
+                                 'min': duration, 'queries': queries}]}
+
+        baseline = get_results(1.0, 10)
+        self.assertFalse(benchmark.compare_results(get_results(1.2, 10), baseline)[0]['regression'])
+        self.assertTrue(benchmark.compare_results(get_results(1.3, 10), baseline)[0]['regression'])
+        self.assertTrue(benchmark.compare_results(get_results(0.5, 11), baseline)[0]['regression'])
+        self.assertEqual(benchmark.compare_results(get_results(1.0, 10), {'results': []}), [])
+
+
+@override_settings(DEBUG=True)
+class BulkDBPopulatorTests(TestCase):
+    """Bulk test data generator tests."""
+
+    def populate(self, seed):
+        """Populate a small dataset, returning the performances of the generated users."""
+        user_ids = list(auth_models.User.objects.values_list('id', flat=True))
+        BulkDBPopulator(users=3, years=1, performances=300, seed=seed, chunk_size=50).execute()
+
+        users = auth_models.User.objects.exclude(id__in=user_ids).order_by('id')
+        return [(i, performance.date, performance.duration) for i, user in enumerate(users)
+                for performance in models.ActivityPerformance.objects.filter(timesheet__user=user).order_by('id')]
+
+    def test_populate(self):
+        """Test populating the database in bulk."""
+        performances = self.populate(925)
+        self.assertGreater(len(performances), 0)
+
+        # Rows of models using multi-table inheritance should be stored in every table
+        self.assertEqual(models.Performance.objects.count(), models.ActivityPerformance.objects.count())
+        for performance in models.Performance.objects.all():
+            self.assertIsInstance(performance, models.ActivityPerformance)
+        self.assertEqual(models.UserInfo.objects.count(), auth_models.User.objects.count())
+
+        # The same seed should result in the same data
+        self.assertEqual(self.populate(925), performances)
+
+
+class RequestCacheTests(SimpleTestCase):
+    """Request cache tests."""
+
+    def test_memoize(self):
+        """Test memoizing values in the active request cache."""
+        calls = []
+
+        def func():
+            calls.append(None)
+            return len(calls)
+
+        # Without an active request cache, values are calculated every time
+        self.assertEqual(memoize('key', func), 1)
+        self.assertEqual(memoize('key', func), 2)
+
+        with request_cache() as cache:
+            self.assertEqual(memoize('key', func), 3)
+            self.assertEqual(memoize('key', func), 3)
+            self.assertEqual(cache.get_stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+            clear_request_cache()
+            self.assertEqual(memoize('key', func), 4)
+
+        self.assertIsNone(get_request_cache())
+
+    def test_invalidate(self):
+        """Test forgetting memoized values by key prefix."""
+        with request_cache() as cache:
+            memoize(('a', 1), lambda: 1)
+            memoize(('a', 2), lambda: 2)
+            memoize(('ab', 1), lambda: 3)
+            memoize('a', lambda: 4)
+
+            invalidate_request_cache('a')
+            self.assertEqual(cache.get_stats()['size'], 1)
+            self.assertEqual(memoize(('ab', 1), lambda: None), 3)
+            self.assertEqual(memoize(('a', 1), lambda: 5), 5)
+
+        # Without an active request cache, there is nothing to invalidate
+        invalidate_request_cache('a')
@@ -1,7 +1,7 @@
 """Utils."""
-import copy
 import datetime
 import os
+from bisect import bisect_right
 from calendar import monthrange
 from importlib import import_module
 
@@ -10,6 +10,7 @@ from django.core.mail import send_mail as base_send_mail
 from django.db.models import Q
 from django.template.loader import render_to_string
 from import_export.widgets import ManyToManyWidget
+from rest_framework.utils.encoders import JSONEncoder
 
 DEFAULT_DJANGO_ENVIRONMENT = 'dev'
 
@@ -63,12 +64,8 @@ def month_date_range(year, month):
 
 def dates_in_range(from_date, until_date):
     """Get all dates for the given date range."""
-    dates = []
-    current_date = copy.deepcopy(from_date)
-    while current_date.strftime('%Y%m%d') <= until_date.strftime('%Y%m%d'):
-        dates.append(copy.deepcopy(current_date))
-        current_date += relativedelta(days=1)
-    return dates
+    day_count = until_date.toordinal() - from_date.toordinal() + 1
+    return [from_date + datetime.timedelta(days=day) for day in range(max(0, day_count))]
 
 
 def hours_to_days(hours, rounded=True):
@@ -143,9 +140,115 @@ class IntelligentManyToManyWidget(ManyToManyWidget):
 
 
 class AvailabilityInfo(object):
-    def __init__(self):
-        self.day_tags = []
-        self.leave_dates = []
+    __slots__ = ('day_tags', 'leave_dates')
+
+    def __init__(self, day_tags=None, leave_dates=None):
+        self.day_tags = day_tags if day_tags is not None else []
+        self.leave_dates = leave_dates if leave_dates is not None else []
 
     def add_tag(self, tag):
         self.day_tags.append(tag)
+
+
+class AvailabilityTags(object):
+    """
+    Registry of availability tags and the bits representing them in availability flags.
+
+    The base tags always have the same bits, other tags (such as whereabout locations) get the next free bit when
+    they are first registered. There is no limit on the amount of tags, so flags may not fit in 64 bits.
+    """
+
+    BASE_TAGS = ('no_work', 'holiday', 'sickness', 'sickness_pending', 'leave', 'leave_pending')
+
+    def __init__(self):
+        self.tags = list(self.BASE_TAGS)
+        self.bits = {tag: 1 << i for i, tag in enumerate(self.tags)}
+
+    def get_bit(self, tag):
+        """Get the bit for the given tag, registering it if needed."""
+        bit = self.bits.get(tag)
+        if bit is None:
+            bit = self.bits[tag] = 1 << len(self.tags)
+            self.tags.append(tag)
+        return bit
+
+    def get_tags(self, flags):
+        """Get the tags set in the given flags, in the order of their bits."""
+        return [tag for i, tag in enumerate(self.tags) if flags >> i & 1]
+
+
+class IntervalIndex(object):
+    """
+    Index of items which are active over an inclusive date interval.
+
+    The interval boundaries of all items are sorted once, after which the items active on any given date are found
+    with a binary search. Items without an end date stay active indefinitely. Active items keep the order in which
+    they were passed in.
+    """
+
+    def __init__(self, items, start_attr='starts_at', end_attr='ends_at'):
+        items = list(items)
+        boundaries = set()
+        for item in items:
+            boundaries.add(getattr(item, start_attr))
+            if getattr(item, end_attr):
+                boundaries.add(getattr(item, end_attr) + datetime.timedelta(days=1))
+
+        # Every boundary starts a segment during which the set of active items stays the same
+        self.boundaries = sorted(boundaries)
+        self.segments = [tuple(item for item in items
+                               if (getattr(item, start_attr) <= boundary) and
+                               ((not getattr(item, end_attr)) or (getattr(item, end_attr) >= boundary)))
+                         for boundary in self.boundaries]
+
+    def get(self, date):
+        """Get the items active on the given date."""
+        index = bisect_right(self.boundaries, date) - 1
+        return self.segments[index] if index >= 0 else ()
+
+    def first(self, date):
+        """Get the first item active on the given date, if any."""
+        items = self.get(date)
+        return items[0] if items else None
+
+    def iter_segments(self, from_date, until_date):
+        """Iterate over (from, until, items) segments covering the given date range, in order."""
+        current_date = from_date
+        index = bisect_right(self.boundaries, from_date) - 1
+        while current_date <= until_date:
+            next_index = index + 1
+            segment_until = (min(until_date, self.boundaries[next_index] - datetime.timedelta(days=1))
+                             if next_index < len(self.boundaries) else until_date)
+            yield current_date, segment_until, (self.segments[index] if index >= 0 else ())
+            current_date = segment_until + datetime.timedelta(days=1)
+            index = next_index
+
+
+class StreamingJSONObject(object):
+    """A JSON object of which the (key, value) pairs are produced lazily, to be encoded by iter_json."""
+
+    def __init__(self, items):
+        self.items = items
+
+
+def iter_json(data, encoder=None):
+    """
+    Encode data as JSON, yielding the result in chunks.
+
+    Streaming JSON objects are consumed one pair at a time, as are dicts containing them.
+    Everything else is encoded at once, the same way the JSON renderer of the API would.
+    """
+    encoder = encoder if encoder is not None else JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    if isinstance(data, dict) and any([isinstance(x, StreamingJSONObject) for x in data.values()]):
+        data = StreamingJSONObject(data.items())
+
+    if not isinstance(data, StreamingJSONObject):
+        yield encoder.encode(data)
+        return
+
+    yield '{'
+    for i, (key, value) in enumerate(data.items):
+        yield '%s%s:' % (',' if i else '', encoder.encode(str(key)))
+        yield from iter_json(value, encoder)
+    yield '}'
@@ -32,6 +32,8 @@ from ninetofiver import models
 from ninetofiver import tables, calculation, pagination
 from ninetofiver import redmine
 from ninetofiver.models import ContractLog, Contract
+from ninetofiver.holidays import holiday_calendar
+from ninetofiver.request_cache import memoize
 from ninetofiver.utils import month_date_range, dates_in_range, hours_to_days
 from .forms import LeaveDatePrefillForm
 
@@ -242,23 +244,22 @@ def admin_leave_bulk_edit_dates(request, leave_pk):
                     employment_contract = models.EmploymentContract.objects.filter(
                         Q(user=leave.user, started_at__lte=current_date) &
                         (Q(ended_at__isnull=True) | Q(ended_at__gte=current_date))
-                    ).first()
+                    ).select_related('company', 'work_schedule').first()
                     work_schedule = employment_contract.work_schedule if employment_contract else None
 
                 # Determine amount of hours to work on this day based on work schedule
                 work_hours = 0.00
                 if work_schedule:
-                    work_hours = float(getattr(work_schedule, current_date.strftime('%A').lower(), Decimal(0.00)))
+                    work_hours = float(work_schedule.weekday_hours[current_date.weekday()])
 
                 # Determine existence of holidays on this day based on work schedule
-                holiday = None
+                holidays = []
                 if employment_contract:
-                    holiday = models.Holiday.objects.filter(date=current_date,
-                                                            country=employment_contract.company.country).first()
+                    holidays = holiday_calendar.get_holidays(employment_contract.company.country, current_date)
 
                 # If we have to work a certain amount of hours on this day, and there is no holiday on that day,
                 # add a leave date pair for that amount of hours
-                if (work_hours > 0.0) and (not holiday):
+                if (work_hours > 0.0) and (not holidays):
                     # Ensure the leave starts when the working day does
                     pair_starts_at = current_dt.replace(hour=settings.DEFAULT_WORKING_DAY_STARTING_HOUR, minute=0,
                                                         second=1)
@@ -417,12 +418,12 @@ def admin_report_timesheet_contract_overview_view(request):
 
     contracts = contracts.values_list('id', flat=True)
 
-    data = []
-    for timesheet in timesheets:
-        date_range = timesheet.get_date_range()
-        range_info = calculation.get_range_info([timesheet.user], date_range[0], date_range[1], summary=True)
+    timesheets = list(timesheets)
+    range_infos = calculation.get_timesheet_range_info_batch(timesheets, summary=True)
 
-        for contract_performance in range_info[timesheet.user.id]['summary']['performances']:
+    data = []
+    for timesheet, range_info in zip(timesheets, range_infos):
+        for contract_performance in range_info['summary']['performances']:
             if (not contracts) or (contract_performance['contract'].id in contracts):
                 data.append({
                     'contract': contract_performance['contract'],
@@ -523,13 +524,18 @@ def admin_report_timesheet_overview_view(request):
                                          user__employmentcontract__started_at__lte=period_end,
                                          user__employmentcontract__company__id=company))
 
+    # Range info for the full month and up until today are both taken from a single range covering them
+    timesheets = list(timesheets)
+    today = datetime.now().date()
+    date_ranges = [timesheet.get_date_range() for timesheet in timesheets]
+    user_range_infos = calculation.get_user_range_info_batch(
+        [(timesheet.user, date_range[0], max(date_range[1], today))
+         for timesheet, date_range in zip(timesheets, date_ranges)])
+
     data = []
-    for timesheet in timesheets:
-        date_range = timesheet.get_date_range()
-        range_info = calculation.get_range_info([timesheet.user], date_range[0], date_range[1])
-        range_info = range_info[timesheet.user.id]
-        range_info_to_day = calculation.get_range_info([timesheet.user], date_range[0], datetime.now().date())
-        range_info_to_day = range_info_to_day[timesheet.user.id]
+    for timesheet, date_range, user_range_info in zip(timesheets, date_ranges, user_range_infos):
+        range_info = user_range_info.range_totals(date_range[0], date_range[1])
+        range_info_to_day = user_range_info.range_totals(date_range[0], today)
 
         data.append({
             'timesheet': timesheet,
@@ -568,7 +574,7 @@ def admin_report_user_range_info_view(request):
     data = []
 
     if user and from_date and until_date and (until_date >= from_date):
-        range_info = calculation.get_range_info([user], from_date, until_date, daily=True)[user.id]
+        range_info = calculation.get_range_info_batch([(user, from_date, until_date)], daily=True)[0]
 
         for day in sorted(range_info['details'].keys()):
             day_detail = range_info['details'][day]
@@ -611,7 +617,7 @@ def admin_report_user_leave_group_overview_view(request):
     data = []
 
     if from_date and until_date and (until_date >= from_date):
-        leave_types = models.LeaveType.objects.all()
+        leave_types = memoize('leave_types', lambda: list(models.LeaveType.objects.all()))
 
         # Grab leave dates, sort them in a dict per user, then by leave type while summing them
         leave_dates = models.LeaveDate.objects.filter(leave__status=models.STATUS_APPROVED,starts_at__gte=from_date,ends_at__lte=until_date.replace(day=until_date.day+1))
@@ -687,7 +693,7 @@ def admin_report_user_leave_overview_view(request):
             timesheet_data.setdefault(timesheet.year, {})[timesheet.month] = timesheet
 
         # Grab leave types, index them by ID
-        leave_types = models.LeaveType.objects.all()
+        leave_types = memoize('leave_types', lambda: list(models.LeaveType.objects.all()))
 
         # Grab leave dates, index them by year, then month, then leave type ID
         leave_dates = fltr.qs.filter().select_related('leave', 'leave__leave_type')
@@ -752,10 +758,10 @@ def admin_report_user_work_ratio_by_user_view(request):
 
         timesheets = fltr.qs.select_related('user').order_by('year', 'month')
 
-        for timesheet in timesheets:
-            date_range = timesheet.get_date_range()
-            range_info = calculation.get_range_info([timesheet.user], date_range[0], date_range[1], summary=True)
-            range_info = range_info[timesheet.user.id]
+        timesheets = list(timesheets)
+        range_infos = calculation.get_timesheet_range_info_batch(timesheets, summary=True)
+
+        for timesheet, range_info in zip(timesheets, range_infos):
 
             data.append({
                 'year': timesheet.year,
@@ -795,10 +801,10 @@ def admin_report_user_work_ratio_by_month_view(request):
 
     if fltr.data.get('month', None) and fltr.data.get('year', None):
 
-        for timesheet in fltr.qs.select_related('user'):
-            date_range = timesheet.get_date_range()
-            range_info = calculation.get_range_info([timesheet.user], date_range[0], date_range[1], summary=True)
-            range_info = range_info[timesheet.user.id]
+        timesheets = list(fltr.qs.select_related('user'))
+        range_infos = calculation.get_timesheet_range_info_batch(timesheets, summary=True)
+
+        for timesheet, range_info in zip(timesheets, range_infos):
 
             data.append({
                 'user':           timesheet.user,
@@ -838,10 +844,10 @@ def admin_report_user_work_ratio_overview_view(request):
 
         timesheets = fltr.qs.select_related('user').order_by('year', 'month')
 
-        for timesheet in timesheets:
-            date_range = timesheet.get_date_range()
-            range_info = calculation.get_range_info([timesheet.user], date_range[0], date_range[1], summary=True)
-            range_info = range_info[timesheet.user.id]
+        timesheets = list(timesheets)
+        range_infos = calculation.get_timesheet_range_info_batch(timesheets, summary=True)
+
+        for timesheet, range_info in zip(timesheets, range_infos):
 
             total_hours = range_info['performed_hours'] + range_info['leave_hours']
             leave_hours = range_info['leave_hours']
@@ -898,41 +904,16 @@ class AvailabilityView(View):
     def get_active_users(self):
         return auth_models.User.objects.filter(is_active=True).distinct()
 
-    def fetch_contract_user_work_schedules(self, users, from_date, until_date):
-        contract_user_work_schedules = (models.ContractUserWorkSchedule.objects
-                .filter(contract_user__user__in=users)
-                .filter(Q(ends_at__isnull=True, starts_at__lte=until_date) |
-                        Q(ends_at__isnull=False, starts_at__lte=until_date,
-                          ends_at__gte=from_date))
-                .select_related('contract_user', 'contract_user__user',
-                                'contract_user__contract_role', 'contract_user__contract',
-                                'contract_user__contract__customer'))
-
-        # Index contract user work schedules by user
-        contract_user_work_schedule_data = {}
-        for contract_user_work_schedule in contract_user_work_schedules:
-            (contract_user_work_schedule_data
-             .setdefault(contract_user_work_schedule.contract_user.user.id, [])
-             .append(contract_user_work_schedule))
-
-        return contract_user_work_schedule_data
-
-    def fetch_employment_contracts(self, from_date, until_date, users):
-
-        employment_contracts = (models.EmploymentContract.objects
-                                .filter(
-            (Q(ended_at__isnull=True) & Q(started_at__lte=until_date)) |
-            (Q(started_at__lte=until_date) & Q(ended_at__gte=from_date)),
-            user__in=users)
-                                .order_by('started_at')
-                                .select_related('user', 'company', 'work_schedule'))
-        # Index employment contracts by user ID
-        employment_contract_data = {}
-        for employment_contract in employment_contracts:
-            (employment_contract_data
-             .setdefault(employment_contract.user.id, [])
-             .append(employment_contract))
-        return employment_contract_data
+    def get_calendar_context(self, users, from_date, until_date):
+        return calculation.CalendarContext(users, from_date, until_date)
+
+    def fetch_contract_user_work_schedules(self, users, from_date, until_date, context=None):
+        context = context if context is not None else self.get_calendar_context(users, from_date, until_date)
+        return context.contract_user_work_schedule_data
+
+    def fetch_employment_contracts(self, from_date, until_date, users, context=None):
+        context = context if context is not None else self.get_calendar_context(users, from_date, until_date)
+        return context.employment_contract_data
 
 
 class ResourceAvailabilityOverviewView(AvailabilityView):
@@ -963,15 +944,11 @@ class ResourceAvailabilityOverviewView(AvailabilityView):
 
         if users and from_date and until_date and (until_date >= from_date):
             dates = dates_in_range(from_date, until_date)
-
-            # Fetch contract user work schedules
-            contract_user_work_schedule_data = self.fetch_contract_user_work_schedules(users, from_date, until_date)
-
-            # Fetch employment contracts
-            employment_contract_data = self.fetch_employment_contracts(from_date, until_date, users)
+            calendar_context = self.get_calendar_context(users, from_date, until_date)
 
             # Fetch availability
-            availability = calculation.get_availability_info(users, from_date, until_date)
+            availability = calculation.get_user_availability_infos(users, from_date, until_date,
+                                                                   context=calendar_context)
 
             # Iterate over users, days to create daily user data
             for user in users:
@@ -980,40 +957,31 @@ class ResourceAvailabilityOverviewView(AvailabilityView):
                     'days': {},
                 }
                 data.append(user_data)
+                user_availability = availability[user.id]
 
-                for current_date in dates:
+                for day, current_date in enumerate(dates):
                     date_str = str(current_date)
                     user_day_data = user_data['days'][date_str] = {}
 
-                    day_availability = availability[str(user.id)][date_str].day_tags
+                    day_availability = user_availability.get_day(day).day_tags
                     day_contract_user_work_schedules = []
                     day_scheduled_hours = Decimal('0.00')
                     day_work_hours = Decimal('0.00')
 
                     # Get contract user work schedules for this day
                     # This allows us to determine the scheduled hours for this user
-                    for contract_user_work_schedule in contract_user_work_schedule_data.get(user.id, []):
-                        if (contract_user_work_schedule.starts_at <= current_date) and \
-                                ((not contract_user_work_schedule.ends_at) or
-                                 (contract_user_work_schedule.ends_at >= current_date)):
-                            day_contract_user_work_schedules.append(contract_user_work_schedule)
-                            day_scheduled_hours += getattr(contract_user_work_schedule,
-                                                           current_date.strftime('%A').lower(), Decimal('0.00'))
+                    for contract_user_work_schedule in calendar_context.get_contract_user_work_schedules(
+                            user.id, current_date):
+                        day_contract_user_work_schedules.append(contract_user_work_schedule)
+                        day_scheduled_hours += contract_user_work_schedule.weekday_hours[current_date.weekday()]
 
                     # Get employment contract for this day
                     # This allows us to determine the required hours for this user
-                    employment_contract = None
-                    try:
-                        for ec in employment_contract_data[user.id]:
-                            if (ec.started_at <= current_date) and ((not ec.ended_at) or (ec.ended_at >= current_date)):
-                                employment_contract = ec
-                                break
-                    except KeyError:
-                        pass
+                    employment_contract = calendar_context.get_employment_contract(user.id, current_date)
 
                     work_schedule = employment_contract.work_schedule if employment_contract else None
                     if work_schedule:
-                        day_work_hours = getattr(work_schedule, current_date.strftime('%A').lower(), Decimal('0.00'))
+                        day_work_hours = work_schedule.weekday_hours[current_date.weekday()]
 
                     user_day_data['availability'] = day_availability
                     user_day_data['contract_user_work_schedules'] = day_contract_user_work_schedules
@@ -1076,15 +1044,11 @@ class TimesheetMonthlyOverviewView(AvailabilityView):
 
         if users and from_date and until_date and (until_date >= from_date):
             dates = dates_in_range(from_date, until_date)
+            calendar_context = self.get_calendar_context(users, from_date, until_date)
 
             # Fetch availability
-            availability = calculation.get_availability_info(users, from_date, until_date)
-
-            # Fetch contract user work schedules
-            contract_user_work_schedule_data = self.fetch_contract_user_work_schedules(users, from_date, until_date)
-
-            # Fetch employment contracts
-            employment_contract_data = self.fetch_employment_contracts(from_date, until_date, users)
+            availability = calculation.get_user_availability_infos(users, from_date, until_date,
+                                                                   context=calendar_context)
 
             # Iterate over users, days to create daily user data
             for user in users:
@@ -1092,25 +1056,23 @@ class TimesheetMonthlyOverviewView(AvailabilityView):
                     'user': user,
                     'days': {},
                 }
+                user_availability = availability[user.id]
 
-                for current_date in dates:
+                for day, current_date in enumerate(dates):
                     day_contract_user_work_schedules = []
                     day_scheduled_hours = Decimal('0.00')
 
                     # Get contract user work schedules for this day
                     # This allows us to determine the scheduled hours for this user
-                    for contract_user_work_schedule in contract_user_work_schedule_data.get(user.id, []):
-                        if (contract_user_work_schedule.starts_at <= current_date) and \
-                                ((not contract_user_work_schedule.ends_at) or
-                                 (contract_user_work_schedule.ends_at >= current_date)):
-                            day_contract_user_work_schedules.append(contract_user_work_schedule)
-                            day_scheduled_hours += getattr(contract_user_work_schedule,
-                                                           current_date.strftime('%A').lower(), Decimal('0.00'))
+                    for contract_user_work_schedule in calendar_context.get_contract_user_work_schedules(
+                            user.id, current_date):
+                        day_contract_user_work_schedules.append(contract_user_work_schedule)
+                        day_scheduled_hours += contract_user_work_schedule.weekday_hours[current_date.weekday()]
 
                     user_day_data = {}
 
                     date_str = str(current_date)
-                    day_availability = availability[str(user.id)][date_str]
+                    day_availability = user_availability.get_day(day)
                     day_availability_tags = day_availability.day_tags
                     user_day_data['availability'] = day_availability_tags
                     user_day_data['leave_dates'] = day_availability.leave_dates
@@ -1120,19 +1082,12 @@ class TimesheetMonthlyOverviewView(AvailabilityView):
 
                     # Get employment contract for this day
                     # This allows us to determine the required hours for this user
-                    employment_contract = None
-                    try:
-                        for ec in employment_contract_data[user.id]:
-                            if (ec.started_at <= current_date) and ((not ec.ended_at) or (ec.ended_at >= current_date)):
-                                employment_contract = ec
-                                break
-                    except KeyError:
-                        pass
+                    employment_contract = calendar_context.get_employment_contract(user.id, current_date)
 
                     work_schedule = employment_contract.work_schedule if employment_contract else None
                     day_work_hours = Decimal('0.00')
                     if work_schedule:
-                        day_work_hours = getattr(work_schedule, current_date.strftime('%A').lower(), Decimal('0.00'))
+                        day_work_hours = work_schedule.weekday_hours[current_date.weekday()]
                     user_day_data['work_hours'] = day_work_hours
                     user_day_data['enough_hours'] = day_scheduled_hours >= day_work_hours
 
@@ -1525,49 +1480,29 @@ def admin_report_user_overtime_overview_view(request):
     until_date = parser.parse(request.GET.get('until_date', None)).date() if request.GET.get('until_date') else None
     data = []
 
-    overtime_leave_type_ids = list(models.LeaveType.objects.filter(overtime=True).values_list('id', flat=True))
+    overtime_leave_type_ids = memoize(
+        'overtime_leave_type_ids',
+        lambda: list(models.LeaveType.objects.filter(overtime=True).values_list('id', flat=True)))
 
     if user and from_date and until_date and (until_date >= from_date) and overtime_leave_type_ids:
-        # Grab leave dates, index them by year, then month, then leave type ID
-        leave_dates = fltr.qs.filter(leave__leave_type__id__in=overtime_leave_type_ids).select_related('leave')
-        leave_date_data = {}
-        for leave_date in leave_dates:
-            (leave_date_data
-                .setdefault(leave_date.starts_at.year, {})
-                .setdefault(leave_date.starts_at.month, [])
-                .append(leave_date))
-
-        # Iterate over years, months to create monthly data
-        current_date = copy.deepcopy(from_date)
+        # Monthly overtime is read from the overtime checkpoints of the user
+        # The balance shown in the report starts at the first month of the period
         remaining_overtime_hours = Decimal('0.00')
 
-        while current_date.strftime('%Y%m') <= until_date.strftime('%Y%m'):
-            current_date_range = month_date_range(current_date.year, current_date.month)
-            month_range_info = calculation.get_range_info([user], from_date=current_date_range[0],
-                                                          until_date=current_date_range[1])
-
-            overtime_hours = month_range_info[user.id]['overtime_hours']
-            remaining_overtime_hours += overtime_hours
-
-            remaining_hours = month_range_info[user.id]['remaining_hours']
-            remaining_overtime_hours -= remaining_hours
-
-            used_overtime_hours = sum([Decimal(str(round((x.ends_at - x.starts_at).total_seconds() / 3600, 2)))
-                                      for x in leave_date_data.get(current_date.year, {}).get(current_date.month, {})])
-            remaining_overtime_hours -= used_overtime_hours
+        for checkpoint in calculation.get_overtime_checkpoints(user, from_date, until_date):
+            remaining_overtime_hours += (checkpoint.overtime_hours - checkpoint.remaining_hours -
+                                         checkpoint.used_overtime_hours)
 
             data.append({
-                'year': current_date.year,
-                'month': current_date.month,
+                'year': checkpoint.year,
+                'month': checkpoint.month,
                 'user': user,
-                'overtime_hours': overtime_hours,
-                'remaining_hours': remaining_hours,
-                'used_overtime_hours': used_overtime_hours,
+                'overtime_hours': checkpoint.overtime_hours,
+                'remaining_hours': checkpoint.remaining_hours,
+                'used_overtime_hours': checkpoint.used_overtime_hours,
                 'remaining_overtime_hours': remaining_overtime_hours,
             })
 
-            current_date += relativedelta(months=1)
-
     config = RequestConfig(request, paginate=False)
     table = tables.UserOvertimeOverviewTable(data)
     config.configure(table)
@@ -1854,39 +1789,10 @@ def admin_report_internal_availability_overview_view(request):
         pass
 
     if users and date:
+        calendar_context = calculation.CalendarContext(users, date, date)
+
         # Fetch availability
-        availability = calculation.get_internal_availability_info(users, date, date)
-
-        # # Fetch contract user work schedules
-        contract_user_work_schedules = (models.ContractUserWorkSchedule.objects
-                                        .filter(contract_user__user__in=users)
-                                        .filter(Q(ends_at__isnull=True, starts_at__lte=date) |
-                                                Q(ends_at__isnull=False, starts_at__lte=date,
-                                                  ends_at__gte=date))
-                                        .select_related('contract_user', 'contract_user__user',
-                                                        'contract_user__contract_role', 'contract_user__contract',
-                                                        'contract_user__contract__customer'))
-        # Index contract user work schedules by user
-        contract_user_work_schedule_data = {}
-        for contract_user_work_schedule in contract_user_work_schedules:
-            (contract_user_work_schedule_data
-                .setdefault(contract_user_work_schedule.contract_user.user.id, [])
-                .append(contract_user_work_schedule))
-
-        # Fetch employment contracts
-        employment_contracts = (models.EmploymentContract.objects
-                                .filter(
-                                    (Q(ended_at__isnull=True) & Q(started_at__lte=date)) |
-                                    (Q(started_at__lte=date) & Q(ended_at__gte=date)),
-                                    user__in=users)
-                                .order_by('started_at')
-                                .select_related('user', 'company', 'work_schedule'))
-        # Index employment contracts by user ID
-        employment_contract_data = {}
-        for employment_contract in employment_contracts:
-            (employment_contract_data
-                .setdefault(employment_contract.user.id, [])
-                .append(employment_contract))
+        availability = calculation.get_internal_availability_info(users, date, date, context=calendar_context)
 
         # Iterate over users, days to create daily user data
         for user in users:
@@ -1913,28 +1819,17 @@ def admin_report_internal_availability_overview_view(request):
 
             # Get contract user work schedules for this day
             # This allows us to determine the scheduled hours for this user
-            for contract_user_work_schedule in contract_user_work_schedule_data.get(user.id, []):
-                if (contract_user_work_schedule.starts_at <= date) and \
-                        ((not contract_user_work_schedule.ends_at) or
-                            (contract_user_work_schedule.ends_at >= date)):
-                    day_contract_user_work_schedules.append(contract_user_work_schedule)
-                    day_scheduled_hours += getattr(contract_user_work_schedule,
-                                                   date.strftime('%A').lower(), Decimal('0.00'))
+            for contract_user_work_schedule in calendar_context.get_contract_user_work_schedules(user.id, date):
+                day_contract_user_work_schedules.append(contract_user_work_schedule)
+                day_scheduled_hours += contract_user_work_schedule.weekday_hours[date.weekday()]
 
             # Get employment contract for this day
             # This allows us to determine the required hours for this user
-            employment_contract = None
-            try:
-                for ec in employment_contract_data[user.id]:
-                    if (ec.started_at <= date) and ((not ec.ended_at) or (ec.ended_at >= date)):
-                        employment_contract = ec
-                        break
-            except KeyError:
-                pass
+            employment_contract = calendar_context.get_employment_contract(user.id, date)
 
             work_schedule = employment_contract.work_schedule if employment_contract else None
             if work_schedule:
-                day_work_hours = getattr(work_schedule, date.strftime('%A').lower(), Decimal('0.00'))
+                day_work_hours = work_schedule.weekday_hours[date.weekday()]
 
             user_day_data['availability'] = day_availability
             user_day_data['contract_user_work_schedules'] = day_contract_user_work_schedules